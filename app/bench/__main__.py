@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pytz
+import requests
+
+from app.bench.fixtures import FixtureStore, ReplayServer, install_recorder, install_replay
+from app.bench.load import compare, environment, peak_rss_bytes, run_scenario
+
+try:
+    import freezegun
+except ImportError:
+    freezegun = None
+
+# Budgets and client limits would measure the limiter, not the service
+REPLAY_ENV = {
+    'RATE_LIMIT_PER_MINUTE': '0',
+    'UPSTREAM_STATIONS_PER_MINUTE': '0',
+    'UPSTREAM_BUOY_PER_MINUTE': '0',
+    'UPSTREAM_TIDE_PER_MINUTE': '0',
+    'UPSTREAM_GRIB_PER_MINUTE': '0'
+}
+
+# No background spot report builds competing with the measured requests
+BACKGROUND_ENV = {
+    'SPOT_REFRESH_INTERVAL': '0'
+}
+
+# Every request goes upstream (to the replay server) instead of the cache
+COLD_ENV = {
+    'CACHE_TIMEOUT': '0',
+    'BUOY_CACHE_TIMEOUT': '0',
+    'TIDE_CACHE_TIMEOUT': '0',
+    'CACHE_STALE_TIMEOUT': '0'
+}
+
+
+def scenarios(args):
+    return {
+        'buoys_nearby': f'/api/buoys/nearby/{args.lat}/{args.lon}',
+        'buoy_data': f'/api/buoys/{args.station}/data',
+        'forecast': f'/api/forecast/{args.lat}/{args.lon}',
+        'tides_location': f'/api/tides/location?lat={args.lat}&lon={args.lon}'
+    }
+
+
+def serve(args):
+    # Runs in the child process: the API on a local port, its upstream calls recorded or replayed
+    store = FixtureStore(args.fixtures)
+    replay = None
+    if args.mode == 'record':
+        install_recorder(store)
+    else:
+        replay = ReplayServer(store).start()
+        install_replay(replay.base_url)
+        # Pin the clock to the recording so model runs and tide windows line up with the fixtures
+        if freezegun is not None and store.recorded_at:
+            freezegun.freeze_time(store.recorded_at, tick=True).start()
+        elif store.recorded_at:
+            print('freezegun is not installed; forecast and tide windows will not match the recording')
+
+    from flask import jsonify
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app.run import create_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app = create_app()
+
+    @app.route('/bench/replay')
+    def replay_stats():
+        return jsonify({
+            'hits': replay.hits if replay else None,
+            'misses': sorted(set(replay.misses)) if replay else []
+        })
+
+    make_server('127.0.0.1', args.port, app, threaded=True, request_handler=QuietHandler).serve_forever()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(args, mode, env):
+    port = _free_port()
+    scratch = tempfile.mkdtemp(prefix='surfpy-bench-')
+    env = dict(
+        os.environ,
+        GRIB_CACHE_DIR=os.path.join(scratch, 'grib'),
+        GRID_STORE_DIR=os.path.join(scratch, 'grids'),
+        STATION_SNAPSHOT_DIR=os.path.join(scratch, 'stations'),
+        HARMONICS_DIR=os.path.join(scratch, 'harmonics'),
+        BUOY_ARCHIVE_PATH=os.path.join(scratch, 'buoys.sqlite3'),
+        **BACKGROUND_ENV,
+        **env
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'app.bench', 'serve', '--fixtures', args.fixtures, '--mode', mode, '--port', str(port)],
+        env=env
+    )
+    base_url = f'http://127.0.0.1:{port}'
+
+    # Ready once both station catalogs are loaded, so the first scenario does not pay for them
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Benchmark server exited during startup')
+        try:
+            stations = requests.get(base_url + '/api/status', timeout=5).json()['stations']
+            if all(catalog['loaded'] for catalog in stations.values()):
+                return process, base_url
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError('Benchmark server did not become ready')
+
+
+def _stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def record(args):
+    process, base_url = _start_server(args, 'record', {})
+    try:
+        for name, path in scenarios(args).items():
+            response = requests.get(base_url + path, timeout=args.timeout)
+            print(f'{name:16} {response.status_code} {path}')
+    finally:
+        _stop_server(process)
+
+    store = FixtureStore(args.fixtures)
+    print(f"Recorded {len(store.manifest['responses'])} upstream responses into {args.fixtures}")
+
+
+def run(args):
+    if not os.path.exists(os.path.join(args.fixtures, 'manifest.json')):
+        print(f'No fixtures in {args.fixtures}; run the record command first')
+        return 2
+
+    env = dict(REPLAY_ENV, **(COLD_ENV if args.cold else {}))
+    selected = {name: path for name, path in scenarios(args).items() if not args.scenario or name in args.scenario}
+
+    process, base_url = _start_server(args, 'replay', env)
+    try:
+        results = {}
+        for name, path in selected.items():
+            results[name] = run_scenario(base_url, path, args.requests, args.concurrency, args.warmup, args.timeout)
+        replay = requests.get(base_url + '/bench/replay', timeout=args.timeout).json()
+        peak_rss = peak_rss_bytes(process.pid)
+    finally:
+        _stop_server(process)
+
+    report = {
+        'created_at': datetime.now(pytz.UTC).isoformat(),
+        'fixtures': args.fixtures,
+        'cold': args.cold,
+        'environment': environment(),
+        'scenarios': results,
+        'peak_rss_bytes': peak_rss,
+        'replay': replay
+    }
+
+    print(f'{"scenario":16} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"req/s":>8} {"errors":>7}')
+    for name, result in results.items():
+        print(f"{name:16} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} "
+              f"{result['throughput_rps']:>8} {result['errors']:>7}")
+    if peak_rss:
+        print(f'peak RSS: {peak_rss / 2 ** 20:.1f} MiB')
+    if replay['misses']:
+        print(f"{len(replay['misses'])} upstream URLs had no fixture, e.g. {replay['misses'][0]}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            return _report_comparison(json.load(f), report, args.threshold)
+    return 0
+
+
+def _report_comparison(baseline, current, threshold):
+    lines, regressions = compare(baseline, current, threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'{len(regressions)} metrics regressed by more than {threshold}%')
+        return 1
+    return 0
+
+
+def compare_files(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return _report_comparison(baseline, current, args.threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API offline against recorded NOAA responses')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_target_arguments(command):
+        command.add_argument('--fixtures', required=True, help='directory of recorded upstream responses')
+        command.add_argument('--lat', type=float, default=36.95, help='latitude for location endpoints')
+        command.add_argument('--lon', type=float, default=-122.02, help='longitude for location endpoints')
+        command.add_argument('--station', default='46042', help='buoy station for the data endpoint')
+        command.add_argument('--timeout', type=float, default=300, help='per-request timeout in seconds')
+        command.add_argument('--startup-timeout', type=float, default=300, help='seconds to wait for the server')
+
+    record_command = commands.add_parser('record', help='call NOAA live once per endpoint and save the responses')
+    add_target_arguments(record_command)
+
+    run_command = commands.add_parser('run', help='replay the fixtures and measure each endpoint')
+    add_target_arguments(run_command)
+    run_command.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    run_command.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    run_command.add_argument('--warmup', type=int, default=1, help='unmeasured requests per endpoint first')
+    run_command.add_argument('--cold', action='store_true', help='disable the upstream cache')
+    run_command.add_argument('--scenario', action='append', choices=['buoys_nearby', 'buoy_data', 'forecast',
+                                                                     'tides_location'])
+    run_command.add_argument('--output', help='write results as JSON')
+    run_command.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    run_command.add_argument('--threshold', type=float, default=10.0, help='regression threshold in percent')
+
+    compare_command = commands.add_parser('compare', help='compare two results files')
+    compare_command.add_argument('baseline')
+    compare_command.add_argument('current')
+    compare_command.add_argument('--threshold', type=float, default=10.0, help='regression threshold in percent')
+
+    serve_command = commands.add_parser('serve', help=argparse.SUPPRESS)
+    serve_command.add_argument('--fixtures', required=True)
+    serve_command.add_argument('--mode', choices=['record', 'replay'], default='replay')
+    serve_command.add_argument('--port', type=int, required=True)
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+        return 0
+    if args.command == 'record':
+        record(args)
+        return 0
+    if args.command == 'run':
+        return run(args)
+    return compare_files(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
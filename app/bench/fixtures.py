@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+
+import pytz
+from requests.adapters import HTTPAdapter
+
+MANIFEST_FILE = 'manifest.json'
+
+# Query parameters that move with the clock; fixtures are matched without them
+VOLATILE_PARAMS = {'begin_date', 'end_date', 'date', 'range'}
+
+
+def fixture_key(url):
+    # Model run dates and cycles are folded out of GRIB paths so a recorded run
+    # answers for whatever run the replaying process thinks is current
+    parts = urlsplit(url)
+    path = re.sub(r'\d{8}', '{date}', parts.path)
+    path = re.sub(r'\{date\}/\d{2}/', '{date}/{cycle}/', path)
+    path = re.sub(r'\bt\d{2}z\b', 't{cycle}z', path)
+    query = urlencode(sorted((name, value) for name, value in parse_qsl(parts.query) if name not in VOLATILE_PARAMS))
+    return f'{parts.netloc}{path}?{query}' if query else f'{parts.netloc}{path}'
+
+
+class FixtureStore:
+    # Recorded upstream responses: <root>/manifest.json plus one body file per response
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        path = os.path.join(root, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'recorded_at': None, 'responses': {}}
+
+    @property
+    def recorded_at(self):
+        recorded_at = self.manifest.get('recorded_at')
+        return datetime.fromisoformat(recorded_at) if recorded_at else None
+
+    def get(self, url):
+        entry = self.manifest['responses'].get(fixture_key(url))
+        if entry is None:
+            return None
+        with open(os.path.join(self.root, entry['file']), 'rb') as f:
+            return entry['status'], entry['content_type'], f.read()
+
+    def put(self, url, status, content_type, body):
+        key = fixture_key(url)
+        filename = hashlib.sha1(key.encode()).hexdigest()
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, filename), 'wb') as f:
+                f.write(body)
+            if self.manifest['recorded_at'] is None:
+                self.manifest['recorded_at'] = datetime.now(pytz.UTC).isoformat()
+            self.manifest['responses'][key] = {
+                'url': url,
+                'file': filename,
+                'status': status,
+                'content_type': content_type,
+                'bytes': len(body)
+            }
+            tmp_path = os.path.join(self.root, MANIFEST_FILE + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, os.path.join(self.root, MANIFEST_FILE))
+
+
+class ReplayServer:
+    # Local stand-in for the NOAA hosts. Requests arrive as /<quoted original URL>.
+    def __init__(self, store, host='127.0.0.1'):
+        self.store = store
+        self.hits = 0
+        self.misses = []
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, with_body):
+                url = unquote(self.path[1:])
+                fixture = replay.store.get(url)
+                if fixture is None:
+                    replay.misses.append(url)
+                    self.send_error(404, 'No fixture recorded')
+                    return
+                replay.hits += 1
+                status, content_type, body = fixture
+                self.send_response(status)
+                self.send_header('Content-Type', content_type or 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if with_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f'http://{host}:{self._server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='replay-server', daemon=True).start()
+        return self
+
+
+def install_replay(base_url):
+    # Every requests call in this process (surfpy's and ours) is redirected to the replay server
+    original_send = HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        if not request.url.startswith(base_url):
+            request.url = f'{base_url}/{quote(request.url, safe="")}'
+        return original_send(self, request, **kwargs)
+
+    HTTPAdapter.send = send
+
+
+def install_recorder(store):
+    # Passes requests through to NOAA and keeps a copy of every successful GET
+    original_send = HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        response = original_send(self, request, **kwargs)
+        if request.method == 'GET' and response.status_code == 200:
+            store.put(request.url, response.status_code, response.headers.get('Content-Type'), response.content)
+        return response
+
+    HTTPAdapter.send = send
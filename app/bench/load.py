@@ -0,0 +1,133 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    rank = min(len(values), max(1, math.ceil(fraction * len(values))))
+    return values[rank - 1]
+
+
+def parse_server_timing(header):
+    timings = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                timings[name] = timings.get(name, 0) + float(value)
+    return timings
+
+
+def peak_rss_bytes(pid):
+    # High-water mark of the server's resident set; Linux only
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_scenario(base_url, path, count, concurrency, warmup=1, timeout=120):
+    local = threading.local()
+
+    def call(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=timeout)
+            body_bytes = len(response.content)
+            ok = response.status_code == 200
+            timings = parse_server_timing(response.headers.get('Server-Timing'))
+        except Exception:
+            body_bytes, ok, timings = 0, False, {}
+        return time.perf_counter() - started, ok, body_bytes, timings
+
+    # Warmup requests fill caches and grids; their latency is reported separately
+    cold = [call(None)[0] for _ in range(warmup)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(count)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _, _, _ in results)
+    spans = {}
+    for _, _, _, timings in results:
+        for name, duration in timings.items():
+            spans[name] = spans.get(name, 0) + duration
+
+    return {
+        'path': path,
+        'requests': count,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, ok, _, _ in results if not ok),
+        'cold_ms': round(cold[0] * 1000, 2) if cold else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'throughput_rps': round(count / elapsed, 1),
+        'mean_bytes': round(sum(size for _, _, size, _ in results) / count),
+        'server_timing_ms': {name: round(total / count, 2) for name, total in sorted(spans.items())}
+    }
+
+
+# (metric, True if higher is better)
+COMPARED_METRICS = [
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('p99_ms', False),
+    ('throughput_rps', True)
+]
+
+
+def compare(baseline, current, threshold=10.0):
+    # Returns (report lines, regressions); a regression is a change worse than threshold percent
+    lines = []
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            lines.append(f'{name}: no baseline')
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            before, after = base.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > threshold:
+                flag = '  REGRESSION'
+                regressions.append((name, metric, change))
+            lines.append(f'{name:16} {metric:15} {before:>10} -> {after:>10}  {change:+7.1f}%{flag}')
+
+    before, after = baseline.get('peak_rss_bytes'), current.get('peak_rss_bytes')
+    if before and after:
+        change = (after - before) / before * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(('server', 'peak_rss_bytes', change))
+        lines.append(f'{"server":16} {"peak_rss_mb":15} {before / 2 ** 20:>10.1f} -> {after / 2 ** 20:>10.1f}  '
+                     f'{change:+7.1f}%{flag}')
+    return lines, regressions
+
+
+def environment():
+    return {
+        'cpus': os.cpu_count(),
+        'platform': os.uname().sysname if hasattr(os, 'uname') else None
+    }
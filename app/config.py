@@ -0,0 +1,128 @@
+import os
+import tempfile
+
+
+class Config:
+    # Station catalogs (NDBC buoys, CO-OPS tide stations)
+    STATION_REFRESH_INTERVAL = int(os.environ.get('STATION_REFRESH_INTERVAL', '21600'))
+    STATION_RETRY_INTERVAL = int(os.environ.get('STATION_RETRY_INTERVAL', '300'))
+    # Catalogs and their spatial indexes are saved here after each refresh and restored at boot;
+    # the directory must belong to the server's user
+    STATION_SNAPSHOT_DIR = os.environ.get(
+        'STATION_SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'surfpy-api', 'stations')
+    )
+
+    # Upstream data cache; Redis is used when REDIS_URL is set
+    REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_TIMEOUT = int(os.environ.get('CACHE_TIMEOUT', '300'))
+    CACHE_NEGATIVE_TIMEOUT = int(os.environ.get('CACHE_NEGATIVE_TIMEOUT', '30'))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '1024'))
+    # How long expired entries are kept to serve when the upstream budget is exhausted
+    CACHE_STALE_TIMEOUT = int(os.environ.get('CACHE_STALE_TIMEOUT', '3600'))
+    # Seconds a request waits, beyond UPSTREAM_QUEUE_TIMEOUT, on another request's upstream fetch
+    # of the same key before fetching it itself
+    CACHE_LOAD_TIMEOUT = int(os.environ.get('CACHE_LOAD_TIMEOUT', '30'))
+    CACHE_TTLS = {
+        'buoy': int(os.environ.get('BUOY_CACHE_TIMEOUT', '600')),
+        'tide': int(os.environ.get('TIDE_CACHE_TIMEOUT', '86400')),
+        # Spot forecasts are keyed by model run, so they only need to outlive the run
+        'spot': int(os.environ.get('SPOT_CACHE_TIMEOUT', '21600'))
+    }
+
+    # Downloaded GFS wave GRIB files, kept per model run
+    GRIB_CACHE_DIR = os.environ.get('GRIB_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'surfpy-api', 'grib'))
+    GRIB_CACHE_MAX_BYTES = int(os.environ.get('GRIB_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+    GRIB_DOWNLOAD_TIMEOUT = int(os.environ.get('GRIB_DOWNLOAD_TIMEOUT', '60'))
+    GRIB_DOWNLOAD_WORKERS = int(os.environ.get('GRIB_DOWNLOAD_WORKERS', '8'))
+
+    # Decoded forecast grids, memory-mapped and shared between worker processes
+    GRID_STORE_DIR = os.environ.get('GRID_STORE_DIR', os.path.join(tempfile.gettempdir(), 'surfpy-api', 'grids'))
+
+    # Local history of every buoy reading fetched, for /api/buoys/<id>/history
+    BUOY_ARCHIVE_PATH = os.environ.get(
+        'BUOY_ARCHIVE_PATH', os.path.join(tempfile.gettempdir(), 'surfpy-api', 'buoys.sqlite3')
+    )
+    BUOY_ARCHIVE_BACKFILL = int(os.environ.get('BUOY_ARCHIVE_BACKFILL', '2000'))
+    BUOY_HISTORY_MAX_DAYS = int(os.environ.get('BUOY_HISTORY_MAX_DAYS', '366'))
+
+    # Buoy subscriptions: each watched station's realtime file is probed with a conditional,
+    # ranged request every BUOY_POLL_INTERVAL seconds
+    BUOY_POLL_URL = os.environ.get('BUOY_POLL_URL', 'https://www.ndbc.noaa.gov/data/realtime2/{station_id}.spec')
+    BUOY_POLL_INTERVAL = int(os.environ.get('BUOY_POLL_INTERVAL', '60'))
+    BUOY_POLL_PROBE_BYTES = int(os.environ.get('BUOY_POLL_PROBE_BYTES', '2048'))
+    BUOY_SUBSCRIBE_KEEPALIVE = int(os.environ.get('BUOY_SUBSCRIBE_KEEPALIVE', '15'))
+    BUOY_SUBSCRIBE_MAX_SECONDS = int(os.environ.get('BUOY_SUBSCRIBE_MAX_SECONDS', '3600'))
+    BUOY_SUBSCRIBE_MAX_REPLAY = int(os.environ.get('BUOY_SUBSCRIBE_MAX_REPLAY', '144'))
+
+    # Tide station harmonic constituents, fetched once per station and predicted locally
+    HARMONICS_DIR = os.environ.get('HARMONICS_DIR', os.path.join(tempfile.gettempdir(), 'surfpy-api', 'harmonics'))
+    HARMONICS_REFRESH_INTERVAL = int(os.environ.get('HARMONICS_REFRESH_INTERVAL', str(30 * 86400)))
+    TIDE_MAX_DAYS = int(os.environ.get('TIDE_MAX_DAYS', '366'))
+
+    # Background model-run ingestion (python -m app.ingest)
+    INGEST_DAYS = int(os.environ.get('INGEST_DAYS', '16'))
+    INGEST_POLL_INTERVAL = int(os.environ.get('INGEST_POLL_INTERVAL', '600'))
+
+    # Named spots (GET /api/spots/<id>) and the scheduler that keeps their reports built; an
+    # empty SPOTS_FILE disables the registry and SPOT_REFRESH_INTERVAL=0 builds reports on request
+    SPOTS_FILE = os.environ.get('SPOTS_FILE', os.path.join(os.path.dirname(__file__), 'spots.json'))
+    SPOT_REFRESH_INTERVAL = int(os.environ.get('SPOT_REFRESH_INTERVAL', '300'))
+    # Lock file electing the one worker per host that runs the scheduler (a Redis lock with REDIS_URL)
+    SPOT_LEADER_LOCK = os.environ.get(
+        'SPOT_LEADER_LOCK', os.path.join(tempfile.gettempdir(), 'surfpy-api', 'spot-reports.lock')
+    )
+    # Where the leader publishes finished reports for the other workers on the host (Redis with REDIS_URL)
+    SPOT_REPORT_DIR = os.environ.get('SPOT_REPORT_DIR', os.path.join(tempfile.gettempdir(), 'surfpy-api', 'spots'))
+    SPOT_FORECAST_HOURS = int(os.environ.get('SPOT_FORECAST_HOURS', '72'))
+    SPOT_TIDE_DAYS = int(os.environ.get('SPOT_TIDE_DAYS', '3'))
+    SPOT_BUOY_COUNT = int(os.environ.get('SPOT_BUOY_COUNT', '3'))
+
+    # POST /api/forecast/batch
+    FORECAST_BATCH_MAX_SPOTS = int(os.environ.get('FORECAST_BATCH_MAX_SPOTS', '500'))
+
+    # Concurrent upstream fetches within one request (e.g. /api/buoys/batch)
+    FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', '16'))
+    FANOUT_TIMEOUT = int(os.environ.get('FANOUT_TIMEOUT', '10'))
+    BUOY_BATCH_MAX_STATIONS = int(os.environ.get('BUOY_BATCH_MAX_STATIONS', '50'))
+
+    # Cache-Control max-age per data source, matching how often each one changes upstream
+    HTTP_MAX_AGES = {
+        'forecast': int(os.environ.get('FORECAST_MAX_AGE', '1800')),
+        'buoy': int(os.environ.get('BUOY_MAX_AGE', '600')),
+        'tide': int(os.environ.get('TIDE_MAX_AGE', '3600')),
+        'stations': int(os.environ.get('STATIONS_MAX_AGE', '3600')),
+        'spots': int(os.environ.get('SPOTS_MAX_AGE', '300'))
+    }
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+    # Production server (python -m app.serve). The gevent worker makes upstream waits
+    # cooperative, so one process holds many in-flight NOAA requests.
+    SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', '2'))
+    SERVER_WORKER_CLASS = os.environ.get('SERVER_WORKER_CLASS', 'gevent')
+    SERVER_WORKER_CONNECTIONS = int(os.environ.get('SERVER_WORKER_CONNECTIONS', '1000'))
+    SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT', '120'))
+    SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE', '5'))
+    # Build the app and load station catalogs once in the master, shared copy-on-write by workers
+    SERVER_PRELOAD = os.environ.get('SERVER_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+    UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', '32'))
+
+    # Inbound per-client limit (0 disables); buckets live in Redis when REDIS_URL is set
+    RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', '60'))
+    RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', '0'))
+    # Comma-separated API keys that get their own bucket; any other X-API-Key is ignored
+    RATE_LIMIT_API_KEYS = frozenset(
+        key.strip() for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()
+    )
+    # Reverse proxies in front of the app whose X-Forwarded-For entry is trusted (0 uses the peer address)
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', '0'))
+
+    # Outbound calls per minute to each NOAA source, per process (0 means no budget)
+    UPSTREAM_BUDGETS = {
+        'stations': int(os.environ.get('UPSTREAM_STATIONS_PER_MINUTE', '6')),
+        'buoy': int(os.environ.get('UPSTREAM_BUOY_PER_MINUTE', '120')),
+        'tide': int(os.environ.get('UPSTREAM_TIDE_PER_MINUTE', '120')),
+        'grib': int(os.environ.get('UPSTREAM_GRIB_PER_MINUTE', '600'))
+    }
+    UPSTREAM_CONCURRENCY = int(os.environ.get('UPSTREAM_CONCURRENCY', '8'))
+    UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', '5'))
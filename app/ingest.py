@@ -0,0 +1,35 @@
+import argparse
+
+from app.config import Config
+from app.services import create_grib_store, create_grid_store
+from app.services.ingest import ForecastIngestor
+from app.services.wave_models import WAVE_MODELS
+
+
+def main():
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+    parser = argparse.ArgumentParser(description='Download and decode new wave model runs ahead of requests')
+    parser.add_argument('--model', action='append', choices=sorted(WAVE_MODELS), help='model to ingest (default: all)')
+    parser.add_argument('--days', type=int, default=config['INGEST_DAYS'], help='forecast days to ingest per run')
+    parser.add_argument('--interval', type=int, default=config['INGEST_POLL_INTERVAL'], help='seconds between polls')
+    parser.add_argument('--once', action='store_true', help='poll once and exit')
+    args = parser.parse_args()
+
+    grib_store = create_grib_store(config)
+    ingestor = ForecastIngestor(
+        grib_store,
+        create_grid_store(config, grib_store),
+        {name: WAVE_MODELS[name] for name in (args.model or WAVE_MODELS)},
+        days=args.days,
+        poll_interval=args.interval
+    )
+
+    if args.once:
+        ingestor.run_once()
+    else:
+        ingestor.run_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from .buoy_routes import bp as buoy_routes
 from .forecast_routes import bp as forecast_routes
+from .spot_routes import bp as spot_routes
 from .tide_routes import bp as tide_routes
 
-__all__ = ['buoy_routes', 'forecast_routes', 'tide_routes']
\ No newline at end of file
+__all__ = ['buoy_routes', 'forecast_routes', 'spot_routes', 'tide_routes']
\ No newline at end of file
@@ -1,37 +1,166 @@
-from flask import Blueprint, jsonify, request
-from surfpy import Location, BuoyStations, BuoyStation
-from datetime import datetime
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from surfpy import Location, BuoyStation
+from datetime import datetime, timedelta
+import time
 import pytz
-from functools import lru_cache
+from app.services import (
+    cached, conditional, get_buoy_archive, get_buoy_poller, get_cache, get_fanout, get_station_catalog,
+    get_upstream_limiter
+)
+from app.services.buoy_archive import RESAMPLE_INTERVALS, epoch_seconds, resample
+from app.services.metrics import span
+from app.services.rate_limit import UpstreamBudgetExceeded, upstream_busy_response
+from app.services.serialization import (
+    BUOY_READING_COLUMNS, COLUMNAR_FORMATS, columnar_response, invalid_format_response, requested_format, to_columns
+)
 
 bp = Blueprint('buoys', __name__, url_prefix='/api/buoys')
 
+# How long an SSE client waits before reconnecting after the stream ends
+RECONNECT_MILLISECONDS = 5000
 
-# Cache for buoy data
-@lru_cache(maxsize=128)
-def fetch_buoy_data(station_id, data_count=20):
+
+def load_buoy_data(station_id, data_count=20):
     try:
-        stations = BuoyStations()
-        stations.fetch_stations()
-        station = stations.find_station(station_id)
+        station = get_station_catalog().find_buoy_station(station_id)
 
         if not station:
             return None
 
-        # Try to get detailed wave reading first
-        data = station.fetch_detailed_wave_reading(data_count)
-        if data:
-            return data
+        with get_upstream_limiter().slot('buoy') as call:
+            # Try to get detailed wave reading first
+            data = station.fetch_detailed_wave_reading(data_count)
+            if not data:
+                # Fall back to latest reading if detailed not available
+                data = [station.fetch_latest_reading()]
+            if not any(data):
+                call.fail()
 
-        # Fall back to latest reading if detailed not available
-        return [station.fetch_latest_reading()]
+        archive_readings(station_id, data)
+        return data
+    except UpstreamBudgetExceeded:
+        # Let the cache fall back to the last good readings
+        raise
     except Exception as e:
         print(f"Error fetching buoy data: {str(e)}")
         return None
 
 
-@bp.route('/nearby/<float:lat>/<float:lon>')
+def backfill_station(station_id):
+    # True once the station's realtime window is archived, None if NDBC did not provide it
+    if load_buoy_data(station_id, current_app.config['BUOY_ARCHIVE_BACKFILL']) is None:
+        return None
+    get_buoy_archive().mark_backfilled(station_id)
+    return True
+
+
+# Cache for buoy data
+@cached('buoy')
+def fetch_buoy_data(station_id, data_count=20):
+    return load_buoy_data(station_id, data_count)
+
+
+def archive_readings(station_id, data):
+    # Every upstream fetch tops up the station's local history
+    try:
+        get_buoy_archive().append(station_id, [reading for reading in data if reading])
+    except Exception as e:
+        print(f"Error archiving buoy data: {str(e)}")
+
+
+def parse_time(value):
+    # ISO 8601, naive times taken as UTC
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        return pytz.UTC.localize(parsed)
+    return parsed.astimezone(pytz.UTC)
+
+
+def _column(values):
+    return [None if value != value else value for value in values.tolist()]
+
+
+def format_reading(reading):
+    measurement = {
+        'timestamp': reading.date.isoformat() if reading.date else None,
+        'wave_summary': None,
+        'wind': {
+            'speed': reading.wind_speed,
+            'direction': reading.wind_direction,
+            'compass_direction': reading.wind_compass_direction,
+            'gust': reading.wind_gust
+        },
+        'weather': {
+            'pressure': reading.pressure,
+            'air_temperature': reading.air_temperature,
+            'water_temperature': reading.water_temperature,
+            'dewpoint': reading.dewpoint_temperature
+        },
+        'swells': []
+    }
+
+    if reading.wave_summary:
+        measurement['wave_summary'] = {
+            'height': reading.wave_summary.wave_height,
+            'period': reading.wave_summary.period,
+            'direction': reading.wave_summary.direction,
+            'compass_direction': reading.wave_summary.compass_direction
+        }
+
+    for swell in reading.swell_components:
+        measurement['swells'].append({
+            'height': swell.wave_height,
+            'period': swell.period,
+            'direction': swell.direction,
+            'compass_direction': swell.compass_direction
+        })
+
+    return measurement
+
+
+def poll_readings(station_id, count):
+    # The buoy poller's fetch: the newest readings as (timestamp, reading), archived as well
+    station = get_station_catalog().find_buoy_station(station_id)
+    if not station:
+        return []
+
+    with get_upstream_limiter().slot('buoy') as call:
+        data = station.fetch_detailed_wave_reading(count) or []
+        if not data:
+            call.fail()
+    data = [reading for reading in data if reading and reading.date]
+    archive_readings(station_id, data)
+    return [(epoch_seconds(reading.date), format_reading(reading)) for reading in data]
+
+
+def fetch_latest_readings(station_ids, data_count=1):
+    # Concurrent fetches for several stations; each entry is either readings or an error
+    results = get_fanout().map(lambda station_id: fetch_buoy_data(station_id, data_count), station_ids)
+
+    stations = {}
+    for station_id, (data, error) in results.items():
+        if error:
+            stations[station_id] = {'error': error}
+        elif not data:
+            stations[station_id] = {'error': 'Failed to fetch buoy data'}
+        else:
+            stations[station_id] = {'readings': [format_reading(reading) for reading in data]}
+    return stations
+
+
+@bp.route('/nearby/<float(signed=True):lat>/<float(signed=True):lon>')
 def get_nearby_buoys(lat, lon):
+    return nearby_buoys(lat, lon)
+
+
+@bp.route('/nearby/<float(signed=True):lat>/<float(signed=True):lon>/latest')
+def get_nearby_buoys_latest(lat, lon):
+    return nearby_buoys(lat, lon, with_latest=True)
+
+
+def nearby_buoys(lat, lon, with_latest=False):
     try:
         # Validate coordinate ranges
         if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
@@ -47,24 +176,37 @@ def get_nearby_buoys(lat, lon):
         count = min(max(1, int(request.args.get('count', '5'))), 10)
         active_only = request.args.get('active', 'true').lower() == 'true'
         buoy_type = request.args.get('type', BuoyStation.BuoyType.none)
+        radius_km = request.args.get('radius')
+        radius_km = float(radius_km) if radius_km is not None else None
 
         location = Location(lat, lon)
-        stations = BuoyStations()
-        if not stations.fetch_stations():
+        snapshot = get_station_catalog().buoy_snapshot()
+        if not snapshot:
             return jsonify({
                 'error': 'Failed to fetch buoy stations'
             }), 500
 
-        nearby = []
-        closest_stations = stations.find_closest_stations(location, count)
-
-        for station in closest_stations:
-            if active_only and not station.active:
-                continue
+        # Without latest readings the result only changes when the station catalog does
+        if not with_latest:
+            not_modified = conditional('stations', snapshot.loaded_at)
+            if not_modified:
+                return not_modified
 
-            if buoy_type != BuoyStation.BuoyType.none and station.buoy_type != buoy_type:
-                continue
+        # Filters are applied inside the index search so exactly `count` matches come back
+        with span('search'):
+            mask = snapshot.index.select(
+                active=True if active_only else None,
+                buoy_type=buoy_type if buoy_type != BuoyStation.BuoyType.none else None
+            )
+            closest_stations = snapshot.index.nearest(
+                location,
+                count,
+                max_distance=radius_km * 1000 if radius_km is not None else None,
+                mask=mask
+            )
 
+        nearby = []
+        for station, distance in closest_stations:
             nearby.append({
                 'id': station.station_id,
                 'name': station.name,
@@ -72,20 +214,27 @@ def get_nearby_buoys(lat, lon):
                     'latitude': station.location.latitude,
                     'longitude': station.location.longitude
                 },
-                'distance_km': location.distance(station.location) / 1000,
+                'distance_km': distance / 1000,
                 'active': station.active,
                 'type': station.buoy_type,
                 'owner': station.owner,
                 'program': station.program
             })
 
+        if with_latest:
+            with span('fetch'):
+                latest = fetch_latest_readings([station['id'] for station in nearby])
+            for station in nearby:
+                station['latest'] = latest[station['id']]
+
         return jsonify({
             'request': {
                 'latitude': lat,
                 'longitude': lon,
                 'count': count,
                 'active_only': active_only,
-                'type': buoy_type
+                'type': buoy_type,
+                'radius_km': radius_km
             },
             'stations': nearby
         })
@@ -102,56 +251,255 @@ def get_buoy_data(station_id):
     try:
         # Get optional parameters
         data_count = min(max(1, int(request.args.get('count', '20'))), 50)
+        fmt = requested_format()
+        if fmt != 'json' and fmt not in COLUMNAR_FORMATS:
+            return invalid_format_response(fmt)
 
         # Fetch data with caching
-        data = fetch_buoy_data(station_id, data_count)
+        with span('fetch'):
+            data = fetch_buoy_data(station_id, data_count)
         if not data:
             return jsonify({
                 'error': 'Failed to fetch buoy data',
                 'station_id': station_id
             }), 500
 
-        response = []
-        for reading in data:
-            measurement = {
-                'timestamp': reading.date.isoformat() if reading.date else None,
-                'wave_summary': None,
-                'wind': {
-                    'speed': reading.wind_speed,
-                    'direction': reading.wind_direction,
-                    'compass_direction': reading.wind_compass_direction,
-                    'gust': reading.wind_gust
-                },
-                'weather': {
-                    'pressure': reading.pressure,
-                    'air_temperature': reading.air_temperature,
-                    'water_temperature': reading.water_temperature,
-                    'dewpoint': reading.dewpoint_temperature
-                },
-                'swells': []
+        latest = max((reading.date for reading in data if reading.date), default=None)
+        not_modified = conditional('buoy', latest, last_modified=latest)
+        if not_modified:
+            return not_modified
+
+        with span('serialize'):
+            if fmt in COLUMNAR_FORMATS:
+                return columnar_response(fmt, 'readings', to_columns(data, BUOY_READING_COLUMNS), station_id=station_id)
+
+            response = [format_reading(reading) for reading in data]
+
+            return jsonify({
+                'station_id': station_id,
+                'readings': response
+            })
+
+    except UpstreamBudgetExceeded as e:
+        return upstream_busy_response(e)
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'details': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'error': 'Server error',
+            'details': str(e)
+        }), 500
+
+
+@bp.route('/<string:station_id>/history')
+def get_buoy_history(station_id):
+    try:
+        fmt = requested_format()
+        if fmt != 'json' and fmt not in COLUMNAR_FORMATS:
+            return invalid_format_response(fmt)
+
+        interval = request.args.get('resample')
+        if interval is not None and interval not in RESAMPLE_INTERVALS:
+            return jsonify({
+                'error': 'Invalid parameters',
+                'details': f'Unknown resample {interval!r}, expected one of {", ".join(RESAMPLE_INTERVALS)}'
+            }), 400
+
+        now = datetime.now(pytz.UTC)
+        end_time = parse_time(request.args.get('end')) or now
+        start_time = parse_time(request.args.get('start')) or end_time - timedelta(days=7)
+        max_days = current_app.config['BUOY_HISTORY_MAX_DAYS']
+        if start_time >= end_time or end_time - start_time > timedelta(days=max_days):
+            return jsonify({
+                'error': 'Invalid parameters',
+                'details': f'start must be before end and at most {max_days} days apart'
+            }), 400
+
+        # Served from the archive. NDBC is only asked to backfill a station's realtime window
+        # once, and otherwise when the window reaches past the last archived reading by more
+        # than a buoy cache period.
+        archive = get_buoy_archive()
+        cache = get_cache()
+        backfilled = archive.backfilled(station_id)
+        try:
+            with span('fetch'):
+                if not backfilled:
+                    # The readings go to the archive rather than the cache, where a backfill-sized
+                    # entry would only evict hot ones. The cache only holds the outcome, so a failed
+                    # backfill is retried after the negative TTL rather than on every request.
+                    backfilled = bool(cache.get_or_load(
+                        f'buoy:backfill:{station_id}',
+                        lambda: backfill_station(station_id),
+                        ttl=cache.negative_ttl
+                    ))
+
+                last = archive.last_timestamp(station_id)
+                ttl = cache.ttl_for('buoy')
+                if last is None or min(end_time.timestamp(), time.time()) > last + ttl:
+                    fetch_buoy_data(station_id)
+        except UpstreamBudgetExceeded:
+            pass
+        last = archive.last_timestamp(station_id)
+
+        if last is None:
+            return jsonify({
+                'error': 'No archived data for station',
+                'station_id': station_id
+            }), 404
+
+        not_modified = conditional(
+            'buoy', last, backfilled, start_time.isoformat(), end_time.isoformat(), interval
+        )
+        if not_modified:
+            return not_modified
+
+        with span('archive'):
+            times, columns = archive.query(station_id, start_time, end_time)
+            if interval:
+                times, columns = resample(times, columns, RESAMPLE_INTERVALS[interval])
+
+        with span('serialize'):
+            timestamps = [datetime.fromtimestamp(ts, pytz.UTC).isoformat() for ts in times.tolist()]
+            values = {name: _column(series) for name, series in columns.items()}
+            meta = {
+                'station_id': station_id,
+                'start_time': start_time.isoformat(),
+                'end_time': end_time.isoformat(),
+                'resample': interval
             }
 
-            if reading.wave_summary:
-                measurement['wave_summary'] = {
-                    'height': reading.wave_summary.wave_height,
-                    'period': reading.wave_summary.period,
-                    'direction': reading.wave_summary.direction,
-                    'compass_direction': reading.wave_summary.compass_direction
-                }
+            if fmt in COLUMNAR_FORMATS:
+                return columnar_response(fmt, 'readings', dict(timestamp=timestamps, **values, swells=[]), **meta)
 
-            for swell in reading.swell_components:
-                measurement['swells'].append({
-                    'height': swell.wave_height,
-                    'period': swell.period,
-                    'direction': swell.direction,
-                    'compass_direction': swell.compass_direction
+            readings = []
+            for row, timestamp in enumerate(timestamps):
+                readings.append({
+                    'timestamp': timestamp,
+                    'wave_summary': {
+                        'height': values['wave_height'][row],
+                        'period': values['wave_period'][row],
+                        'direction': values['wave_direction'][row]
+                    },
+                    'wind': {
+                        'speed': values['wind_speed'][row],
+                        'direction': values['wind_direction'][row],
+                        'gust': values['wind_gust'][row]
+                    },
+                    'weather': {
+                        'pressure': values['pressure'][row],
+                        'air_temperature': values['air_temperature'][row],
+                        'water_temperature': values['water_temperature'][row],
+                        'dewpoint': values['dewpoint'][row]
+                    }
                 })
 
-            response.append(measurement)
+            return jsonify(dict(meta, count=len(readings), readings=readings))
+
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'details': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'error': 'Server error',
+            'details': str(e)
+        }), 500
+
+
+@bp.route('/<string:station_id>/subscribe')
+def subscribe_buoy(station_id):
+    # Server-Sent Events: a reading event (id = observation time) for each new observation,
+    # starting with the latest one, or with those after Last-Event-ID when resuming
+    try:
+        if not get_station_catalog().find_buoy_station(station_id):
+            return jsonify({
+                'error': 'Buoy station not found',
+                'station_id': station_id
+            }), 404
+
+        since = request.headers.get('Last-Event-ID') or request.args.get('since')
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({
+            'error': 'Invalid parameters',
+            'details': 'Last-Event-ID and since must be epoch seconds'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'error': 'Server error',
+            'details': str(e)
+        }), 500
+
+    poller = get_buoy_poller()
+    subscription = poller.subscribe(station_id, since)
+    keepalive = current_app.config['BUOY_SUBSCRIBE_KEEPALIVE']
+    max_seconds = current_app.config['BUOY_SUBSCRIBE_MAX_SECONDS']
+
+    def encode(item):
+        timestamp, reading = item
+        return f'id: {timestamp}\nevent: reading\ndata: {current_app.json.dumps(reading)}\n\n'
+
+    def generate():
+        # Readings pushed while the backlog was built can repeat it; each one goes out once
+        sent = since or 0
+        try:
+            yield f'retry: {RECONNECT_MILLISECONDS}\n\n'
+            for item in subscription.backlog:
+                if item[0] > sent:
+                    sent = item[0]
+                    yield encode(item)
+
+            # Streams end after max_seconds so long-lived clients spread across workers;
+            # they reconnect with Last-Event-ID, and the watch outlives them long enough
+            # that they miss nothing
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline:
+                item = subscription.get(keepalive)
+                if item is None:
+                    # A comment line keeps proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                elif item[0] > sent:
+                    sent = item[0]
+                    yield encode(item)
+        finally:
+            poller.unsubscribe(subscription)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+
+@bp.route('/batch')
+def get_batch_buoy_data():
+    try:
+        station_ids = [station_id.strip() for station_id in request.args.get('ids', '').split(',') if station_id.strip()]
+        if not station_ids:
+            return jsonify({
+                'error': 'Missing parameters',
+                'required': ['ids']
+            }), 400
+
+        max_stations = current_app.config['BUOY_BATCH_MAX_STATIONS']
+        if len(station_ids) > max_stations:
+            return jsonify({
+                'error': 'Too many stations',
+                'max_stations': max_stations
+            }), 400
+
+        data_count = min(max(1, int(request.args.get('count', '1'))), 50)
+
+        with span('fetch'):
+            readings = fetch_latest_readings(station_ids, data_count)
 
         return jsonify({
-            'station_id': station_id,
-            'readings': response
+            'request': {
+                'ids': station_ids,
+                'count': data_count
+            },
+            'stations': readings
         })
 
     except ValueError as e:
@@ -178,17 +526,53 @@ def get_docs():
                     'lon': 'longitude (-180 to 180)',
                     'count': 'number of stations to return (1-10, default: 5)',
                     'active': 'filter for active stations only (true/false, default: true)',
-                    'type': f'buoy type ({", ".join(vars(BuoyStation.BuoyType).keys())})'
+                    'type': f'buoy type ({", ".join(vars(BuoyStation.BuoyType).keys())})',
+                    'radius': 'only return stations within this many kilometers (optional)'
                 },
                 'example': '/api/buoys/nearby/41.4302/-71.455?count=5&active=true'
             },
+            'nearby_latest': {
+                'path': '/api/buoys/nearby/<lat>/<lon>/latest',
+                'method': 'GET',
+                'parameters': 'same as nearby; each station also carries its latest reading',
+                'example': '/api/buoys/nearby/41.4302/-71.455/latest?count=5'
+            },
             'data': {
                 'path': '/api/buoys/<station_id>/data',
                 'method': 'GET',
                 'parameters': {
-                    'count': 'number of readings to return (1-50, default: 20)'
+                    'count': 'number of readings to return (1-50, default: 20)',
+                    'format': 'json (default), columnar, msgpack or arrow'
                 },
                 'example': '/api/buoys/44097/data?count=20'
+            },
+            'history': {
+                'path': '/api/buoys/<station_id>/history',
+                'method': 'GET',
+                'parameters': {
+                    'start': 'ISO 8601 start time (default: 7 days before end)',
+                    'end': 'ISO 8601 end time (default: now)',
+                    'resample': f'average into buckets ({", ".join(RESAMPLE_INTERVALS)}, optional)',
+                    'format': 'json (default), columnar, msgpack or arrow'
+                },
+                'example': '/api/buoys/44097/history?start=2024-11-01T00:00:00Z&resample=1h'
+            },
+            'subscribe': {
+                'path': '/api/buoys/<station_id>/subscribe',
+                'method': 'GET',
+                'parameters': {
+                    'since': 'epoch seconds of the last reading seen (or the Last-Event-ID header)'
+                },
+                'example': '/api/buoys/44097/subscribe'
+            },
+            'batch': {
+                'path': '/api/buoys/batch',
+                'method': 'GET',
+                'parameters': {
+                    'ids': 'comma separated station ids',
+                    'count': 'number of readings per station (1-50, default: 1)'
+                },
+                'example': '/api/buoys/batch?ids=44097,44013&count=1'
             }
         }
     })
\ No newline at end of file
@@ -1,65 +1,257 @@
-from flask import Blueprint, jsonify, request
-from surfpy import Location, BuoyStations, us_west_coast_gfs_wave_model, atlantic_gfs_wave_model
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from surfpy import Location
 from datetime import datetime, timedelta
+import numpy as np
 import pytz
+from app.services import (
+    conditional, get_cache, get_grib_store, get_grid_store, get_station_catalog, get_upstream_limiter
+)
+from app.services.breaking import DEFAULT_SPOT, breaking_columns, spot_params
+from app.services.grid_store import decode_point
+from app.services.metrics import span
+from app.services.rate_limit import UpstreamBudgetExceeded, upstream_busy_response
+from app.services.serialization import (
+    COLUMNAR_FORMATS, FORECAST_COLUMNS, WAVE_COLUMNS, columnar_response, invalid_format_response, requested_format,
+    to_columns
+)
+from app.services.wave_models import select_model
 
 bp = Blueprint('forecast', __name__, url_prefix='/api/forecast')
 
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
 
-@bp.route('/<float:lat>/<float:lon>')
-def get_forecast(lat, lon):
+
+def format_forecast(data, breaking=None):
+    forecast = {
+        'timestamp': data.date.isoformat(),
+        'wave_summary': {
+            'height': data.wave_summary.wave_height if data.wave_summary else None,
+            'period': data.wave_summary.period if data.wave_summary else None,
+            'direction': data.wave_summary.direction if data.wave_summary else None,
+            'compass_direction': data.wave_summary.compass_direction if data.wave_summary else None
+        },
+        'wind': {
+            'speed': data.wind_speed,
+            'direction': data.wind_direction,
+            'compass_direction': data.wind_compass_direction
+        },
+        'swells': []
+    }
+
+    if breaking is not None:
+        forecast['breaking_waves'] = {
+            'minimum_height': breaking[0],
+            'maximum_height': breaking[1]
+        }
+
+    for swell in data.swell_components:
+        forecast['swells'].append({
+            'height': swell.wave_height,
+            'period': swell.period,
+            'direction': swell.direction,
+            'compass_direction': swell.compass_direction
+        })
+
+    return forecast
+
+
+def format_spot_forecasts(buoy_data, spot):
+    # Breaking heights for every hour and swell component are solved in one vectorized pass
+    breaking = breaking_columns(buoy_data, **spot)
+    heights = zip(breaking['breaking_minimum_height'], breaking['breaking_maximum_height'])
+    return [format_forecast(data, pair) for data, pair in zip(buoy_data, heights)]
+
+
+def spot_forecast(model, grid_run, location, spot, start_time, end_time, columnar=False):
+    # Cached per model run, spot parameters and forecast hour, so repeat requests for a beach
+    # skip extraction and the breaking-wave solve. None when the spot is off the model grid.
+    key = ':'.join([
+        'spot', model.name, grid_run.meta['run'], f'{location.latitude:.4f}', f'{location.longitude:.4f}',
+        *(f'{spot[name]:g}' for name in DEFAULT_SPOT),
+        start_time.strftime('%Y%m%d%H'), end_time.strftime('%Y%m%d%H'), 'columns' if columnar else 'rows'
+    ])
+
+    def load():
+        with span('extract'):
+            processed_data = grid_run.point_data(location, start_time, end_time)
+        if processed_data is None:
+            return None
+
+        with span('convert'):
+            buoy_data = model.to_buoy_data(processed_data)
+
+        with span('breaking'):
+            if not columnar:
+                return format_spot_forecasts(buoy_data, spot)
+            columns = to_columns(buoy_data, FORECAST_COLUMNS)
+            columns.update(breaking_columns(buoy_data, **spot))
+            return columns
+
+    return get_cache().get_or_load(key, load, 'spot')
+
+
+def forecast_hours(model, location, spot, start_time, end_time, end_index):
+    # Formatted forecast hours, a chunk at a time. Read from the decoded grid when it already covers
+    # the window, otherwise decoded from each GRIB hour as soon as that file is downloaded.
+    grid_run = get_grid_store().available(model, end_index)
+    if grid_run is not None:
+        for processed_data in grid_run.iter_point_data(location, start_time, end_time):
+            yield format_spot_forecasts(model.to_buoy_data(processed_data), spot)
+        return
+
+    start_index = max(0, int(model.time_index(start_time)))
+    for path in get_grib_store().iter_grib_paths(model, start_index, end_index):
+        if path is None:
+            continue
+        try:
+            processed_data = decode_point(path, location)
+        except Exception as e:
+            print(f"Error decoding grib data: {str(e)}")
+            continue
+        if processed_data is None:
+            # Off the grid for this hour means off the grid for every hour
+            return
+        yield format_spot_forecasts(model.to_buoy_data(processed_data), spot)
+
+
+def stream_forecast(model, location, spot, start_time, end_time, end_index, stream):
+    # NDJSON (one forecast hour per line) or Server-Sent Events (one forecast event per hour,
+    # then an end event). Nothing beyond the hours in flight is held in memory.
+    def encode(event, payload):
+        data = current_app.json.dumps(payload)
+        if stream == 'sse':
+            return f'event: {event}\ndata: {data}\n\n'
+        return data + '\n'
+
+    def generate():
+        count = 0
+        try:
+            for forecasts in forecast_hours(model, location, spot, start_time, end_time, end_index):
+                for forecast in forecasts:
+                    count += 1
+                    yield encode('forecast', forecast)
+            if not count:
+                yield encode('error', {'error': 'Location is outside the forecast model grid'})
+        except Exception as e:
+            print(f"Error streaming forecast: {str(e)}")
+            yield encode('error', {'error': str(e)})
+        if stream == 'sse':
+            yield encode('end', {'count': count, 'model': model.name})
+
+    headers = {'X-Accel-Buffering': 'no'}
+    if stream == 'sse':
+        headers['Cache-Control'] = 'no-cache'
+    return Response(stream_with_context(generate()), mimetype=STREAM_MIMETYPES[stream], headers=headers)
+
+
+def forecast_response(location, hours, envelope=False):
+    # Common body of the path and query string forecast routes
+    fmt = requested_format()
+    if fmt != 'json' and fmt not in COLUMNAR_FORMATS:
+        return invalid_format_response(fmt)
     try:
-        location = Location(lat, lon)
+        spot = spot_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid parameters', 'details': str(e)}), 400
 
-        # Determine which model to use based on location
-        if 210 <= location.absolute_longitude <= 250 and 25 <= location.latitude <= 50:
-            model = us_west_coast_gfs_wave_model()
-        else:
-            model = atlantic_gfs_wave_model()
+    stream = request.args.get('stream')
+    if stream is not None and (stream not in STREAM_MIMETYPES or fmt != 'json'):
+        return jsonify({
+            'error': 'Invalid parameters',
+            'details': f'stream must be one of {", ".join(STREAM_MIMETYPES)} and only works with JSON'
+        }), 400
 
-        # Get time range for forecast
-        days = int(request.args.get('days', '3'))
-        current_time = datetime.now(pytz.UTC)
-        end_time = current_time + timedelta(days=days)
-
-        # Fetch and process forecast data
-        start_index = model.time_index(current_time)
-        end_index = model.time_index(end_time)
-
-        raw_data = model.fetch_grib_datas(int(start_index), int(end_index))
-        processed_data = model.parse_grib_datas(location, raw_data)
-        buoy_data = model.to_buoy_data(processed_data)
-
-        # Format response
-        forecasts = []
-        for data in buoy_data:
-            forecast = {
-                'timestamp': data.date.isoformat(),
-                'wave_summary': {
-                    'height': data.wave_summary.wave_height if data.wave_summary else None,
-                    'period': data.wave_summary.period if data.wave_summary else None,
-                    'direction': data.wave_summary.direction if data.wave_summary else None,
-                    'compass_direction': data.wave_summary.compass_direction if data.wave_summary else None
-                },
-                'wind': {
-                    'speed': data.wind_speed,
-                    'direction': data.wind_direction,
-                    'compass_direction': data.wind_compass_direction
-                },
-                'swells': []
-            }
-
-            for swell in data.swell_components:
-                forecast['swells'].append({
-                    'height': swell.wave_height,
-                    'period': swell.period,
-                    'direction': swell.direction,
-                    'compass_direction': swell.compass_direction
-                })
-
-            forecasts.append(forecast)
+    # The finest wave model grid covering the location
+    model = select_model(location)
+    if model is None:
+        return jsonify({'error': 'Location is outside every forecast model grid'}), 400
+
+    # Get time range for forecast
+    current_time = datetime.now(pytz.UTC)
+    end_time = current_time + timedelta(hours=hours)
+
+    # Streams start on the first decoded hour instead of waiting for the whole window
+    if stream:
+        return stream_forecast(model, location, spot, current_time, end_time, int(model.time_index(end_time)), stream)
 
+    # Fetch and process forecast data. Decoded grids are shared per model run, normally
+    # published ahead of time by the ingestion worker, so this is an index lookup.
+    end_index = model.time_index(end_time)
+    with span('grid'):
+        grid_run = get_grid_store().current(model, int(end_index))
+
+    # The response only changes with the model run it is served from and the forecast hour
+    # the window starts in
+    run_id = grid_run.meta['run']
+    not_modified = conditional(
+        'forecast', model.name, run_id, current_time.strftime('%Y%m%d%H'),
+        last_modified=datetime.strptime(run_id, '%Y%m%d%H')
+    )
+    if not_modified:
+        return not_modified
+
+    forecasts = spot_forecast(model, grid_run, location, spot, current_time, end_time, fmt in COLUMNAR_FORMATS)
+    if forecasts is None:
+        return jsonify({'error': 'Location is outside the forecast model grid'}), 400
+
+    meta = {'model': model.name}
+    if envelope:
+        meta['location'] = dict(latitude=location.latitude, longitude=location.longitude, **spot)
+
+    with span('serialize'):
+        if fmt in COLUMNAR_FORMATS:
+            return columnar_response(fmt, 'forecasts', forecasts, **meta)
+        if envelope:
+            return jsonify(dict(meta, forecasts=forecasts))
         return jsonify(forecasts)
+
+
+@bp.route('/<float(signed=True):lat>/<float(signed=True):lon>')
+def get_forecast(lat, lon):
+    try:
+        days = int(request.args.get('days', '3'))
+        return forecast_response(Location(lat, lon), days * 24)
+    except UpstreamBudgetExceeded as e:
+        return upstream_busy_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/location')
+def get_location_forecast():
+    try:
+        # Validate required parameters
+        if 'lat' not in request.args or 'lon' not in request.args:
+            return jsonify({
+                'error': 'Missing parameters',
+                'required': ['lat', 'lon']
+            }), 400
+
+        try:
+            lat = float(request.args.get('lat'))
+            lon = float(request.args.get('lon'))
+            hours = min(max(1, int(request.args.get('hours', '24'))), 384)
+        except ValueError:
+            return jsonify({
+                'error': 'Invalid parameters',
+                'details': 'lat and lon must be numeric and hours an integer'
+            }), 400
+
+        if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+            return jsonify({
+                'error': 'Invalid coordinates',
+                'valid_ranges': {
+                    'latitude': '[-90, 90]',
+                    'longitude': '[-180, 180]'
+                }
+            }), 400
+
+        return forecast_response(Location(lat, lon), hours, envelope=True)
+    except UpstreamBudgetExceeded as e:
+        return upstream_busy_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -67,41 +259,150 @@ def get_forecast(lat, lon):
 @bp.route('/buoy/<string:station_id>')
 def get_buoy_forecast(station_id):
     try:
-        stations = BuoyStations()
-        stations.fetch_stations()
-        station = stations.find_station(station_id)
+        fmt = requested_format()
+        if fmt != 'json' and fmt not in COLUMNAR_FORMATS:
+            return invalid_format_response(fmt)
+
+        station = get_station_catalog().find_buoy_station(station_id)
 
         if not station:
             return jsonify({'error': 'Station not found'}), 404
 
-        data = station.fetch_detailed_wave_reading(20)  # Get 20 most recent readings
+        with get_upstream_limiter().slot('buoy') as call:
+            data = station.fetch_detailed_wave_reading(20)  # Get 20 most recent readings
+            if not data:
+                call.fail()
 
         if not data:
             return jsonify({'error': 'No data available'}), 404
 
-        forecasts = []
-        for reading in data:
-            forecast = {
-                'timestamp': reading.date.isoformat(),
-                'wave_summary': {
-                    'height': reading.wave_summary.wave_height if reading.wave_summary else None,
-                    'period': reading.wave_summary.period if reading.wave_summary else None,
-                    'direction': reading.wave_summary.direction if reading.wave_summary else None,
-                    'compass_direction': reading.wave_summary.compass_direction if reading.wave_summary else None
-                },
-                'swells': []
-            }
-
-            for swell in reading.swell_components:
-                forecast['swells'].append({
-                    'height': swell.wave_height,
-                    'period': swell.period,
-                    'direction': swell.direction,
-                    'compass_direction': swell.compass_direction
-                })
-
-            forecasts.append(forecast)
+        latest = max((reading.date for reading in data if reading.date), default=None)
+        not_modified = conditional('buoy', latest, last_modified=latest)
+        if not_modified:
+            return not_modified
 
-        return jsonify(forecasts)
+        with span('serialize'):
+            if fmt in COLUMNAR_FORMATS:
+                return columnar_response(fmt, 'forecasts', to_columns(data, WAVE_COLUMNS), station_id=station_id)
+
+            forecasts = []
+            for reading in data:
+                forecast = {
+                    'timestamp': reading.date.isoformat(),
+                    'wave_summary': {
+                        'height': reading.wave_summary.wave_height if reading.wave_summary else None,
+                        'period': reading.wave_summary.period if reading.wave_summary else None,
+                        'direction': reading.wave_summary.direction if reading.wave_summary else None,
+                        'compass_direction': reading.wave_summary.compass_direction if reading.wave_summary else None
+                    },
+                    'swells': []
+                }
+
+                for swell in reading.swell_components:
+                    forecast['swells'].append({
+                        'height': swell.wave_height,
+                        'period': swell.period,
+                        'direction': swell.direction,
+                        'compass_direction': swell.compass_direction
+                    })
+
+                forecasts.append(forecast)
+
+            return jsonify(forecasts)
+    except UpstreamBudgetExceeded as e:
+        return upstream_busy_response(e)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+def _parse_spot(index, spot):
+    try:
+        lat = float(spot['lat'])
+        lon = float(spot['lon'])
+        days = min(max(1, int(spot.get('days', 3))), 16)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None, {'index': index, 'error': 'Invalid spot', 'details': 'lat and lon must be numeric'}
+
+    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        return None, {'index': index, 'error': 'Invalid coordinates', 'spot': {'lat': lat, 'lon': lon}}
+
+    try:
+        params = spot_params(spot)
+    except ValueError as e:
+        return None, {'index': index, 'error': 'Invalid spot', 'details': str(e)}
+
+    return (index, Location(lat, lon), days, params), None
+
+
+@bp.route('/batch', methods=['POST'])
+def get_batch_forecast():
+    body = request.get_json(silent=True) or {}
+    spots = body.get('spots')
+    if not isinstance(spots, list) or not spots:
+        return jsonify({
+            'error': 'Missing parameters',
+            'required': ['spots']
+        }), 400
+
+    max_spots = current_app.config['FORECAST_BATCH_MAX_SPOTS']
+    if len(spots) > max_spots:
+        return jsonify({
+            'error': 'Too many spots',
+            'max_spots': max_spots
+        }), 400
+
+    # Group spots by the model that covers them so each grid is read once
+    errors = []
+    groups = {}
+    for index, spot in enumerate(spots):
+        parsed, error = _parse_spot(index, spot)
+        if error:
+            errors.append(error)
+            continue
+        model = select_model(parsed[1])
+        if model is None:
+            errors.append({'index': index, 'error': 'Location is outside every forecast model grid'})
+            continue
+        groups.setdefault(model.name, (model, []))[1].append(parsed)
+
+    current_time = datetime.now(pytz.UTC)
+
+    def generate():
+        for error in errors:
+            yield current_app.json.dumps(error) + '\n'
+
+        for model, group in groups.values():
+            try:
+                end_time = current_time + timedelta(days=max(days for _, _, days, _ in group))
+                grid_run = get_grid_store().current(model, int(model.time_index(end_time)))
+                with span('extract'):
+                    times, values, inside = grid_run.extract(
+                        [location.latitude for _, location, _, _ in group],
+                        [location.absolute_longitude for _, location, _, _ in group],
+                        current_time,
+                        end_time
+                    )
+            except Exception as e:
+                for index, _, _, _ in group:
+                    yield current_app.json.dumps({'index': index, 'error': str(e)}) + '\n'
+                continue
+
+            for point, (index, location, days, params) in enumerate(group):
+                result = {
+                    'index': index,
+                    'location': dict(latitude=location.latitude, longitude=location.longitude, **params),
+                    'model': model.name
+                }
+                if not inside[point]:
+                    result['error'] = 'Location is outside the forecast model grid'
+                    yield current_app.json.dumps(result) + '\n'
+                    continue
+
+                # Each spot keeps only its own horizon out of the shared extraction
+                count = int(np.searchsorted(times, (current_time + timedelta(days=days)).timestamp()))
+                spot_values = {key: series[:, :count] for key, series in values.items()}
+                buoy_data = model.to_buoy_data(grid_run.to_grib_data(times[:count], spot_values, point))
+                result['forecasts'] = format_spot_forecasts(buoy_data, params)
+                yield current_app.json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -0,0 +1,151 @@
+from flask import Blueprint, current_app, jsonify
+from datetime import datetime, timedelta
+import time
+import pytz
+from app.services import conditional, get_cache, get_grid_store, get_spot_reports, get_station_catalog
+from app.services.rate_limit import UpstreamBudgetExceeded, upstream_busy_response
+from app.services.tides import day_start, fetch_tide_data_any_datum, harmonic_model
+from app.services.wave_models import select_model
+from .buoy_routes import fetch_latest_readings
+from .forecast_routes import spot_forecast
+from .tide_routes import fetch_window, format_tides, max_days
+
+bp = Blueprint('spots', __name__, url_prefix='/api/spots')
+
+# Tide curve resolution in spot reports
+REPORT_TIDE_INTERVAL = 'hourly'
+
+
+def forecast_version(spot):
+    # The forecast window starts at the current hour, so it moves hourly as well as per model
+    # run. The run is the one build_forecast will read, which is not always the newest.
+    model = select_model(spot.location)
+    if model is None:
+        return None
+    current_time = datetime.now(pytz.UTC)
+    end_time = current_time + timedelta(hours=current_app.config['SPOT_FORECAST_HOURS'])
+    grid_run = get_grid_store().current(model, int(model.time_index(end_time)))
+    return f"{model.name}:{grid_run.meta['run']}:{current_time.strftime('%Y%m%d%H')}"
+
+
+def build_forecast(spot):
+    model = select_model(spot.location)
+    if model is None:
+        return {'error': 'Location is outside every forecast model grid'}
+    current_time = datetime.now(pytz.UTC)
+    end_time = current_time + timedelta(hours=current_app.config['SPOT_FORECAST_HOURS'])
+
+    grid_run = get_grid_store().current(model, int(model.time_index(end_time)))
+    forecasts = spot_forecast(model, grid_run, spot.location, spot.params, current_time, end_time)
+    if forecasts is None:
+        return {'error': 'Location is outside the forecast model grid'}
+
+    return {
+        'model': model.name,
+        'run': grid_run.meta['run'],
+        'forecasts': forecasts
+    }
+
+
+def tides_version(spot):
+    return f"{spot.tide_station}:{datetime.now(pytz.UTC).date().isoformat()}"
+
+
+def build_tides(spot):
+    if not spot.tide_station:
+        return None
+
+    station = get_station_catalog().find_tide_station(spot.tide_station)
+    if not station:
+        return {'error': 'Tide station not found', 'station_id': spot.tide_station}
+
+    # Whole UTC days, so the section only changes once a day
+    days = min(current_app.config['SPOT_TIDE_DAYS'], max_days(station.station_id))
+    start_time = day_start(datetime.now(pytz.UTC).date())
+    end_time = start_time + timedelta(days=days)
+
+    result, used_datum = fetch_tide_data_any_datum(
+        station.station_id, *fetch_window(start_time, end_time, REPORT_TIDE_INTERVAL)
+    )
+    if not result:
+        raise RuntimeError(f'Failed to fetch tide data for station {station.station_id}')
+
+    tide_events, tide_data = result
+    tides, predictions = format_tides(
+        tide_events, tide_data, start_time, end_time, REPORT_TIDE_INTERVAL, used_datum,
+        harmonic_model(station.station_id, used_datum)
+    )
+    return {
+        'station': {
+            'id': station.station_id,
+            'name': station.name,
+            'location': {
+                'latitude': station.location.latitude,
+                'longitude': station.location.longitude
+            },
+            'distance_km': spot.location.distance(station.location) / 1000
+        },
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'datum': used_datum,
+        'interval': REPORT_TIDE_INTERVAL,
+        'tides': tides,
+        'predictions': predictions
+    }
+
+
+def buoys_version(spot):
+    # Readings are refetched once per buoy cache period
+    ttl = max(1, get_cache().ttl_for('buoy'))
+    return f"{','.join(spot.buoys)}:{int(time.time() // ttl)}"
+
+
+def build_buoys(spot):
+    catalog = get_station_catalog()
+    latest = fetch_latest_readings(spot.buoys)
+
+    stations = []
+    for station_id in spot.buoys:
+        station = catalog.find_buoy_station(station_id)
+        entry = {'id': station_id, 'name': None, 'distance_km': None}
+        if station:
+            entry['name'] = station.name
+            entry['distance_km'] = spot.location.distance(station.location) / 1000
+        entry.update(latest[station_id])
+        stations.append(entry)
+    return stations
+
+
+REPORT_SECTIONS = [
+    ('forecast', forecast_version, build_forecast),
+    ('tides', tides_version, build_tides),
+    ('buoys', buoys_version, build_buoys)
+]
+
+
+@bp.route('')
+def list_spots():
+    return jsonify({'spots': [spot.describe() for spot in get_spot_reports().registry]})
+
+
+@bp.route('/<string:spot_id>')
+def get_spot(spot_id):
+    try:
+        reports = get_spot_reports()
+        spot = reports.registry.get(spot_id)
+        if not spot:
+            return jsonify({'error': 'Spot not found'}), 404
+
+        report = reports.report(spot)
+        not_modified = conditional('spots', report.etag, last_modified=report.built_at)
+        if not_modified:
+            return not_modified
+
+        return current_app.response_class(report.body, mimetype='application/json')
+    except UpstreamBudgetExceeded as e:
+        return upstream_busy_response(e)
+    except Exception as e:
+        return jsonify({
+            'error': 'Server error',
+            'details': str(e)
+        }), 500
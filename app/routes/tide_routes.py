@@ -1,35 +1,74 @@
-from flask import Blueprint, jsonify, request
-from surfpy import Location, TideStations, TideStation
+from flask import Blueprint, current_app, jsonify, request
+from surfpy import Location, TideStation
 from datetime import datetime, timedelta
 import pytz
-from functools import lru_cache
+from app.services import conditional, get_station_catalog
+from app.services.metrics import span
+from app.services.rate_limit import UpstreamBudgetExceeded, upstream_busy_response
+from app.services.tides import (
+    CURVE_PADDING, TIDE_INTERVALS, as_utc, curve_predictions, day_start, fetch_tide_data,
+    fetch_tide_data_any_datum, harmonic_model, sample_times, tide_curve
+)
 
-bp = Blueprint('tides', __name__, url_prefix='/api/tides')
-
-
-# Cache for tide data
-@lru_cache(maxsize=128)
-def fetch_tide_data(station_id, start_time_str, end_time_str, datum):
-    try:
-        stations = TideStations()
-        stations.fetch_stations()
-        station = stations.find_station(station_id)
+# Longest window NOAA is asked for; locally predicted stations go up to TIDE_MAX_DAYS
+UPSTREAM_MAX_DAYS = 10
 
-        if not station:
-            return None
+bp = Blueprint('tides', __name__, url_prefix='/api/tides')
 
-        start_time = datetime.fromisoformat(start_time_str)
-        end_time = datetime.fromisoformat(end_time_str)
 
-        return station.fetch_tide_data(
-            start_time,
-            end_time,
-            datum=datum,
-            interval=TideStation.DataInterval.high_low
-        )
-    except Exception as e:
-        print(f"Error fetching tide data: {str(e)}")
-        return None
+def invalid_interval_response(interval):
+    return jsonify({
+        'error': 'Invalid parameters',
+        'details': f'Unknown interval {interval!r}, expected one of {", ".join(TIDE_INTERVALS)}'
+    }), 400
+
+
+def max_days(station_id):
+    if harmonic_model(station_id) is not None:
+        return current_app.config['TIDE_MAX_DAYS']
+    return UPSTREAM_MAX_DAYS
+
+
+def fetch_window(start_time, end_time, interval):
+    # A synthesized curve needs the high or low just outside the window on each side
+    if interval:
+        return start_time - CURVE_PADDING, end_time + CURVE_PADDING
+    return start_time, end_time
+
+
+def format_tides(tide_events, tide_data, start_time, end_time, interval, datum, model=None):
+    # Returns (tides, predictions). With an interval the predictions come from the station's
+    # harmonic model, or are interpolated from the high/low events when it has none.
+    tides = []
+    predictions = []
+
+    if interval and model is not None:
+        with span('harmonics'):
+            samples = sample_times(start_time, end_time, TIDE_INTERVALS[interval])
+            predictions = curve_predictions(samples, model.predict(samples, datum), datum)
+        tide_events = [event for event in tide_events or [] if start_time <= as_utc(event.date) <= end_time]
+    elif interval:
+        with span('interpolate'):
+            samples, heights = tide_curve(tide_events or [], start_time, end_time, TIDE_INTERVALS[interval])
+            datum = next((event.water_level_datum for event in tide_events or [] if event.water_level_datum), datum)
+            predictions = curve_predictions(samples, heights, datum)
+        tide_events = [event for event in tide_events or [] if start_time <= as_utc(event.date) <= end_time]
+    elif tide_data:
+        predictions = [{
+            'timestamp': pred.date.isoformat(),
+            'height': pred.water_level,
+            'datum': pred.water_level_datum
+        } for pred in tide_data]
+
+    if tide_events:
+        tides = [{
+            'timestamp': event.date.isoformat(),
+            'type': event.tidal_event,
+            'height': event.water_level,
+            'datum': event.water_level_datum
+        } for event in tide_events]
+
+    return tides, predictions
 
 
 @bp.route('/location')
@@ -63,41 +102,43 @@ def get_tides():
 
         # Create location and get time range
         location = Location(lat, lon)
-        days = min(max(1, int(request.args.get('days', '3'))), 10)  # Limit between 1-10 days
-        start_time = datetime.now(pytz.UTC)
-        end_time = start_time + timedelta(days=days)
+        days = max(1, int(request.args.get('days', '3')))
+        # Whole UTC days, so the body matches the per-day validator below
+        start_time = day_start(datetime.now(pytz.UTC).date())
+        interval = request.args.get('interval')
+        if interval is not None and interval not in TIDE_INTERVALS:
+            return invalid_interval_response(interval)
 
         # Find nearest station
-        stations = TideStations()
-        if not stations.fetch_stations():
+        snapshot = get_station_catalog().tide_snapshot()
+        if not snapshot:
             return jsonify({
                 'error': 'Failed to fetch tide stations'
             }), 500
 
-        station = stations.find_closest_station(location)
+        with span('search'):
+            closest = snapshot.index.nearest(location, 1)
+        station, distance = closest[0] if closest else (None, None)
         if not station:
             return jsonify({
                 'error': 'No tide station found near location',
                 'location': {'latitude': lat, 'longitude': lon}
             }), 404
 
-        # Try different datums in order of preference
-        result = None
-        used_datum = None
-        for datum in [
-            TideStation.TideDatum.mean_lower_low_water,
-            TideStation.TideDatum.mean_sea_level,
-            TideStation.TideDatum.mean_tide_level
-        ]:
-            result = fetch_tide_data(
-                station.station_id,
-                start_time.isoformat(),
-                end_time.isoformat(),
-                datum
+        # Up to 10 days from NOAA, longer where the station is predicted locally
+        days = min(days, max_days(station.station_id))
+        end_time = start_time + timedelta(days=days)
+
+        # Predictions are fixed per station and UTC day window
+        not_modified = conditional('tide', station.station_id, start_time.date())
+        if not_modified:
+            return not_modified
+
+        # Use the datum learned for this station, or probe them all concurrently on first contact
+        with span('fetch'):
+            result, used_datum = fetch_tide_data_any_datum(
+                station.station_id, *fetch_window(start_time, end_time, interval)
             )
-            if result:
-                used_datum = datum
-                break
 
         if not result:
             return jsonify({
@@ -117,7 +158,7 @@ def get_tides():
                     'latitude': station.location.latitude,
                     'longitude': station.location.longitude
                 },
-                'distance_km': location.distance(station.location) / 1000
+                'distance_km': distance / 1000
             },
             'request': {
                 'latitude': lat,
@@ -125,29 +166,23 @@ def get_tides():
                 'days': days,
                 'start_time': start_time.isoformat(),
                 'end_time': end_time.isoformat(),
-                'datum': used_datum
+                'datum': used_datum,
+                'interval': interval
             },
             'tides': [],
             'predictions': []
         }
 
-        if tide_events:
-            response['tides'] = [{
-                'timestamp': event.date.isoformat(),
-                'type': event.tidal_event,
-                'height': event.water_level,
-                'datum': event.water_level_datum
-            } for event in tide_events]
-
-        if tide_data:
-            response['predictions'] = [{
-                'timestamp': pred.date.isoformat(),
-                'height': pred.water_level,
-                'datum': pred.water_level_datum
-            } for pred in tide_data]
+        response['tides'], response['predictions'] = format_tides(
+            tide_events, tide_data, start_time, end_time, interval, used_datum,
+            harmonic_model(station.station_id, used_datum)
+        )
 
-        return jsonify(response)
+        with span('serialize'):
+            return jsonify(response)
 
+    except UpstreamBudgetExceeded as e:
+        return upstream_busy_response(e)
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
         return jsonify({
@@ -160,31 +195,41 @@ def get_tides():
 def get_station_tides(station_id):
     try:
         # Validate and get parameters
-        days = min(max(1, int(request.args.get('days', '3'))), 10)
-        start_time = datetime.now(pytz.UTC)
-        end_time = start_time + timedelta(days=days)
+        days = max(1, int(request.args.get('days', '3')))
+        # Whole UTC days, so the body matches the per-day validator below
+        start_time = day_start(datetime.now(pytz.UTC).date())
+        interval = request.args.get('interval')
+        if interval is not None and interval not in TIDE_INTERVALS:
+            return invalid_interval_response(interval)
 
         # Get station data
-        stations = TideStations()
-        if not stations.fetch_stations():
+        catalog = get_station_catalog()
+        if not catalog.tide_stations():
             return jsonify({
                 'error': 'Failed to fetch tide stations'
             }), 500
 
-        station = stations.find_station(station_id)
+        station = catalog.find_tide_station(station_id)
         if not station:
             return jsonify({
                 'error': 'Station not found',
                 'station_id': station_id
             }), 404
 
+        days = min(days, max_days(station.station_id))
+        end_time = start_time + timedelta(days=days)
+
+        not_modified = conditional('tide', station.station_id, start_time.date())
+        if not_modified:
+            return not_modified
+
         # Fetch tide data with caching
-        result = fetch_tide_data(
-            station_id,
-            start_time.isoformat(),
-            end_time.isoformat(),
-            TideStation.TideDatum.mean_lower_low_water
-        )
+        with span('fetch'):
+            result = fetch_tide_data(
+                station_id,
+                *fetch_window(start_time, end_time, interval),
+                TideStation.TideDatum.mean_lower_low_water
+            )
 
         if not result:
             return jsonify({
@@ -207,29 +252,23 @@ def get_station_tides(station_id):
                 'days': days,
                 'start_time': start_time.isoformat(),
                 'end_time': end_time.isoformat(),
-                'datum': TideStation.TideDatum.mean_lower_low_water
+                'datum': TideStation.TideDatum.mean_lower_low_water,
+                'interval': interval
             },
             'tides': [],
             'predictions': []
         }
 
-        if tide_events:
-            response['tides'] = [{
-                'timestamp': event.date.isoformat(),
-                'type': event.tidal_event,
-                'height': event.water_level,
-                'datum': event.water_level_datum
-            } for event in tide_events]
-
-        if tide_data:
-            response['predictions'] = [{
-                'timestamp': pred.date.isoformat(),
-                'height': pred.water_level,
-                'datum': pred.water_level_datum
-            } for pred in tide_data]
+        response['tides'], response['predictions'] = format_tides(
+            tide_events, tide_data, start_time, end_time, interval, TideStation.TideDatum.mean_lower_low_water,
+            harmonic_model(station_id, TideStation.TideDatum.mean_lower_low_water)
+        )
 
-        return jsonify(response)
+        with span('serialize'):
+            return jsonify(response)
 
+    except UpstreamBudgetExceeded as e:
+        return upstream_busy_response(e)
     except ValueError as e:
         return jsonify({
             'error': 'Invalid parameters',
@@ -252,17 +291,19 @@ def get_docs():
                 'parameters': {
                     'lat': 'latitude (-90 to 90)',
                     'lon': 'longitude (-180 to 180)',
-                    'days': 'number of days to forecast (1-10, default: 3)'
+                    'days': 'number of days to forecast (default: 3, max 10; more for locally predicted stations)',
+                    'interval': 'optional curve resolution: 6min, 15min or hourly'
                 },
-                'example': '/api/tides/location?lat=41.4302&lon=-71.455&days=3'
+                'example': '/api/tides/location?lat=41.4302&lon=-71.455&days=3&interval=15min'
             },
             'station': {
                 'path': '/api/tides/station/<station_id>',
                 'method': 'GET',
                 'parameters': {
-                    'days': 'number of days to forecast (1-10, default: 3)'
+                    'days': 'number of days to forecast (default: 3, max 10; more for locally predicted stations)',
+                    'interval': 'optional curve resolution: 6min, 15min or hourly'
                 },
-                'example': '/api/tides/station/8454658?days=3'
+                'example': '/api/tides/station/8454658?days=3&interval=hourly'
             }
         }
     })
@@ -271,9 +312,7 @@ def get_docs():
 @bp.route('/station/<station_id>/debug')
 def debug_station(station_id):
     try:
-        stations = TideStations()
-        stations.fetch_stations()
-        station = stations.find_station(station_id)
+        station = get_station_catalog().find_tide_station(station_id)
 
         if not station:
             return jsonify({
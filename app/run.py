@@ -1,15 +1,102 @@
+import time
+
+# Measured from here, so startup metrics show what importing the routes and services costs
+_import_started = time.perf_counter()
+
 from flask import Flask, jsonify
 from flask_cors import CORS
-from app.routes import buoy_routes, forecast_routes, tide_routes
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app.config import Config
+from app.routes import buoy_routes, forecast_routes, spot_routes, tide_routes
+from app.routes.buoy_routes import poll_readings
+from app.routes.spot_routes import REPORT_SECTIONS
+from app.services import (
+    StationCatalog, create_buoy_archive, create_buoy_poller, create_cache, create_fanout, create_grib_store,
+    create_grid_store, create_harmonic_store, create_http_cache, create_metrics, create_rate_limiter, create_session,
+    create_spot_reports, create_upstream_limiter, create_wave_models
+)
+from app.services.serialization import OrjsonProvider, StdlibJsonProvider, orjson
 
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
-def create_app():
+
+def create_app(config=Config, start=True):
+    started = time.perf_counter()
     app = Flask(__name__)
+    app.config.from_object(config)
     CORS(app)
 
+    # Client addresses from X-Forwarded-For, set by the configured number of reverse proxies
+    if app.config['TRUSTED_PROXY_COUNT']:
+        proxies = app.config['TRUSTED_PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+    # orjson is optional; without it the stdlib fallback writes the same JSON (NaN and
+    # Infinity as null in both), just slower
+    app.json = OrjsonProvider(app) if orjson is not None else StdlibJsonProvider(app)
+
+    # Request timing and Server-Timing headers; registered first so it sees rate-limited requests too
+    metrics = create_metrics(app)
+    app.extensions['metrics'] = metrics
+
+    # Inbound per-client limit, checked before any route runs
+    rate_limiter = create_rate_limiter(app)
+    app.extensions['rate_limiter'] = rate_limiter
+
+    # Budget and concurrency cap on every call we make to NOAA
+    upstream_limiter = create_upstream_limiter(app.config, metrics)
+    app.extensions['upstream_limiter'] = upstream_limiter
+
+    # Shared station catalog, restored from the last saved snapshot and refreshed in the background
+    station_catalog = StationCatalog(
+        refresh_interval=app.config['STATION_REFRESH_INTERVAL'],
+        retry_interval=app.config['STATION_RETRY_INTERVAL'],
+        upstream_limiter=upstream_limiter,
+        snapshot_dir=app.config['STATION_SNAPSHOT_DIR']
+    )
+    app.extensions['station_catalog'] = station_catalog
+    restore_started = time.perf_counter()
+    station_catalog.restore()
+    metrics.record_startup('station_restore', time.perf_counter() - restore_started)
+
+    cache = create_cache(app.config)
+    app.extensions['cache'] = cache
+    app.extensions['fanout'] = create_fanout(app.config)
+
+    buoy_archive = create_buoy_archive(app.config)
+    app.extensions['buoy_archive'] = buoy_archive
+
+    http_session = create_session(app.config['UPSTREAM_POOL_SIZE'])
+    app.extensions['http_session'] = http_session
+
+    # Pushes new buoy readings to subscribers; its thread starts with the first subscription
+    buoy_poller = create_buoy_poller(app, poll_readings, http_session, upstream_limiter)
+    app.extensions['buoy_poller'] = buoy_poller
+
+    grib_store = create_grib_store(app.config, http_session, upstream_limiter)
+    app.extensions['grib_store'] = grib_store
+
+    # Every surfpy wave model, indexed by grid extent
+    wave_models = create_wave_models(app.config)
+    app.extensions['wave_models'] = wave_models
+
+    grid_store = create_grid_store(app.config, grib_store)
+    app.extensions['grid_store'] = grid_store
+
+    harmonic_store = create_harmonic_store(app.config, http_session, upstream_limiter)
+    app.extensions['harmonic_store'] = harmonic_store
+
+    http_cache = create_http_cache(app)
+    app.extensions['http_cache'] = http_cache
+
+    # Named spots, their reports rebuilt in the background as model runs, tide days and buoy readings move on
+    spot_reports = create_spot_reports(app, REPORT_SECTIONS)
+    app.extensions['spot_reports'] = spot_reports
+
     # Register blueprints
     app.register_blueprint(buoy_routes)
     app.register_blueprint(forecast_routes)
+    app.register_blueprint(spot_routes)
     app.register_blueprint(tide_routes)
 
     @app.route('/')
@@ -25,13 +112,71 @@ def create_app():
             "available_endpoints": {
                 "buoys": "/api/buoys/nearby/<lat>/<lon>",
                 "forecast": "/api/forecast/<lat>/<lon>",
+                "spots": "/api/spots/<spot_id>",
                 "tides": "/api/tides/<lat>/<lon>"
             }
         })
 
+    @app.route('/api/status')
+    def status():
+        return jsonify({
+            'stations': station_catalog.stats(),
+            'cache': cache.stats(),
+            'buoy_archive': buoy_archive.stats(),
+            'buoy_poller': buoy_poller.stats(),
+            'grib_store': grib_store.stats(),
+            'grid_store': grid_store.stats(),
+            'wave_models': wave_models.stats(),
+            'harmonics': harmonic_store.stats(),
+            'http_cache': http_cache.stats(),
+            'spots': spot_reports.stats(),
+            'rate_limit': rate_limiter.stats() if rate_limiter else None,
+            'upstream': upstream_limiter.stats(),
+            'startup': metrics.startup
+        })
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        readings = []
+        lookups = {}
+        for (source, result), count in sorted(cache.source_counts().items()):
+            readings.append(('surfpy_cache_requests_total', 'counter', count, {'source': source, 'result': result}))
+            if result in ('hits', 'negative_hits', 'misses'):
+                hits, total = lookups.get(source, (0, 0))
+                lookups[source] = (hits + (count if result != 'misses' else 0), total + count)
+        for source, (hits, total) in sorted(lookups.items()):
+            readings.append(('surfpy_cache_hit_ratio', 'gauge', round(hits / total, 4), {'source': source}))
+
+        grib_stats = grib_store.stats()
+        readings.append(('surfpy_grib_store_bytes', 'gauge', grib_stats['bytes'], {}))
+        readings.append(('surfpy_grib_store_files', 'gauge', grib_stats['files'], {}))
+        for name, catalog in station_catalog.stats().items():
+            readings.append(('surfpy_station_catalog_age_seconds', 'gauge', catalog['age_seconds'], {'catalog': name}))
+        for phase, seconds in metrics.startup.items():
+            readings.append(('surfpy_startup_seconds', 'gauge', seconds, {'phase': phase}))
+
+        return app.response_class(metrics.render(readings), mimetype='text/plain; version=0.0.4')
+
+    metrics.record_startup('imports', IMPORT_SECONDS)
+    metrics.record_startup('create_app', time.perf_counter() - started)
+    if start:
+        start_background(app)
     return app
 
 
+def preload(app):
+    # Runs in a pre-fork master: everything loaded here is shared copy-on-write by the workers
+    started = time.perf_counter()
+    app.extensions['station_catalog'].preload()
+    app.extensions['metrics'].record_startup('station_preload', time.perf_counter() - started)
+
+
+def start_background(app):
+    # Threads do not survive fork, so a preloaded app starts them in each worker after forking
+    app.extensions['station_catalog'].start()
+    app.extensions['spot_reports'].start()
+
+
 if __name__ == '__main__':
     app = create_app()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,52 @@
+from gunicorn.app.base import BaseApplication
+
+from app.config import Config
+
+
+class SurfpyApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Imported here so the gevent worker can monkey-patch sockets before requests/ssl load
+        from app.run import create_app, preload
+        if not self.cfg.preload_app:
+            return create_app()
+
+        app = create_app(start=False)
+        preload(app)
+        return app
+
+
+def post_fork(server, worker):
+    # The preloaded app's background threads stayed behind in the master
+    from app.run import start_background
+    start_background(worker.app.wsgi())
+
+
+def main():
+    options = {
+        'bind': Config.SERVER_BIND,
+        'workers': Config.SERVER_WORKERS,
+        'worker_class': Config.SERVER_WORKER_CLASS,
+        'worker_connections': Config.SERVER_WORKER_CONNECTIONS,
+        'timeout': Config.SERVER_TIMEOUT,
+        'keepalive': Config.SERVER_KEEPALIVE
+    }
+    if Config.SERVER_PRELOAD:
+        # The app now loads in the master, so the master patches before it does
+        if Config.SERVER_WORKER_CLASS == 'gevent':
+            from gevent import monkey
+            monkey.patch_all()
+        options.update(preload_app=True, post_fork=post_fork)
+
+    SurfpyApplication(options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+from .buoy_archive import BuoyArchive, create_buoy_archive, get_buoy_archive
+from .buoy_poller import BuoyPoller, create_buoy_poller, get_buoy_poller
+from .cache import Cache, cached, create_cache, get_cache
+from .fanout import FanOut, create_fanout, get_fanout
+from .grib_store import GribStore, create_grib_store, get_grib_store
+from .grid_store import GridRun, GridStore, create_grid_store, get_grid_store
+from .harmonics import HarmonicModel, HarmonicStore, create_harmonic_store, get_harmonic_store
+from .http import create_session, get_session
+from .http_cache import HttpCache, conditional, create_http_cache
+from .metrics import Metrics, create_metrics, get_metrics, span
+from .rate_limit import (
+    RateLimiter, UpstreamBudgetExceeded, UpstreamLimiter, create_rate_limiter, create_upstream_limiter,
+    get_upstream_limiter
+)
+from .spots import SpotRegistry, SpotReports, create_spot_reports, get_spot_reports
+from .station_catalog import StationCatalog, get_station_catalog
+from .wave_models import WaveModelRegistry, create_wave_models, get_wave_models, select_model
+
+__all__ = [
+    'BuoyArchive', 'create_buoy_archive', 'get_buoy_archive',
+    'BuoyPoller', 'create_buoy_poller', 'get_buoy_poller',
+    'Cache', 'cached', 'create_cache', 'get_cache',
+    'FanOut', 'create_fanout', 'get_fanout',
+    'GribStore', 'create_grib_store', 'get_grib_store',
+    'GridRun', 'GridStore', 'create_grid_store', 'get_grid_store',
+    'HarmonicModel', 'HarmonicStore', 'create_harmonic_store', 'get_harmonic_store',
+    'create_session', 'get_session',
+    'HttpCache', 'conditional', 'create_http_cache',
+    'Metrics', 'create_metrics', 'get_metrics', 'span',
+    'RateLimiter', 'UpstreamBudgetExceeded', 'UpstreamLimiter', 'create_rate_limiter', 'create_upstream_limiter',
+    'get_upstream_limiter',
+    'SpotRegistry', 'SpotReports', 'create_spot_reports', 'get_spot_reports',
+    'StationCatalog', 'get_station_catalog',
+    'WaveModelRegistry', 'create_wave_models', 'get_wave_models', 'select_model'
+]
\ No newline at end of file
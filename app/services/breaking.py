@@ -0,0 +1,134 @@
+import numpy as np
+
+GRAVITY = 9.81
+
+# Spot parameters used when a request leaves them out: model point depth (m), the compass
+# direction the beach faces and the beach slope (rise over run)
+DEFAULT_SPOT = {
+    'depth': 30.0,
+    'angle': 145.0,
+    'slope': 0.02
+}
+
+# Bisection steps for the breaking depth; 40 halvings resolve it to well under a millimetre
+BREAKING_ITERATIONS = 40
+
+
+def swell_arrays(readings):
+    # (hours, components) arrays of height, period and direction, NaN-padded. Readings
+    # without swell partitions fall back to their wave summary as a single component.
+    components = [
+        list(reading.swell_components) or ([reading.wave_summary] if reading.wave_summary else [])
+        for reading in readings
+    ]
+    width = max((len(swells) for swells in components), default=0) or 1
+
+    def column(attribute):
+        rows = [
+            [getattr(swell, attribute) for swell in swells] + [None] * (width - len(swells))
+            for swells in components
+        ]
+        return np.array(rows, dtype=np.float64).reshape(len(components), width)
+
+    return column('wave_height'), column('period'), column('direction')
+
+
+def wavelength(periods, depth):
+    # Linear dispersion, using Fenton and McKee's explicit approximation
+    deep = GRAVITY * periods ** 2 / (2 * np.pi)
+    return deep * np.tanh((2 * np.pi * depth / deep) ** 0.75) ** (2 / 3)
+
+
+def _propagation(periods, depth):
+    # Phase and group speed at depth
+    length = wavelength(periods, depth)
+    kh2 = 4 * np.pi * depth / length
+    with np.errstate(over='ignore'):
+        n = 0.5 * (1 + kh2 / np.sinh(kh2))
+    celerity = length / periods
+    return celerity, n * celerity
+
+
+def _height_factor(periods, incident, depth):
+    # Shoaling times refraction coefficient at depth, relative to deep water
+    deep_celerity = GRAVITY * periods / (2 * np.pi)
+    celerity, group_velocity = _propagation(periods, depth)
+    shoaling = np.sqrt(0.5 * deep_celerity / group_velocity)
+    refracted = np.arcsin(np.clip(celerity / deep_celerity * np.sin(incident), -1, 1))
+    refraction = np.sqrt(np.cos(incident) / np.cos(refracted))
+    return shoaling * refraction
+
+
+def breaking_heights(heights, periods, directions, depth, angle, slope):
+    # Breaking height range per forecast hour from (hours, components) swell arrays, all in
+    # metric units. Each component is carried from the model point (depth metres deep) toward
+    # the beach by linear shoaling and refraction until it meets Weggel's breaker criterion for
+    # the beach slope; the hour's range comes from its largest breaker. Hours without any swell
+    # data are NaN, hours whose swell all travels away from the beach are flat (0).
+    heights = np.asarray(heights, dtype=np.float64)
+    periods = np.asarray(periods, dtype=np.float64)
+    directions = np.asarray(directions, dtype=np.float64)
+
+    valid = np.isfinite(heights) & np.isfinite(periods) & np.isfinite(directions) & (periods > 0)
+    incident = np.radians((directions - angle + 180) % 360 - 180)
+    breaking = valid & (np.abs(incident) < np.pi / 2) & (heights > 0)
+
+    heights = np.where(breaking, heights, 0.0)
+    periods = np.where(breaking, periods, 1.0)
+    incident = np.where(breaking, incident, 0.0)
+
+    # Weggel (1972) breaker index: Hb = b * d / (1 + a * d / (g T^2))
+    a = 43.8 * (1 - np.exp(-19 * slope))
+    b = 1.56 / (1 + np.exp(-19.5 * slope))
+    gt2 = GRAVITY * periods ** 2
+
+    def breaker_height(d):
+        return b * d / (1 + a * d / gt2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        deep_height = heights / _height_factor(periods, incident, depth)
+
+        # Swell already past the breaker criterion at the model point breaks there
+        broken = heights >= breaker_height(depth)
+        low = np.full(heights.shape, depth * 1e-4)
+        high = np.full(heights.shape, float(depth))
+        for _ in range(BREAKING_ITERATIONS):
+            middle = (low + high) / 2
+            unbroken = deep_height * _height_factor(periods, incident, middle) < breaker_height(middle)
+            high = np.where(unbroken, middle, high)
+            low = np.where(unbroken, low, middle)
+
+        height = np.where(broken, np.minimum(heights, breaker_height(depth)), breaker_height(high))
+        height = np.where(breaking, height, 0.0)
+
+    has_swell = valid.any(axis=1)
+    maximum = np.where(has_swell, height.max(axis=1, initial=0.0), np.nan)
+    return maximum / 1.5, maximum
+
+
+def spot_params(source):
+    # depth, angle and slope from query args or a batch spot, defaulting each one
+    params = {}
+    for name, default in DEFAULT_SPOT.items():
+        try:
+            params[name] = float(source.get(name, default))
+        except (TypeError, ValueError):
+            raise ValueError(f'{name} must be numeric')
+    if not params['depth'] > 0:
+        raise ValueError('depth must be positive')
+    if not 0 < params['slope'] < 1:
+        raise ValueError('slope must be between 0 and 1')
+    params['angle'] %= 360
+    return params
+
+
+def breaking_columns(readings, depth, angle, slope):
+    minimum, maximum = breaking_heights(*swell_arrays(readings), depth, angle, slope)
+    return {
+        'breaking_minimum_height': _values(minimum),
+        'breaking_maximum_height': _values(maximum)
+    }
+
+
+def _values(array):
+    return [None if np.isnan(value) else round(float(value), 2) for value in array]
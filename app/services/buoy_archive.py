@@ -0,0 +1,202 @@
+import calendar
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pytz
+from flask import current_app
+
+# Archived fields: column name -> getter on a surfpy BuoyData reading
+ARCHIVE_COLUMNS = [
+    ('wave_height', lambda reading: reading.wave_summary.wave_height if reading.wave_summary else None),
+    ('wave_period', lambda reading: reading.wave_summary.period if reading.wave_summary else None),
+    ('wave_direction', lambda reading: reading.wave_summary.direction if reading.wave_summary else None),
+    ('wind_speed', lambda reading: reading.wind_speed),
+    ('wind_direction', lambda reading: reading.wind_direction),
+    ('wind_gust', lambda reading: reading.wind_gust),
+    ('pressure', lambda reading: reading.pressure),
+    ('air_temperature', lambda reading: reading.air_temperature),
+    ('water_temperature', lambda reading: reading.water_temperature),
+    ('dewpoint', lambda reading: reading.dewpoint_temperature)
+]
+
+COLUMN_NAMES = [name for name, _ in ARCHIVE_COLUMNS]
+
+# Averaged as angles rather than numbers
+DIRECTION_COLUMNS = {'wave_direction', 'wind_direction'}
+
+# Resampled to the bucket maximum instead of the mean
+PEAK_COLUMNS = {'wind_gust'}
+
+RESAMPLE_INTERVALS = {
+    '1h': 3600,
+    '3h': 3 * 3600,
+    '6h': 6 * 3600,
+    '1d': 86400
+}
+
+# Primary key order makes every station's rows one contiguous, time-ordered range
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS readings (
+    station_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    {', '.join(f'{name} REAL' for name in COLUMN_NAMES)},
+    PRIMARY KEY (station_id, ts)
+) WITHOUT ROWID
+"""
+
+# Stations whose realtime window has been backfilled; having rows alone does not mean that,
+# since /data and the subscription poller archive just the newest readings
+STATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stations (
+    station_id TEXT PRIMARY KEY,
+    backfilled_at INTEGER NOT NULL
+)
+"""
+
+
+def epoch_seconds(date):
+    if date.tzinfo is None:
+        date = pytz.UTC.localize(date)
+    return calendar.timegm(date.utctimetuple())
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
+
+
+class BuoyArchive:
+    # Every buoy observation the service has seen, one row per station and time, in SQLite
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.queries = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Not kept: a pre-fork master must not hand its connection to the workers
+        connection = sqlite3.connect(path, timeout=30)
+        with connection:
+            connection.execute(SCHEMA)
+            connection.execute(STATIONS_SCHEMA)
+        connection.close()
+
+    def _connection(self):
+        # One connection per thread; WAL lets worker processes read while another one appends
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def last_timestamp(self, station_id):
+        row = self._connection().execute(
+            'SELECT MAX(ts) FROM readings WHERE station_id = ?', (station_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def backfilled(self, station_id):
+        row = self._connection().execute(
+            'SELECT 1 FROM stations WHERE station_id = ?', (station_id,)
+        ).fetchone()
+        return row is not None
+
+    def mark_backfilled(self, station_id):
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO stations (station_id, backfilled_at) VALUES (?, ?)',
+                (station_id, int(time.time()))
+            )
+
+    def append(self, station_id, readings):
+        # Stores the readings not archived yet, older ones included; returns how many
+        rows = {}
+        for reading in readings:
+            if not reading.date:
+                continue
+            ts = epoch_seconds(reading.date)
+            if ts not in rows:
+                rows[ts] = (station_id, ts, *(_number(getter(reading)) for _, getter in ARCHIVE_COLUMNS))
+        if not rows:
+            return 0
+
+        with self._connection() as connection:
+            cursor = connection.executemany(
+                f'INSERT OR IGNORE INTO readings (station_id, ts, {", ".join(COLUMN_NAMES)}) '
+                f'VALUES ({", ".join("?" * (len(COLUMN_NAMES) + 2))})',
+                list(rows.values())
+            )
+        with self._lock:
+            self.appended += cursor.rowcount
+        return cursor.rowcount
+
+    def query(self, station_id, start, end):
+        # (times, {column: values}) for start <= ts < end as float arrays, missing values NaN
+        rows = self._connection().execute(
+            f'SELECT ts, {", ".join(COLUMN_NAMES)} FROM readings '
+            'WHERE station_id = ? AND ts >= ? AND ts < ? ORDER BY ts',
+            (station_id, epoch_seconds(start), epoch_seconds(end))
+        ).fetchall()
+        self.queries += 1
+
+        table = np.array(rows, dtype=np.float64).reshape(len(rows), len(COLUMN_NAMES) + 1)
+        return table[:, 0].astype(np.int64), {name: table[:, i + 1] for i, name in enumerate(COLUMN_NAMES)}
+
+    def stats(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = None
+        return {
+            'path': self.path,
+            'bytes': size,
+            'appended': self.appended,
+            'queries': self.queries
+        }
+
+
+def resample(times, columns, step):
+    # Buckets of step seconds aligned to the epoch: circular mean for directions, maximum for
+    # gusts, mean for everything else. Empty buckets are left out.
+    if not len(times):
+        return times, columns
+    buckets = times - times % step
+    edges, inverse = np.unique(buckets, return_inverse=True)
+
+    result = {}
+    for name, values in columns.items():
+        valid = np.isfinite(values)
+        counts = np.bincount(inverse, weights=valid, minlength=len(edges))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if name in DIRECTION_COLUMNS:
+                radians = np.radians(np.where(valid, values, 0.0))
+                sin = np.bincount(inverse, weights=np.sin(radians) * valid, minlength=len(edges))
+                cos = np.bincount(inverse, weights=np.cos(radians) * valid, minlength=len(edges))
+                # Rounded before wrapping, so a mean just below north comes out as 0 rather than 360
+                aggregated = np.round(np.degrees(np.arctan2(sin, cos)), 2) % 360
+            elif name in PEAK_COLUMNS:
+                aggregated = np.full(len(edges), -np.inf)
+                np.maximum.at(aggregated, inverse[valid], values[valid])
+            else:
+                aggregated = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=len(edges)) / counts
+        aggregated[counts == 0] = np.nan
+        result[name] = aggregated
+    return edges, result
+
+
+def create_buoy_archive(config):
+    return BuoyArchive(config['BUOY_ARCHIVE_PATH'])
+
+
+def get_buoy_archive():
+    return current_app.extensions['buoy_archive']
@@ -0,0 +1,279 @@
+import calendar
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from flask import current_app
+
+# Latest readings kept per watched station, for a new subscriber's first event and for
+# clients resuming with Last-Event-ID
+RECENT_READINGS = 24
+
+# Allowance on top of a poll interval and a keepalive for a dropped client to reconnect
+RECONNECT_GRACE = 15
+
+
+def observation_times(text, complete=False):
+    # Observation times in epoch seconds, newest first, from the head of an NDBC realtime
+    # file: '#' header lines, then rows starting YY MM DD hh mm. A row cut off by the end of
+    # a partial read is skipped.
+    lines = text.splitlines()
+    if not complete and not text.endswith('\n'):
+        lines = lines[:-1]
+
+    times = []
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        try:
+            year, month, day, hour, minute = (int(field) for field in line.split()[:5])
+        except ValueError:
+            continue
+        times.append(calendar.timegm((year, month, day, hour, minute, 0)))
+    return times
+
+
+class Subscription:
+    def __init__(self, station_id, backlog, max_queue=100):
+        self.station_id = station_id
+        # (timestamp, reading) pairs to send before anything new
+        self.backlog = backlog
+        self._queue = queue.Queue(max_queue)
+        self.dropped = 0
+
+    def push(self, item):
+        # A client too slow to drain its queue misses readings rather than holding up the poller
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class _Watch:
+    def __init__(self, station_id):
+        self.station_id = station_id
+        self.subscribers = set()
+        self.etag = None
+        self.last_modified = None
+        self.last_timestamp = None
+        self.polled_at = None
+        self.idle_since = None
+        self.recent = deque(maxlen=RECENT_READINGS)
+
+
+class BuoyPoller:
+    # One upstream poll per watched station, however many clients subscribe to it. Each
+    # cycle sends a conditional request for just the head of the station's NDBC realtime
+    # file, where the newest rows are. Only when it shows observations newer than the last
+    # one pushed is surfpy asked for that many readings, which then go to every subscriber.
+    def __init__(self, app, fetch, url_template, session, upstream_limiter=None, interval=60,
+                 probe_bytes=2048, timeout=30, grace=75, max_replay=144):
+        self.app = app
+        # fetch(station_id, count) -> [(timestamp, reading)] for the newest count observations
+        self.fetch = fetch
+        self.url_template = url_template
+        self.session = session
+        self.upstream_limiter = upstream_limiter
+        self.interval = interval
+        self.probe_bytes = probe_bytes
+        self.timeout = timeout
+        # Seconds a watch outlives its last subscriber, so a reconnecting client finds its
+        # buffer and ETag still current
+        self.grace = grace
+        # Most readings fetched to catch up a client resuming from before the buffer
+        self.max_replay = max_replay
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.probes = 0
+        self.not_modified = 0
+        self.fetches = 0
+        self.pushed = 0
+        self.errors = 0
+
+    def start(self):
+        # Started by the first subscription, so it always runs in the worker serving it
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='buoy-poller', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                self.poll_due()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def subscribe(self, station_id, since=None):
+        # since: the last timestamp the client saw; without it only the latest reading is replayed.
+        # Readings pushed while the backlog is built may repeat in it; callers skip what they sent.
+        with self._lock:
+            watch = self._watches.get(station_id)
+            if watch is None:
+                watch = self._watches[station_id] = _Watch(station_id)
+            subscription = Subscription(station_id, [])
+            watch.subscribers.add(subscription)
+            watch.idle_since = None
+            recent = list(watch.recent)
+
+        if since and (not recent or since < recent[0][0]):
+            recent = self._catch_up(watch, since) or recent
+        subscription.backlog = [item for item in recent if item[0] > since] if since else recent[-1:]
+
+        self.start()
+        if watch.polled_at is None:
+            self._wake.set()
+        return subscription
+
+    def _catch_up(self, watch, since):
+        # The buffer starts after since: fetch enough readings to cover the gap and keep the
+        # newest of them as the buffer
+        try:
+            with self.app.app_context():
+                items = self.fetch(watch.station_id, self.max_replay)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error catching up buoy {watch.station_id}: {str(e)}")
+            return None
+
+        self.fetches += 1
+        with self._lock:
+            merged = dict(watch.recent)
+            merged.update(items)
+            readings = sorted(merged.items(), key=lambda item: item[0])
+            watch.recent = deque(readings, maxlen=RECENT_READINGS)
+            if readings:
+                watch.last_timestamp = max(watch.last_timestamp or 0, readings[-1][0])
+        return [item for item in readings if item[0] > since]
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            watch = self._watches.get(subscription.station_id)
+            if watch:
+                watch.subscribers.discard(subscription)
+                if not watch.subscribers:
+                    watch.idle_since = time.time()
+
+    def poll_due(self):
+        now = time.time()
+        with self._lock:
+            for station_id, watch in list(self._watches.items()):
+                if watch.idle_since is not None and now - watch.idle_since > self.grace:
+                    del self._watches[station_id]
+            due = [
+                watch for watch in self._watches.values()
+                if watch.polled_at is None or now - watch.polled_at >= self.interval
+            ]
+
+        for watch in due:
+            try:
+                self.poll(watch)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error polling buoy {watch.station_id}: {str(e)}")
+
+    def _probe(self, watch):
+        # Observation times at the head of the file, or None while it is unchanged
+        url = self.url_template.format(station_id=watch.station_id)
+        headers = {'Range': f'bytes=0-{self.probe_bytes - 1}'}
+        if watch.etag:
+            headers['If-None-Match'] = watch.etag
+        if watch.last_modified:
+            headers['If-Modified-Since'] = watch.last_modified
+
+        slot = self.upstream_limiter.slot('buoy') if self.upstream_limiter else nullcontext()
+        with slot:
+            self.probes += 1
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+            try:
+                if response.status_code == 304:
+                    self.not_modified += 1
+                    return None
+                response.raise_for_status()
+                # Read no further than the probe even from a server that ignores Range
+                head = next(response.iter_content(self.probe_bytes), b'')
+            finally:
+                response.close()
+
+        if self.upstream_limiter:
+            self.upstream_limiter.record_bytes('buoy', len(head))
+        watch.etag = response.headers.get('ETag')
+        watch.last_modified = response.headers.get('Last-Modified')
+        return observation_times(head.decode('ascii', 'replace'), complete=len(head) < self.probe_bytes)
+
+    def poll(self, watch):
+        watch.polled_at = time.time()
+        times = self._probe(watch)
+        if not times:
+            return 0
+
+        last = watch.last_timestamp
+        new = {timestamp for timestamp in times if last is None or timestamp > last}
+        if not new:
+            return 0
+
+        # A new watch starts from the latest reading; after that every newer row is fetched
+        self.fetches += 1
+        readings = sorted(
+            (item for item in self.fetch(watch.station_id, 1 if last is None else len(new))
+             if last is None or item[0] > last),
+            key=lambda item: item[0]
+        )
+        if not readings:
+            return 0
+
+        with self._lock:
+            watch.last_timestamp = readings[-1][0]
+            watch.recent.extend(readings)
+            subscribers = list(watch.subscribers)
+        for subscription in subscribers:
+            for item in readings:
+                subscription.push(item)
+        self.pushed += len(readings) * len(subscribers)
+        return len(readings)
+
+    def stats(self):
+        with self._lock:
+            watches = list(self._watches.values())
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'interval': self.interval,
+            'watched_stations': len(watches),
+            'subscribers': sum(len(watch.subscribers) for watch in watches),
+            'probes': self.probes,
+            'not_modified': self.not_modified,
+            'fetches': self.fetches,
+            'pushed': self.pushed,
+            'dropped': sum(subscription.dropped for watch in watches for subscription in watch.subscribers),
+            'errors': self.errors
+        }
+
+
+def create_buoy_poller(app, fetch, session, upstream_limiter=None):
+    return BuoyPoller(
+        app,
+        fetch,
+        app.config['BUOY_POLL_URL'],
+        session,
+        upstream_limiter=upstream_limiter,
+        interval=app.config['BUOY_POLL_INTERVAL'],
+        probe_bytes=app.config['BUOY_POLL_PROBE_BYTES'],
+        grace=app.config['BUOY_POLL_INTERVAL'] + app.config['BUOY_SUBSCRIBE_KEEPALIVE'] + RECONNECT_GRACE,
+        max_replay=app.config['BUOY_SUBSCRIBE_MAX_REPLAY']
+    )
+
+
+def get_buoy_poller():
+    return current_app.extensions['buoy_poller']
@@ -0,0 +1,294 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app
+
+from .metrics import span
+from .rate_limit import UpstreamBudgetExceeded
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class _Negative:
+    # Stored in place of a failed (None) result so it can expire on its own TTL
+    pass
+
+
+NEGATIVE = _Negative()
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, allow_stale=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            fresh_until, stale_until, value = entry
+            now = time.monotonic()
+            if stale_until <= now:
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            if fresh_until <= now and not allow_stale:
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        # Entries past ttl are only returned to allow_stale lookups, until stale_ttl runs out too
+        with self._lock:
+            now = time.monotonic()
+            self._entries[key] = (now + ttl, now + ttl + stale_ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+class RedisBackend:
+    def __init__(self, url, prefix='surfpy-api:'):
+        if redis is None:
+            raise RuntimeError('REDIS_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key, allow_stale=False):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        fresh_until, value = pickle.loads(raw)
+        if fresh_until <= time.time() and not allow_stale:
+            return None
+        return NEGATIVE if value is None else value
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        raw = pickle.dumps((time.time() + ttl, None if value is NEGATIVE else value))
+        self.client.set(self.prefix + key, raw, ex=max(1, int(ttl + stale_ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def stats(self):
+        # Redis tracks its own evictions; expose them when the server allows it
+        stats = {'backend': 'redis'}
+        try:
+            info = self.client.info('stats')
+            stats['evictions'] = info.get('evicted_keys')
+            stats['expirations'] = info.get('expired_keys')
+        except Exception as e:
+            stats['error'] = str(e)
+        return stats
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Cache:
+    def __init__(self, backend, ttls=None, default_ttl=300, negative_ttl=30, stale_ttl=0, load_wait=35):
+        self.backend = backend
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        # Longest a caller waits on another caller's load of the same key before loading itself
+        self.load_wait = load_wait
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'loads': 0,
+            'load_errors': 0,
+            'stale_served': 0,
+            'wait_timeouts': 0,
+            'backend_errors': 0
+        }
+        # Same counters split by data source, the key prefix ('buoy', 'tide', ...)
+        self._source_counters = {}
+
+    def _count(self, name, key=None):
+        with self._counters_lock:
+            self._counters[name] += 1
+            if key is not None:
+                source_key = (key.split(':', 1)[0], name)
+                self._source_counters[source_key] = self._source_counters.get(source_key, 0) + 1
+
+    def ttl_for(self, data_type):
+        return self.ttls.get(data_type, self.default_ttl)
+
+    def _backend_get(self, key, allow_stale=False):
+        # A backend that is down (e.g. Redis unreachable) reads as a miss
+        try:
+            return self.backend.get(key, allow_stale=allow_stale)
+        except Exception as e:
+            self._count('backend_errors')
+            print(f"Error reading cache: {str(e)}")
+            return None
+
+    def get_or_load(self, key, loader, data_type=None, ttl=None):
+        with span('cache'):
+            value = self._backend_get(key)
+        if value is NEGATIVE:
+            self._count('negative_hits', key)
+            return None
+        if value is not None:
+            self._count('hits', key)
+            return value
+
+        self._count('misses', key)
+
+        # Single-flight: the first caller for a key loads it, everyone else waits for that result
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            self._count('coalesced')
+            if flight.done.wait(self.load_wait):
+                if flight.error:
+                    raise flight.error
+                return flight.value
+            # The leader is stuck on a slow upstream: load independently rather than keep waiting
+            self._count('wait_timeouts')
+            flight = _Flight()
+
+        try:
+            self._count('loads')
+            value = loader()
+            self.set(key, value, data_type, ttl)
+            flight.value = value
+            return value
+        except UpstreamBudgetExceeded as e:
+            # Out of upstream budget: an expired value beats no value
+            stale = self._backend_get(key, allow_stale=True)
+            if stale is None or stale is NEGATIVE:
+                self._count('load_errors')
+                flight.error = e
+                raise
+            self._count('stale_served', key)
+            flight.value = stale
+            return stale
+        except Exception as e:
+            self._count('load_errors')
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def get(self, key, default=None, allow_stale=False):
+        # Plain lookup for callers that assemble results from several keys
+        with span('cache'):
+            value = self._backend_get(key, allow_stale=allow_stale)
+        if allow_stale:
+            if value is None or value is NEGATIVE:
+                return default
+            self._count('stale_served', key)
+            return value
+        if value is None:
+            self._count('misses', key)
+            return default
+        if value is NEGATIVE:
+            self._count('negative_hits', key)
+            return default
+        self._count('hits', key)
+        return value
+
+    def set(self, key, value, data_type=None, ttl=None):
+        # A failed write only costs a later miss; the caller still has its value
+        try:
+            if value is None:
+                self.backend.set(key, NEGATIVE, self.negative_ttl)
+            else:
+                self.backend.set(key, value, ttl if ttl is not None else self.ttl_for(data_type), self.stale_ttl)
+        except Exception as e:
+            self._count('backend_errors')
+            print(f"Error writing cache: {str(e)}")
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['negative_hits']) / lookups, 4) if lookups else None
+        stats['in_flight'] = len(self._flights)
+        stats.update(self.backend.stats())
+        return stats
+
+    def source_counts(self):
+        # {(source, counter): count}
+        with self._counters_lock:
+            return dict(self._source_counters)
+
+
+def create_cache(config):
+    if config.get('REDIS_URL'):
+        backend = RedisBackend(config['REDIS_URL'])
+    else:
+        backend = MemoryBackend(config['CACHE_MAX_ENTRIES'])
+
+    return Cache(
+        backend,
+        ttls=config['CACHE_TTLS'],
+        default_ttl=config['CACHE_TIMEOUT'],
+        negative_ttl=config['CACHE_NEGATIVE_TIMEOUT'],
+        stale_ttl=config['CACHE_STALE_TIMEOUT'],
+        load_wait=config['UPSTREAM_QUEUE_TIMEOUT'] + config['CACHE_LOAD_TIMEOUT']
+    )
+
+
+def get_cache():
+    return current_app.extensions['cache']
+
+
+def cached(data_type):
+    # Drop-in replacement for lru_cache on upstream fetch helpers that return None on failure
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            parts = [str(arg) for arg in args]
+            parts.extend(f'{name}={kwargs[name]}' for name in sorted(kwargs))
+            key = ':'.join([data_type, func.__name__] + parts)
+            return get_cache().get_or_load(key, lambda: func(*args, **kwargs), data_type)
+        return wrapper
+    return decorator
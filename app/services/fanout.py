@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app
+
+
+class FanOut:
+    # Bounded pool for running independent upstream fetches concurrently inside a request
+    def __init__(self, workers=16, timeout=10):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fanout')
+
+    def map(self, func, keys, timeout=None):
+        # Returns {key: (value, error)}; keys still running at the deadline report a timeout
+        # (their fetch keeps going in the background and still lands in the cache)
+        app = current_app._get_current_object()
+
+        def call(key):
+            with app.app_context():
+                return func(key)
+
+        futures = {key: self._executor.submit(call, key) for key in dict.fromkeys(keys)}
+        wait(futures.values(), timeout=timeout if timeout is not None else self.timeout)
+
+        results = {}
+        for key, future in futures.items():
+            if not future.done():
+                results[key] = (None, 'Timed out waiting for upstream')
+            elif future.exception() is not None:
+                results[key] = (None, str(future.exception()))
+            else:
+                results[key] = (future.result(), None)
+        return results
+
+
+def create_fanout(config):
+    return FanOut(config['FANOUT_WORKERS'], config['FANOUT_TIMEOUT'])
+
+
+def get_fanout():
+    return current_app.extensions['fanout']
@@ -0,0 +1,177 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from .http import create_session
+
+
+class GribStore:
+    # Forecast-hour GRIB files on local disk, laid out as <root>/<model>/<run>/<file>.
+    # Files are downloaded once per model run and shared by every request and worker.
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, timeout=60, workers=8, session=None, upstream_limiter=None):
+        self.root = root
+        self.session = session or create_session(workers)
+        self.upstream_limiter = upstream_limiter
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grib-store')
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.downloads = 0
+        self.download_errors = 0
+        self.bytes_downloaded = 0
+        self.hits = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def run_id(model):
+        return model.latest_model_time().strftime('%Y%m%d%H')
+
+    def run_dir(self, model, run_id):
+        return os.path.join(self.root, model.name, run_id)
+
+    def _lock_for(self, path):
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def _download(self, url, path):
+        if self.upstream_limiter:
+            with self.upstream_limiter.slot('grib'):
+                response = self.session.get(url, timeout=self.timeout)
+        else:
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.content
+
+        # Publish atomically so other workers never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.downloads += 1
+        self.bytes_downloaded += len(data)
+        if self.upstream_limiter:
+            self.upstream_limiter.record_bytes('grib', len(data))
+
+    def fetch_file(self, url, run_dir):
+        # Returns the local path of the file, downloading it first if needed
+        path = os.path.join(run_dir, os.path.basename(url))
+        with self._lock_for(path):
+            if os.path.exists(path):
+                self.hits += 1
+                os.utime(path)
+                return path
+
+            os.makedirs(run_dir, exist_ok=True)
+            try:
+                self._download(url, path)
+                return path
+            except Exception as e:
+                self.download_errors += 1
+                print(f"Error fetching grib data: {str(e)}")
+                return None
+
+    def fetch_grib_paths(self, model, start_index, end_index):
+        # Local paths of each forecast-hour file in [start_index, end_index), None where it failed
+        return list(self.iter_grib_paths(model, start_index, end_index))
+
+    def iter_grib_paths(self, model, start_index, end_index):
+        # Same paths, yielded in forecast order as each one lands; the pool keeps downloading ahead
+        run_id = self.run_id(model)
+        run_dir = self.run_dir(model, run_id)
+        new_run = not os.path.isdir(run_dir)
+        downloads = self.downloads
+
+        urls = model.create_grib_urls(start_index, end_index)
+        yield from self._executor.map(lambda url: self.fetch_file(url, run_dir), urls)
+
+        if new_run:
+            self.evict_superseded(model, run_id)
+        if self.downloads != downloads:
+            self.enforce_size_cap()
+
+    def fetch_grib_datas(self, model, start_index, end_index):
+        # Same contract as model.fetch_grib_datas, served from the per-run store
+        raw_data = []
+        for path in self.fetch_grib_paths(model, start_index, end_index):
+            if path is None:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    raw_data.append(f.read())
+            except OSError as e:
+                print(f"Error reading grib data: {str(e)}")
+        return raw_data
+
+    def evict_superseded(self, model, current_run_id):
+        model_dir = os.path.join(self.root, model.name)
+        for run_id in os.listdir(model_dir):
+            if run_id < current_run_id:
+                path = os.path.join(model_dir, run_id)
+                shutil.rmtree(path, ignore_errors=True)
+                with self._locks_lock:
+                    for lock_path in [p for p in self._locks if p.startswith(path + os.sep)]:
+                        del self._locks[lock_path]
+
+    def _files(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def enforce_size_cap(self):
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        # Least recently used files go first
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        files = self._files()
+        return {
+            'root': self.root,
+            'files': len(files),
+            'bytes': sum(size for _, size, _ in files),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'downloads': self.downloads,
+            'download_errors': self.download_errors,
+            'bytes_downloaded': self.bytes_downloaded
+        }
+
+
+def create_grib_store(config, session=None, upstream_limiter=None):
+    return GribStore(
+        config['GRIB_CACHE_DIR'],
+        max_bytes=config['GRIB_CACHE_MAX_BYTES'],
+        timeout=config['GRIB_DOWNLOAD_TIMEOUT'],
+        workers=config['GRIB_DOWNLOAD_WORKERS'],
+        session=session,
+        upstream_limiter=upstream_limiter
+    )
+
+
+def get_grib_store():
+    return current_app.extensions['grib_store']
@@ -0,0 +1,452 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+import pytz
+from flask import current_app
+
+from .metrics import span
+
+META_FILE = 'meta.json'
+CURRENT_FILE = 'CURRENT'
+
+
+def _message_key(message):
+    # Mirrors the variable naming of surfpy's parse_grib_data so model.to_buoy_data accepts the result
+    key = message.shortName
+    if message.typeOfLevel == 'orderedSequenceData':
+        key += '_' + str(message.level)
+    return key
+
+
+def _is_direction(key):
+    return 'dir' in key.lower()
+
+
+def _grid_geometry(message):
+    lat_first = message['latitudeOfFirstGridPointInDegrees']
+    lon_first = message['longitudeOfFirstGridPointInDegrees'] % 360
+    dlat = abs(message['jDirectionIncrementInDegrees'])
+    dlon = abs(message['iDirectionIncrementInDegrees'])
+    if not message['jScansPositively']:
+        dlat = -dlat
+    return {
+        'lat_first': lat_first,
+        'lon_first': lon_first,
+        'dlat': dlat,
+        'dlon': dlon,
+        'nlat': message['Nj'],
+        'nlon': message['Ni']
+    }
+
+
+def _wraps(grid):
+    # Global grids: the column after the last one is the first again (same rule as GridExtent)
+    return grid['nlon'] * grid['dlon'] >= 360 - 1e-6
+
+
+def _corners(grid, latitudes, longitudes):
+    # Bilinear interpolation corners and weights for each point, shape (points, 4)
+    rows = (np.asarray(latitudes, dtype=np.float64) - grid['lat_first']) / grid['dlat']
+    cols = ((np.asarray(longitudes, dtype=np.float64) - grid['lon_first']) % 360) / grid['dlon']
+
+    inside = (rows >= 0) & (rows <= grid['nlat'] - 1)
+    rows = np.clip(rows, 0, grid['nlat'] - 1)
+    row0 = np.minimum(np.floor(rows).astype(np.intp), max(grid['nlat'] - 2, 0))
+    row1 = np.minimum(row0 + 1, grid['nlat'] - 1)
+
+    if _wraps(grid):
+        # Points past the last column interpolate across the seam toward column 0
+        col0 = np.floor(cols).astype(np.intp) % grid['nlon']
+        col1 = (col0 + 1) % grid['nlon']
+    else:
+        inside &= (cols >= 0) & (cols <= grid['nlon'] - 1)
+        cols = np.clip(cols, 0, grid['nlon'] - 1)
+        col0 = np.minimum(np.floor(cols).astype(np.intp), max(grid['nlon'] - 2, 0))
+        col1 = np.minimum(col0 + 1, grid['nlon'] - 1)
+    drow = rows - row0
+    dcol = cols - col0
+
+    row_index = np.stack((row0, row0, row1, row1), axis=1)
+    col_index = np.stack((col0, col1, col0, col1), axis=1)
+    weights = np.stack((
+        (1 - drow) * (1 - dcol),
+        (1 - drow) * dcol,
+        drow * (1 - dcol),
+        drow * dcol
+    ), axis=1)
+    return row_index, col_index, weights, inside
+
+
+def _interpolate(key, corners, weights):
+    # corners (..., 4) values at the bilinear corners; weights broadcast against them
+    # Land cells are NaN; weight only the wet corners so coastal points still resolve
+    valid = np.isfinite(corners)
+    corner_weights = np.where(valid, weights, 0.0)
+    total = corner_weights.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if _is_direction(key):
+            radians = np.radians(np.where(valid, corners, 0.0))
+            sin = (np.sin(radians) * corner_weights).sum(axis=-1)
+            cos = (np.cos(radians) * corner_weights).sum(axis=-1)
+            result = np.degrees(np.arctan2(sin, cos)) % 360
+        else:
+            result = (np.where(valid, corners, 0.0) * corner_weights).sum(axis=-1) / total
+
+    result[total == 0] = np.nan
+    return result
+
+
+def decode_point(path, location):
+    # One forecast hour straight from its GRIB file, interpolated at a single point, in the
+    # dict layout model.to_buoy_data expects. None when the point is off the grid.
+    import pygrib
+    grbs = pygrib.open(path)
+    try:
+        messages = list(grbs)
+    finally:
+        grbs.close()
+    if not messages:
+        raise RuntimeError(f'No messages in {os.path.basename(path)}')
+
+    row_index, col_index, weights, inside = _corners(
+        _grid_geometry(messages[0]), [location.latitude], [location.absolute_longitude]
+    )
+    if not inside[0]:
+        return None
+
+    data = {}
+    for message in messages:
+        key = _message_key(message)
+        values = np.ma.filled(message.values.astype(np.float64), np.nan)
+        data[key] = [float(_interpolate(key, values[row_index, col_index], weights)[0])]
+    data['time'] = [pytz.UTC.localize(messages[0].validDate)]
+    return data
+
+
+class GridRun:
+    # One decoded model run: every variable as a memory-mapped (time, lat, lon) float32 array.
+    # The page cache backs the arrays, so all worker processes share one copy.
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.indexes = np.asarray(self.meta['indexes'])
+        self.times = np.asarray(self.meta['times'])
+        self.variables = {
+            key: np.load(os.path.join(path, filename), mmap_mode='r')
+            for key, filename in self.meta['variables'].items()
+        }
+
+    @property
+    def end_index(self):
+        return self.meta['end_index']
+
+    def covers(self, end_index):
+        return self.meta.get('complete', False) or self.end_index >= end_index
+
+    def time_slots(self, start_time=None, end_time=None):
+        # Slots from the forecast hour containing start_time up to (not including) end_time
+        first = 0
+        last = len(self.times)
+        if start_time is not None:
+            first = max(int(np.searchsorted(self.times, start_time.timestamp(), side='right')) - 1, 0)
+        if end_time is not None:
+            last = int(np.searchsorted(self.times, end_time.timestamp(), side='left'))
+        return np.arange(first, max(first, last))
+
+    def extract(self, latitudes, longitudes, start_time=None, end_time=None):
+        # Values for every variable at every point and forecast hour in one pass: {key: (points, time)}
+        slots = self.time_slots(start_time, end_time)
+        corners = _corners(self.meta['grid'], latitudes, longitudes)
+        return self.times[slots], self._values(slots, *corners), corners[3]
+
+    def _values(self, slots, row_index, col_index, weights, inside):
+        values = {}
+        for key, grid in self.variables.items():
+            corners = np.asarray(grid[slots[:, None, None], row_index[None], col_index[None]], dtype=np.float64)
+            result = _interpolate(key, corners, weights[None])
+            result[:, ~inside] = np.nan
+            values[key] = result.T
+        return values
+
+    def point_data(self, location, start_time=None, end_time=None):
+        # Single-point extraction in the dict layout that model.to_buoy_data expects
+        times, values, inside = self.extract([location.latitude], [location.absolute_longitude], start_time, end_time)
+        if not inside[0]:
+            return None
+        return self.to_grib_data(times, values, 0)
+
+    def iter_point_data(self, location, start_time=None, end_time=None, chunk_hours=24):
+        # point_data in consecutive chunks of forecast hours, for streaming long horizons
+        slots = self.time_slots(start_time, end_time)
+        corners = _corners(self.meta['grid'], [location.latitude], [location.absolute_longitude])
+        if not corners[3][0]:
+            return
+        for first in range(0, len(slots), chunk_hours):
+            chunk = slots[first:first + chunk_hours]
+            yield self.to_grib_data(self.times[chunk], self._values(chunk, *corners), 0)
+
+    @staticmethod
+    def to_grib_data(times, values, point):
+        data = {key: [float(value) for value in series[point]] for key, series in values.items()}
+        data['time'] = [datetime.fromtimestamp(float(timestamp), pytz.UTC) for timestamp in times]
+        return data
+
+
+class GridStore:
+    # Decoded model runs under <root>/<model>/<run>/<end_index>/, built from the GRIB store's files
+    def __init__(self, root, grib_store):
+        self.root = root
+        self.grib_store = grib_store
+        self._runs = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _lock_for(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _run_dir(self, model, run_id):
+        return os.path.join(self.root, model.name, run_id)
+
+    def _latest_build(self, run_dir):
+        if not os.path.isdir(run_dir):
+            return None
+        builds = [int(name) for name in os.listdir(run_dir) if name.isdigit()]
+        return os.path.join(run_dir, str(max(builds))) if builds else None
+
+    def load(self, model, run_id):
+        run_dir = self._run_dir(model, run_id)
+        path = self._latest_build(run_dir)
+        if path is None:
+            return None
+
+        cached = self._runs.get((model.name, run_id))
+        if cached and cached.path == path:
+            return cached
+
+        grid_run = GridRun(path)
+        self._runs[(model.name, run_id)] = grid_run
+        return grid_run
+
+    def current_run_id(self, model_name):
+        try:
+            with open(os.path.join(self.root, model_name, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def set_current(self, model, run_id):
+        # Atomic pointer flip; only complete runs are ever published here
+        model_dir = os.path.join(self.root, model.name)
+        fd, tmp_path = tempfile.mkstemp(dir=model_dir, prefix='.current-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(run_id)
+        os.replace(tmp_path, os.path.join(model_dir, CURRENT_FILE))
+        self.evict(model, run_id)
+
+    def published(self, model, end_index):
+        # The run published by the ingestion worker, unless a newer run is due or it stops short of end_index
+        run_id = self.current_run_id(model.name)
+        if not run_id or run_id < self.grib_store.run_id(model):
+            return None
+        grid_run = self.load(model, run_id)
+        return grid_run if grid_run and grid_run.covers(end_index) else None
+
+    def available(self, model, end_index):
+        # The run current() would serve, but only when it can be read without building anything
+        grid_run = self.published(model, end_index)
+        if grid_run:
+            return grid_run
+        grid_run = self.load(model, self.grib_store.run_id(model))
+        return grid_run if grid_run and grid_run.covers(end_index) else None
+
+    def current(self, model, end_index):
+        # Prefer the run published by the ingestion worker; build on demand when there is none,
+        # or when it is behind the latest run or too short for the window
+        grid_run = self.published(model, end_index)
+        if grid_run:
+            return grid_run
+        try:
+            return self.ensure(model, end_index)
+        except Exception as e:
+            # The newer run may not be on NOAA yet; an older published run still answers
+            run_id = self.current_run_id(model.name)
+            grid_run = self.load(model, run_id) if run_id else None
+            if grid_run is None:
+                raise
+            print(f"Error building {model.name} run, serving {run_id}: {str(e)}")
+            return grid_run
+
+    def ensure(self, model, end_index):
+        # Decoded run covering [0, end_index), building (or extending) it if this process has to
+        run_id = self.grib_store.run_id(model)
+        grid_run = self.load(model, run_id)
+        if grid_run and grid_run.covers(end_index):
+            return grid_run
+
+        with self._lock_for((model.name, run_id)):
+            grid_run = self.load(model, run_id)
+            if grid_run and grid_run.covers(end_index):
+                return grid_run
+
+            # A shorter build of this run is extended: only the hours past it are fetched and decoded
+            start_index = grid_run.end_index if grid_run else 0
+            with span('grib-fetch'):
+                paths = self.grib_store.fetch_grib_paths(model, start_index, end_index)
+            with span('grib-decode'):
+                built = self.build(
+                    model, run_id, list(zip(range(start_index, end_index), paths)), end_index, base=grid_run
+                )
+            if not built:
+                # Nothing past the existing build decoded: serve it as it is and retry next request
+                print(f"No new forecast hours decoded for {model.name} run {run_id}")
+            return self.load(model, run_id)
+
+    def build(self, model, run_id, indexed_paths, end_index, complete=False, base=None):
+        # base: an earlier build of the same run ending where indexed_paths start; its hours
+        # are copied rather than decoded again. The build ends at the first hour that failed to
+        # download or decode, so covers() never counts a gap and the next build retries it.
+        # Returns False, saving nothing, when no hour past base decoded.
+        # pygrib and its ecCodes tables load on the first decode rather than at startup;
+        # serving an already built run never needs them
+        import pygrib
+
+        # First pass reads message headers only (no data decoding) to size the arrays
+        hours = []
+        keys = set()
+        geometry = None
+        if base is not None:
+            geometry = base.meta['grid']
+            keys.update(base.variables)
+            hours.extend((index, None, timestamp) for index, timestamp in zip(base.meta['indexes'], base.meta['times']))
+        base_hours = len(hours)
+        built_end = end_index
+        for index, path in indexed_paths:
+            messages = None
+            if path is not None:
+                try:
+                    grbs = pygrib.open(path)
+                    messages = list(grbs)
+                    grbs.close()
+                except Exception as e:
+                    print(f"Error decoding grib data: {str(e)}")
+            if not messages:
+                built_end = index
+                break
+            if geometry is None:
+                geometry = _grid_geometry(messages[0])
+            keys.update(_message_key(message) for message in messages)
+            hours.append((index, path, pytz.UTC.localize(messages[0].validDate).timestamp()))
+
+        if len(hours) == base_hours:
+            if base is None:
+                raise RuntimeError(f'No forecast data decoded for {model.name} run {run_id}')
+            return False
+
+        run_dir = self._run_dir(model, run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=run_dir, prefix='.build-')
+        try:
+            # Second pass decodes each field straight into its slot of the memory-mapped array
+            shape = (len(hours), geometry['nlat'], geometry['nlon'])
+            variables = {key: f'{key}.npy' for key in sorted(keys)}
+            arrays = {
+                key: np.lib.format.open_memmap(os.path.join(tmp_dir, filename), mode='w+', dtype=np.float32, shape=shape)
+                for key, filename in variables.items()
+            }
+            for array in arrays.values():
+                array[:] = np.nan
+            if base is not None:
+                for key, array in base.variables.items():
+                    arrays[key][:len(array)] = array
+
+            for slot, (_, path, _) in enumerate(hours):
+                if path is None:
+                    continue
+                grbs = pygrib.open(path)
+                for message in grbs:
+                    arrays[_message_key(message)][slot] = np.ma.filled(message.values.astype(np.float32), np.nan)
+                grbs.close()
+
+            for array in arrays.values():
+                array.flush()
+            del arrays
+
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+                json.dump({
+                    'model': model.name,
+                    'run': run_id,
+                    'end_index': built_end,
+                    'complete': complete and built_end == end_index,
+                    'indexes': [index for index, _, _ in hours],
+                    'times': [timestamp for _, _, timestamp in hours],
+                    'grid': geometry,
+                    'variables': variables
+                }, f)
+
+            # Publishing is a directory rename, so readers only ever see complete builds
+            final_dir = os.path.join(run_dir, str(built_end))
+            if os.path.exists(final_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            else:
+                os.rename(tmp_dir, final_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self.builds += 1
+        self.evict(model, run_id)
+        return True
+
+    def evict(self, model, newest_run_id):
+        # Drop runs older than newest_run_id (except the published one) and smaller builds of it
+        model_dir = os.path.join(self.root, model.name)
+        published = self.current_run_id(model.name)
+        for run_id in os.listdir(model_dir):
+            if not run_id.isdigit() or run_id == published:
+                continue
+            if run_id < newest_run_id:
+                shutil.rmtree(os.path.join(model_dir, run_id), ignore_errors=True)
+                self._runs.pop((model.name, run_id), None)
+
+        run_dir = self._run_dir(model, newest_run_id)
+        latest = self._latest_build(run_dir)
+        for name in os.listdir(run_dir):
+            path = os.path.join(run_dir, name)
+            if name.isdigit() and path != latest:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        now = datetime.now(pytz.UTC)
+        current_runs = {
+            name: self.current_run_id(name)
+            for name in sorted(os.listdir(self.root)) if os.path.isdir(os.path.join(self.root, name))
+        }
+        return {
+            'root': self.root,
+            'current_runs': current_runs,
+            # Seconds since each published run's model time
+            'current_run_ages': {
+                name: round((now - pytz.UTC.localize(datetime.strptime(run_id, '%Y%m%d%H'))).total_seconds())
+                for name, run_id in current_runs.items() if run_id
+            },
+            'loaded_runs': sorted(f'{name}/{run_id}' for name, run_id in self._runs),
+            'builds': self.builds
+        }
+
+
+def create_grid_store(config, grib_store):
+    return GridStore(config['GRID_STORE_DIR'], grib_store)
+
+
+def get_grid_store():
+    return current_app.extensions['grid_store']
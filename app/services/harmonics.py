@@ -0,0 +1,313 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pytz
+from flask import current_app
+
+HARCON_URL = 'https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations/{station_id}/harcon.json'
+DATUMS_URL = 'https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations/{station_id}/datums.json'
+
+# Unix time of J2000.0 (2000-01-01 12:00 UTC); the UTC/TT difference is ignored
+J2000 = 946728000.0
+
+# Equilibrium argument of each NOAA constituent as multiples of the astronomical arguments
+# (T, s, h, p, N, p1) plus a constant in degrees, and which nodal correction applies
+# (Schureman, Manual of Harmonic Analysis and Prediction of Tides). M1 and L2 have no
+# simple nodal formula and use f = 1, u = 0 and M2's respectively.
+CONSTITUENTS = {
+    'M2': ((2, -2, 2, 0, 0, 0), 0, 'M2'),
+    'S2': ((2, 0, 0, 0, 0, 0), 0, None),
+    'N2': ((2, -3, 2, 1, 0, 0), 0, 'M2'),
+    'K1': ((1, 0, 1, 0, 0, 0), -90, 'K1'),
+    'M4': ((4, -4, 4, 0, 0, 0), 0, 'M4'),
+    'O1': ((1, -2, 1, 0, 0, 0), 90, 'O1'),
+    'M6': ((6, -6, 6, 0, 0, 0), 0, 'M6'),
+    'MK3': ((3, -2, 3, 0, 0, 0), -90, 'MK3'),
+    'S4': ((4, 0, 0, 0, 0, 0), 0, None),
+    'MN4': ((4, -5, 4, 1, 0, 0), 0, 'M4'),
+    'NU2': ((2, -3, 4, -1, 0, 0), 0, 'M2'),
+    'S6': ((6, 0, 0, 0, 0, 0), 0, None),
+    'MU2': ((2, -4, 4, 0, 0, 0), 0, 'M2'),
+    '2N2': ((2, -4, 2, 2, 0, 0), 0, 'M2'),
+    'OO1': ((1, 2, 1, 0, 0, 0), -90, 'OO1'),
+    'LAM2': ((2, -1, 0, 1, 0, 0), 180, 'M2'),
+    'S1': ((1, 0, 0, 0, 0, 0), 0, None),
+    'M1': ((1, -1, 1, 1, 0, 0), -90, None),
+    'J1': ((1, 1, 1, -1, 0, 0), -90, 'J1'),
+    'MM': ((0, 1, 0, -1, 0, 0), 0, 'MM'),
+    'SSA': ((0, 0, 2, 0, 0, 0), 0, None),
+    'SA': ((0, 0, 1, 0, 0, 0), 0, None),
+    'MSF': ((0, 2, -2, 0, 0, 0), 0, 'MSF'),
+    'MF': ((0, 2, 0, 0, 0, 0), 0, 'MF'),
+    'RHO': ((1, -3, 3, -1, 0, 0), 90, 'O1'),
+    'Q1': ((1, -3, 1, 1, 0, 0), 90, 'O1'),
+    'T2': ((2, 0, -1, 0, 0, 1), 0, None),
+    'R2': ((2, 0, 1, 0, 0, -1), 180, None),
+    '2Q1': ((1, -4, 1, 2, 0, 0), 90, 'O1'),
+    'P1': ((1, 0, -1, 0, 0, 0), 90, None),
+    '2SM2': ((2, 2, -2, 0, 0, 0), 0, 'MSF'),
+    'M3': ((3, -3, 3, 0, 0, 0), 0, 'M3'),
+    'L2': ((2, -1, 2, -1, 0, 0), 180, 'M2'),
+    '2MK3': ((3, -4, 3, 0, 0, 0), 90, '2MK3'),
+    'K2': ((2, 0, 2, 0, 0, 0), 0, 'K2'),
+    'M8': ((8, -8, 8, 0, 0, 0), 0, 'M8'),
+    'MS4': ((4, -2, 2, 0, 0, 0), 0, 'M2')
+}
+
+NODAL_KEYS = sorted({key for _, _, key in CONSTITUENTS.values() if key})
+
+HIGH_TIDE = 'high'
+LOW_TIDE = 'low'
+
+
+def astronomical_arguments(epoch_seconds):
+    # (6, P) array of T, s, h, p, N, p1 in degrees for each time
+    t = np.asarray(epoch_seconds, dtype=np.float64)
+    centuries = (t - J2000) / (86400.0 * 36525.0)
+    hour_angle = 180.0 + 15.0 * (np.mod(t, 86400.0) / 3600.0)
+    return np.stack([
+        hour_angle,
+        218.3164477 + 481267.88123421 * centuries,
+        280.46646 + 36000.76983 * centuries,
+        83.3532465 + 4069.0137287 * centuries,
+        125.04452 - 1934.136261 * centuries,
+        282.93735 + 1.71946 * centuries
+    ])
+
+
+def nodal_corrections(node):
+    # {key: (f, u in degrees)} for the longitude of the moon's node, one value per time
+    n = np.radians(node)
+    cos1, cos2, cos3 = np.cos(n), np.cos(2 * n), np.cos(3 * n)
+    sin1, sin2, sin3 = np.sin(n), np.sin(2 * n), np.sin(3 * n)
+
+    m2 = (1.0004 - 0.0373 * cos1 + 0.0002 * cos2, -2.14 * sin1)
+    k1 = (1.0060 + 0.1150 * cos1 - 0.0088 * cos2 + 0.0006 * cos3, -8.86 * sin1 + 0.68 * sin2 - 0.07 * sin3)
+    corrections = {
+        'M2': m2,
+        'K1': k1,
+        'O1': (1.0089 + 0.1871 * cos1 - 0.0147 * cos2 + 0.0014 * cos3, 10.80 * sin1 - 1.34 * sin2 + 0.19 * sin3),
+        'OO1': (1.1027 + 0.6504 * cos1 + 0.0317 * cos2 - 0.0014 * cos3, -36.68 * sin1 + 4.02 * sin2 - 0.57 * sin3),
+        'J1': (1.1029 + 0.1676 * cos1 - 0.0170 * cos2 + 0.0016 * cos3, -12.94 * sin1 + 1.34 * sin2 - 0.19 * sin3),
+        'K2': (1.0241 + 0.2863 * cos1 + 0.0083 * cos2 - 0.0015 * cos3, -17.74 * sin1 + 0.68 * sin2 - 0.04 * sin3),
+        'MF': (1.043 + 0.414 * cos1, -23.74 * sin1 + 2.68 * sin2 - 0.38 * sin3),
+        'MM': (1.000 - 0.130 * cos1, np.zeros_like(n)),
+        # Compound tides combine the corrections of their parents
+        'M3': (m2[0] ** 1.5, 1.5 * m2[1]),
+        'M4': (m2[0] ** 2, 2 * m2[1]),
+        'M6': (m2[0] ** 3, 3 * m2[1]),
+        'M8': (m2[0] ** 4, 4 * m2[1]),
+        'MK3': (m2[0] * k1[0], m2[1] + k1[1]),
+        '2MK3': (m2[0] ** 2 * k1[0], 2 * m2[1] - k1[1]),
+        'MSF': (m2[0], -m2[1])
+    }
+    return corrections
+
+
+class PredictedTideEvent:
+    # Same attributes the routes read from surfpy's tide events
+    def __init__(self, date, tidal_event, water_level, water_level_datum):
+        self.date = date
+        self.tidal_event = tidal_event
+        self.water_level = water_level
+        self.water_level_datum = water_level_datum
+
+
+class HarmonicModel:
+    def __init__(self, record):
+        constituents = [
+            constituent for constituent in record['constituents']
+            if constituent['name'] in CONSTITUENTS and constituent['amplitude']
+        ]
+        self.station_id = record['station_id']
+        self.datums = record.get('datums') or {}
+        self.names = [constituent['name'] for constituent in constituents]
+        self.amplitudes = np.array([constituent['amplitude'] for constituent in constituents], dtype=np.float64)
+        self.phases = np.array([constituent['phase'] for constituent in constituents], dtype=np.float64)
+        self.speeds = np.radians([constituent['speed'] for constituent in constituents]) / 3600.0
+        self.coefficients = np.array([CONSTITUENTS[name][0] for name in self.names], dtype=np.float64).reshape(-1, 6)
+        self.offsets = np.array([CONSTITUENTS[name][1] for name in self.names], dtype=np.float64)
+        self.nodal_keys = [CONSTITUENTS[name][2] for name in self.names]
+
+    def __bool__(self):
+        return bool(self.names)
+
+    def has_datum(self, datum):
+        return 'MSL' in self.datums and datum in self.datums
+
+    def _arguments(self, epoch_seconds):
+        # (C, P) amplitude*f and phase angle in radians for every constituent and time
+        arguments = astronomical_arguments(epoch_seconds)
+        corrections = nodal_corrections(arguments[4])
+        f = np.ones((len(self.names), arguments.shape[1]))
+        u = np.zeros_like(f)
+        for position, key in enumerate(self.nodal_keys):
+            if key:
+                f[position], u[position] = corrections[key]
+
+        angle = self.coefficients @ arguments + self.offsets[:, None] + u - self.phases[:, None]
+        return self.amplitudes[:, None] * f, np.radians(angle)
+
+    def predict(self, epoch_seconds, datum):
+        # Water level above `datum` at each time; harmonic constants are relative to mean sea level
+        amplitude, angle = self._arguments(epoch_seconds)
+        return self.datums['MSL'] - self.datums[datum] + (amplitude * np.cos(angle)).sum(axis=0)
+
+    def _slope(self, epoch_seconds):
+        amplitude, angle = self._arguments(epoch_seconds)
+        return -(amplitude * self.speeds[:, None] * np.sin(angle)).sum(axis=0)
+
+    def extrema(self, start_seconds, end_seconds, datum, step=360):
+        # Highs and lows where the slope changes sign on a `step` grid, refined by interpolating
+        # the slope's zero crossing. Returns (times, heights, is_high) arrays.
+        samples = np.arange(start_seconds - step, end_seconds + 2 * step, step, dtype=np.float64)
+        slope = self._slope(samples)
+        crossing = np.nonzero(np.sign(slope[:-1]) != np.sign(slope[1:]))[0]
+        crossing = crossing[slope[crossing] != 0]
+        times = samples[crossing] + step * slope[crossing] / (slope[crossing] - slope[crossing + 1])
+        is_high = slope[crossing] > 0
+
+        times = np.round(times / 60.0) * 60.0
+        keep = (times >= start_seconds) & (times <= end_seconds)
+        times, is_high = times[keep], is_high[keep]
+        return times, self.predict(times, datum), is_high
+
+    def tide_events(self, start_time, end_time, datum):
+        times, heights, is_high = self.extrema(start_time.timestamp(), end_time.timestamp(), datum)
+        return [
+            PredictedTideEvent(datetime.fromtimestamp(when, pytz.UTC), HIGH_TIDE if high else LOW_TIDE,
+                               round(height, 3), datum)
+            for when, height, high in zip(times.tolist(), heights.tolist(), is_high.tolist())
+        ]
+
+
+class HarmonicStore:
+    # Harmonic constituents and datums per tide station, fetched from NOAA once and kept on disk
+    def __init__(self, root, session, upstream_limiter=None, refresh_interval=30 * 86400, retry_interval=300,
+                 timeout=30, units='english'):
+        self.root = root
+        self.session = session
+        self.upstream_limiter = upstream_limiter
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.units = units
+        self._models = {}
+        self._failures = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.fetches = 0
+        self.fetch_errors = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _lock_for(self, station_id):
+        with self._locks_lock:
+            return self._locks.setdefault(station_id, threading.Lock())
+
+    def _path(self, station_id):
+        return os.path.join(self.root, re.sub(r'[^A-Za-z0-9_-]', '_', station_id) + '.json')
+
+    def _get_json(self, url):
+        if self.upstream_limiter:
+            with self.upstream_limiter.slot('tide'):
+                response = self.session.get(url, params={'units': self.units}, timeout=self.timeout)
+        else:
+            response = self.session.get(url, params={'units': self.units}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _fetch(self, station_id):
+        harcon = self._get_json(HARCON_URL.format(station_id=station_id))
+        constituents = [{
+            'name': constituent['name'],
+            'amplitude': constituent['amplitude'],
+            'phase': constituent['phase_GMT'],
+            'speed': constituent['speed']
+        } for constituent in harcon.get('HarmonicConstituents') or []]
+
+        # Subordinate stations publish no constituents; remember that too
+        datums = {}
+        if constituents:
+            for datum in self._get_json(DATUMS_URL.format(station_id=station_id)).get('datums') or []:
+                if datum.get('value') is not None:
+                    datums[datum['name']] = datum['value']
+
+        return {
+            'station_id': station_id,
+            'fetched_at': time.time(),
+            'units': self.units,
+            'constituents': constituents,
+            'datums': datums
+        }
+
+    def _save(self, record):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(record['station_id']))
+
+    def _load(self, station_id):
+        try:
+            with open(self._path(station_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def model(self, station_id):
+        # HarmonicModel for the station, or None if it has no constituents (or they cannot be had yet)
+        model = self._models.get(station_id)
+        if model is not None:
+            return model or None
+
+        with self._lock_for(station_id):
+            model = self._models.get(station_id)
+            if model is not None:
+                return model or None
+
+            record = self._load(station_id)
+            stale = record is None or time.time() - record['fetched_at'] > self.refresh_interval
+            if stale and time.time() - self._failures.get(station_id, 0) > self.retry_interval:
+                try:
+                    self.fetches += 1
+                    record = self._fetch(station_id)
+                    self._save(record)
+                except Exception as e:
+                    # Keep whatever is on disk; without it the caller falls back to upstream predictions
+                    self.fetch_errors += 1
+                    self._failures[station_id] = time.time()
+                    print(f"Error fetching harmonic constituents: {str(e)}")
+
+            if record is None:
+                return None
+            model = HarmonicModel(record)
+            self._models[station_id] = model
+            return model or None
+
+    def stats(self):
+        models = list(self._models.values())
+        return {
+            'root': self.root,
+            'stations': len(models),
+            'with_constituents': sum(1 for model in models if model),
+            'fetches': self.fetches,
+            'fetch_errors': self.fetch_errors
+        }
+
+
+def create_harmonic_store(config, session, upstream_limiter=None):
+    return HarmonicStore(
+        config['HARMONICS_DIR'],
+        session,
+        upstream_limiter=upstream_limiter,
+        refresh_interval=config['HARMONICS_REFRESH_INTERVAL']
+    )
+
+
+def get_harmonic_store():
+    return current_app.extensions['harmonic_store']
@@ -0,0 +1,16 @@
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size=32):
+    # One keep-alive connection pool per process for the NOAA hosts we call directly
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    return current_app.extensions['http_session']
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+
+import pytz
+from flask import current_app, g, request
+
+from .cache import MemoryBackend
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class _Policy:
+    def __init__(self, etag, last_modified, max_age):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.max_age = max_age
+
+
+class HttpCache:
+    # Validators, Cache-Control and compression for API responses
+    def __init__(self, max_ages, compress_min_bytes=1024, variant_entries=256):
+        self.max_ages = max_ages
+        self.compress_min_bytes = compress_min_bytes
+        self.variants = MemoryBackend(variant_entries)
+        self.not_modified = 0
+        self.compressed = 0
+        self.variant_hits = 0
+
+    def _encoding(self):
+        if brotli is not None and request.accept_encodings['br']:
+            return 'br'
+        if request.accept_encodings['gzip']:
+            return 'gzip'
+        return None
+
+    def _compress(self, response, policy):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers):
+            return
+
+        encoding = self._encoding()
+        if not encoding:
+            return
+
+        # Pre-compressed variants are reused for as long as the validator says the body is unchanged
+        key = f'{policy.etag}:{encoding}' if policy else None
+        body = self.variants.get(key) if key else None
+        if body is not None:
+            self.variant_hits += 1
+        else:
+            raw = response.get_data()
+            if len(raw) < self.compress_min_bytes:
+                return
+            body = brotli.compress(raw) if encoding == 'br' else gzip.compress(raw, compresslevel=6)
+            self.compressed += 1
+            if key:
+                self.variants.set(key, body, policy.max_age)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+
+    def after_request(self, response):
+        policy = g.get('http_cache')
+        if policy and response.status_code in (200, 304):
+            response.set_etag(policy.etag, weak=True)
+            if policy.last_modified:
+                response.last_modified = policy.last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = policy.max_age
+            response.vary.add('Accept')
+            response.vary.add('Accept-Encoding')
+        self._compress(response, policy)
+        return response
+
+    def stats(self):
+        return {
+            'not_modified': self.not_modified,
+            'compressed': self.compressed,
+            'variant_hits': self.variant_hits,
+            'variants': self.variants.stats()['entries']
+        }
+
+
+def create_http_cache(app):
+    http_cache = HttpCache(app.config['HTTP_MAX_AGES'], app.config['COMPRESS_MIN_BYTES'])
+    app.after_request(http_cache.after_request)
+    return http_cache
+
+
+def conditional(source, *version, last_modified=None):
+    # Call once the data version is known but before building the body. Returns a 304
+    # response when the client's validators still match, otherwise None.
+    http_cache = current_app.extensions['http_cache']
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = pytz.UTC.localize(last_modified)
+    parts = [request.full_path, request.headers.get('Accept', '')] + [str(part) for part in version]
+    etag = hashlib.sha1('|'.join(parts).encode()).hexdigest()
+    g.http_cache = _Policy(etag, last_modified, http_cache.max_ages.get(source, 0))
+
+    matched = False
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        matched = last_modified.replace(microsecond=0) <= request.if_modified_since
+
+    if not matched:
+        return None
+
+    http_cache.not_modified += 1
+    return current_app.response_class(status=304)
@@ -0,0 +1,70 @@
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+
+class ForecastIngestor:
+    # Pulls each new model run into the grid store ahead of requests, then publishes it
+    def __init__(self, grib_store, grid_store, models, days=16, poll_interval=600, timeout=30):
+        self.grib_store = grib_store
+        self.grid_store = grid_store
+        self.models = models
+        self.days = days
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def end_index(self, model):
+        return int(model.time_index(datetime.now(pytz.UTC) + timedelta(days=self.days))) + 1
+
+    def run_available(self, model, end_index):
+        # NOAA publishes forecast hours in order, so the last hour existing means the run is complete
+        try:
+            response = self.grib_store.session.head(model.create_grib_url(end_index - 1), timeout=self.timeout)
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Error checking model run: {str(e)}")
+            return False
+
+    def ingest(self, model):
+        run_id = self.grib_store.run_id(model)
+        if self.grid_store.current_run_id(model.name) == run_id:
+            return False
+
+        end_index = self.end_index(model)
+        if not self.run_available(model, end_index):
+            print(f"{model.name} run {run_id} is not fully published yet")
+            return False
+
+        started = time.time()
+        paths = self.grib_store.fetch_grib_paths(model, 0, end_index)
+        missing = sum(1 for path in paths if path is None)
+        if missing:
+            # Keep serving the previous run; files already downloaded are reused next poll
+            print(f"{model.name} run {run_id}: {missing} forecast hours failed to download")
+            return False
+
+        self.grid_store.build(model, run_id, list(zip(range(0, end_index), paths)), end_index, complete=True)
+        grid_run = self.grid_store.load(model, run_id)
+        if grid_run is None or not grid_run.meta.get('complete'):
+            # A forecast hour failed to decode; the build stops short of it and is not published
+            print(f"{model.name} run {run_id}: decoded only up to forecast hour {grid_run.end_index if grid_run else 0}")
+            return False
+        self.grid_store.set_current(model, run_id)
+        print(f"{model.name} run {run_id} published in {time.time() - started:.1f}s")
+        return True
+
+    def run_once(self):
+        results = {}
+        for name, factory in self.models.items():
+            try:
+                results[name] = self.ingest(factory())
+            except Exception as e:
+                print(f"Error ingesting {name}: {str(e)}")
+                results[name] = False
+        return results
+
+    def run_forever(self):
+        while True:
+            self.run_once()
+            time.sleep(self.poll_interval)
@@ -0,0 +1,169 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+
+# Upper bounds in seconds; sized for anything from a cache hit to an on-demand grid build
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Metrics:
+    # Per-process counters and latency histograms, rendered in the Prometheus text format
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._lock = threading.Lock()
+        # Seconds spent in each startup phase of this process
+        self.startup = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def record_startup(self, phase, seconds):
+        self.startup[phase] = round(seconds, 4)
+
+    def before_request(self):
+        g.request_started = time.perf_counter()
+        g.timings = {}
+
+    def after_request(self, response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.observe('surfpy_request_seconds', elapsed, route=rule, method=request.method,
+                     status=response.status_code)
+
+        timings = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in g.get('timings', {}).items()]
+        timings.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def render(self, readings=()):
+        # readings: (name, kind, value, labels) read from the services at scrape time
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            snapshot = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        for (name, labels), counts, total, count in snapshot:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for name, kind, value, labels in readings:
+            if value is None:
+                continue
+            header(name, kind)
+            lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def create_metrics(app):
+    metrics = Metrics()
+    metrics.describe('surfpy_request_seconds', 'Request latency by route and status')
+    metrics.describe('surfpy_span_seconds', 'Time spent in each step of a request')
+    metrics.describe('surfpy_upstream_seconds', 'Latency of calls to NOAA by source')
+    metrics.describe('surfpy_upstream_requests_total', 'Calls to NOAA by source and outcome')
+    metrics.describe('surfpy_upstream_bytes_total', 'Bytes downloaded from NOAA by source')
+    metrics.describe('surfpy_cache_requests_total', 'Cache lookups by data source and result')
+    metrics.describe('surfpy_cache_hit_ratio', 'Share of cache lookups answered from the cache')
+    metrics.describe('surfpy_grib_store_bytes', 'Size of the local GRIB file cache')
+    metrics.describe('surfpy_grib_store_files', 'Files in the local GRIB file cache')
+    metrics.describe('surfpy_station_catalog_age_seconds', 'Time since each station catalog was loaded')
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+    return metrics
+
+
+def get_metrics():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('metrics')
+
+
+def add_server_timing(name, seconds):
+    # Repeated steps in one request add up under one name
+    if has_request_context() and 'timings' in g:
+        g.timings[name] = g.timings.get(name, 0) + seconds
+
+
+def record_timing(name, seconds):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.observe('surfpy_span_seconds', seconds, span=name)
+    add_server_timing(name, seconds)
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - started)
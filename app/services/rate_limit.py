@@ -0,0 +1,296 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app, jsonify, request
+
+from .metrics import add_server_timing
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class UpstreamBudgetExceeded(Exception):
+    # Raised instead of calling NOAA when a source is out of budget; callers fall back to stale data
+    def __init__(self, source, retry_after):
+        super().__init__(f'Upstream {source} request budget exhausted, retry in {retry_after}s')
+        self.source = source
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        # rate is tokens per second
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        # Returns (allowed, tokens left, seconds until the next token)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True, self.tokens, 0
+            return False, self.tokens, (1 - self.tokens) / self.rate
+
+
+class MemoryBuckets:
+    # One bucket per client, least recently seen clients dropped first
+    def __init__(self, rate, capacity, max_clients=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+    def clients(self):
+        return len(self._buckets)
+
+
+# Refill and take in one round trip so every worker shares the same bucket
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBuckets:
+    def __init__(self, url, rate, capacity, prefix='surfpy-api:ratelimit:'):
+        if redis is None:
+            raise RuntimeError('REDIS_URL is set but the redis package is not installed')
+        self.rate = rate
+        self.capacity = capacity
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key):
+        allowed, tokens = self._take(keys=[self.prefix + key], args=[self.rate, self.capacity, time.time()])
+        tokens = float(tokens)
+        return bool(allowed), tokens, 0 if allowed else (1 - tokens) / self.rate
+
+    def clients(self):
+        return None
+
+
+class RateLimiter:
+    # Per-client token bucket for inbound requests, keyed by a known X-API-Key or else the
+    # client address
+    def __init__(self, buckets, per_minute, api_keys=(), exempt_paths=('/', '/api/status', '/metrics')):
+        self.buckets = buckets
+        self.per_minute = per_minute
+        self.api_keys = frozenset(api_keys)
+        self.exempt_paths = exempt_paths
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    def client_key(self):
+        # An unknown key would otherwise buy a fresh bucket per request; behind ProxyFix
+        # remote_addr is the client's address rather than the proxy's
+        api_key = request.headers.get('X-API-Key')
+        if api_key and api_key in self.api_keys:
+            return f'key:{api_key}'
+        return f'ip:{request.remote_addr}'
+
+    def before_request(self):
+        if request.path in self.exempt_paths or request.method == 'OPTIONS':
+            return None
+
+        try:
+            allowed, remaining, retry_after = self.buckets.take(self.client_key())
+        except Exception as e:
+            # A limiter outage should not take the API down with it
+            self.errors += 1
+            print(f"Error checking rate limit: {str(e)}")
+            return None
+
+        if allowed:
+            self.allowed += 1
+            return None
+
+        self.limited += 1
+        response = jsonify({
+            'error': 'Too many requests',
+            'details': f'Limit is {self.per_minute} requests per minute',
+            'retry_after': math.ceil(retry_after)
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        response.headers['X-RateLimit-Limit'] = str(self.per_minute)
+        response.headers['X-RateLimit-Remaining'] = str(int(remaining))
+        return response
+
+    def stats(self):
+        return {
+            'per_minute': self.per_minute,
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'errors': self.errors,
+            'clients': self.buckets.clients()
+        }
+
+
+class UpstreamCall:
+    # Yielded by UpstreamLimiter.slot. surfpy reports most failures by returning None rather
+    # than raising, so callers mark those here to have them counted as errors.
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class _Budget:
+    def __init__(self, per_minute, concurrency):
+        self.per_minute = per_minute
+        self.bucket = TokenBucket(per_minute / 60.0, max(1, per_minute)) if per_minute else None
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.calls = 0
+        self.queued = 0
+        self.shed = 0
+
+
+class UpstreamLimiter:
+    # Budget (calls per minute) and concurrency cap per upstream source. Callers over budget
+    # queue for up to queue_timeout seconds, then get UpstreamBudgetExceeded.
+    def __init__(self, budgets, concurrency=8, queue_timeout=5, metrics=None):
+        self.queue_timeout = queue_timeout
+        self.metrics = metrics
+        self._budgets = {source: _Budget(per_minute, concurrency) for source, per_minute in budgets.items()}
+
+    @contextmanager
+    def slot(self, source, timeout=None):
+        call = UpstreamCall()
+        budget = self._budgets.get(source)
+        if budget is None:
+            yield call
+            return
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.queue_timeout)
+        if budget.bucket is not None:
+            while True:
+                allowed, _, wait = budget.bucket.take()
+                if allowed:
+                    break
+                if time.monotonic() + wait > deadline:
+                    budget.shed += 1
+                    self._record(source, 'shed')
+                    raise UpstreamBudgetExceeded(source, math.ceil(wait))
+                budget.queued += 1
+                time.sleep(wait)
+
+        if not budget.slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            budget.shed += 1
+            self._record(source, 'shed')
+            raise UpstreamBudgetExceeded(source, 1)
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            budget.calls += 1
+            yield call
+            if call.failed:
+                outcome = 'error'
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            budget.slots.release()
+            self._record(source, outcome, time.perf_counter() - started)
+
+    def _record(self, source, outcome, seconds=None):
+        # The catalog refresh thread has no app context, so metrics are held here rather than looked up
+        if self.metrics is not None:
+            self.metrics.inc('surfpy_upstream_requests_total', source=source, outcome=outcome)
+            if seconds is not None:
+                self.metrics.observe('surfpy_upstream_seconds', seconds, source=source)
+        if seconds is not None:
+            add_server_timing(f'upstream-{source}', seconds)
+
+    def record_bytes(self, source, count):
+        if self.metrics is not None:
+            self.metrics.inc('surfpy_upstream_bytes_total', count, source=source)
+
+    def stats(self):
+        return {
+            source: {
+                'per_minute': budget.per_minute,
+                'calls': budget.calls,
+                'queued': budget.queued,
+                'shed': budget.shed
+            }
+            for source, budget in self._budgets.items()
+        }
+
+
+def create_rate_limiter(app):
+    # RATE_LIMIT_PER_MINUTE=0 turns inbound limiting off
+    per_minute = app.config['RATE_LIMIT_PER_MINUTE']
+    if not per_minute:
+        return None
+
+    rate = per_minute / 60.0
+    burst = app.config['RATE_LIMIT_BURST'] or per_minute
+    if app.config.get('REDIS_URL'):
+        buckets = RedisBuckets(app.config['REDIS_URL'], rate, burst)
+    else:
+        buckets = MemoryBuckets(rate, burst)
+
+    rate_limiter = RateLimiter(buckets, per_minute, app.config['RATE_LIMIT_API_KEYS'])
+    app.before_request(rate_limiter.before_request)
+    return rate_limiter
+
+
+def create_upstream_limiter(config, metrics=None):
+    return UpstreamLimiter(
+        config['UPSTREAM_BUDGETS'],
+        concurrency=config['UPSTREAM_CONCURRENCY'],
+        queue_timeout=config['UPSTREAM_QUEUE_TIMEOUT'],
+        metrics=metrics
+    )
+
+
+def get_upstream_limiter():
+    return current_app.extensions['upstream_limiter']
+
+
+def upstream_busy_response(error):
+    response = jsonify({
+        'error': 'Upstream busy',
+        'details': str(error)
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
@@ -0,0 +1,180 @@
+import math
+
+import numpy as np
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+COLUMNAR_FORMATS = ('columnar', 'msgpack', 'arrow')
+
+FORMAT_MIMETYPES = {
+    'msgpack': MSGPACK_MIMETYPE,
+    'arrow': ARROW_MIMETYPE
+}
+
+
+def _finite(obj):
+    # NaN and Infinity become null, as orjson writes them; NumPy values become plain ones
+    if isinstance(obj, (np.ndarray, np.generic)):
+        obj = obj.tolist()
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+class StdlibJsonProvider(DefaultJSONProvider):
+    # Fallback when orjson is not installed, writing the same JSON as OrjsonProvider: compact,
+    # sorted keys, and null rather than the non-standard NaN and Infinity
+    def dumps(self, obj, **kwargs):
+        if not kwargs.get('indent'):
+            kwargs.setdefault('separators', (',', ':'))
+        return super().dumps(_finite(obj), **kwargs)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Drop-in JSON provider for jsonify; keeps sorted keys so output matches the stdlib provider
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def _summary(attribute):
+    return lambda reading: getattr(reading.wave_summary, attribute) if reading.wave_summary else None
+
+
+def _timestamp(reading):
+    return reading.date.isoformat() if reading.date else None
+
+
+# Column name -> getter, in the order the row format nests them
+WAVE_COLUMNS = [
+    ('timestamp', _timestamp),
+    ('wave_height', _summary('wave_height')),
+    ('wave_period', _summary('period')),
+    ('wave_direction', _summary('direction')),
+    ('wave_compass_direction', _summary('compass_direction'))
+]
+
+WIND_COLUMNS = [
+    ('wind_speed', lambda reading: reading.wind_speed),
+    ('wind_direction', lambda reading: reading.wind_direction),
+    ('wind_compass_direction', lambda reading: reading.wind_compass_direction)
+]
+
+BUOY_READING_COLUMNS = WAVE_COLUMNS + WIND_COLUMNS + [
+    ('wind_gust', lambda reading: reading.wind_gust),
+    ('pressure', lambda reading: reading.pressure),
+    ('air_temperature', lambda reading: reading.air_temperature),
+    ('water_temperature', lambda reading: reading.water_temperature),
+    ('dewpoint', lambda reading: reading.dewpoint_temperature)
+]
+
+FORECAST_COLUMNS = WAVE_COLUMNS + WIND_COLUMNS
+
+SWELL_FIELDS = [
+    ('height', 'wave_height'),
+    ('period', 'period'),
+    ('direction', 'direction'),
+    ('compass_direction', 'compass_direction')
+]
+
+
+def to_columns(readings, columns):
+    # Parallel arrays per field; swell partitions become one array set per component index
+    readings = list(readings)
+    result = {name: [getter(reading) for reading in readings] for name, getter in columns}
+
+    swell_components = [reading.swell_components for reading in readings]
+    component_count = max((len(components) for components in swell_components), default=0)
+    result['swells'] = [
+        {
+            name: [getattr(components[position], attribute) if position < len(components) else None
+                   for components in swell_components]
+            for name, attribute in SWELL_FIELDS
+        }
+        for position in range(component_count)
+    ]
+    return result
+
+
+def requested_format():
+    # 'json' (row layout), 'columnar', 'msgpack' or 'arrow'; binary formats are always columnar
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt.lower()
+
+    best = request.accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE, ARROW_MIMETYPE])
+    for name, mimetype in FORMAT_MIMETYPES.items():
+        if best == mimetype:
+            return name
+    return 'json'
+
+
+def invalid_format_response(fmt):
+    return current_app.json.response({
+        'error': 'Invalid parameters',
+        'details': f'Unknown format {fmt!r}, expected one of json, {", ".join(COLUMNAR_FORMATS)}'
+    }), 400
+
+
+def _arrow_table(columns, meta):
+    flat = {name: values for name, values in columns.items() if name != 'swells'}
+    for position, swell in enumerate(columns['swells']):
+        for name, values in swell.items():
+            flat[f'swell_{position}_{name}'] = values
+    table = pyarrow.table(flat)
+    return table.replace_schema_metadata({'meta': current_app.json.dumps(meta)})
+
+
+def _msgpack_default(obj):
+    # NumPy scalars sneak in from surfpy's parsing
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+def columnar_response(fmt, key, columns, **meta):
+    if fmt == 'msgpack':
+        if msgpack is None:
+            return current_app.json.response({'error': 'MessagePack support is not installed'}), 406
+        body = msgpack.packb(dict(meta, **{key: columns}), use_bin_type=True, default=_msgpack_default)
+        return current_app.response_class(body, mimetype=MSGPACK_MIMETYPE)
+
+    if fmt == 'arrow':
+        if pyarrow is None:
+            return current_app.json.response({'error': 'Arrow support is not installed'}), 406
+        table = _arrow_table(columns, meta)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return current_app.response_class(sink.getvalue().to_pybytes(), mimetype=ARROW_MIMETYPE)
+
+    return current_app.json.response(dict(meta, format='columnar', **{key: columns}))
@@ -0,0 +1,139 @@
+import heapq
+import math
+
+import numpy as np
+
+# Mean earth radius, in meters
+EARTH_RADIUS = 6371000.0
+
+
+def to_unit_vectors(latitudes, longitudes):
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_meters(chord):
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.minimum(np.asarray(chord) / 2.0, 1.0))
+
+
+def meters_to_chord(meters):
+    angle = min(meters / EARTH_RADIUS, math.pi)
+    return 2.0 * math.sin(angle / 2.0)
+
+
+class StationIndex:
+    # k-d tree over unit-sphere coordinates, so euclidean chord distance orders
+    # stations the same way great-circle distance does. Nodes live in flat arrays.
+    LEAF_SIZE = 32
+
+    def __init__(self, stations, attributes=()):
+        self.stations = [station for station in stations if station.location is not None]
+        count = len(self.stations)
+        self.points = to_unit_vectors(
+            [station.location.latitude for station in self.stations],
+            [station.location.longitude for station in self.stations]
+        ).reshape(count, 3)
+        self.attributes = {
+            name: np.array([getattr(station, name, None) for station in self.stations])
+            for name in attributes
+        }
+
+        self.order = np.arange(count)
+        starts, ends, lefts, rights, lows, highs = [], [], [], [], [], []
+
+        def build(start, end):
+            node = len(starts)
+            points = self.points[self.order[start:end]]
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            lows.append(points.min(axis=0) if end > start else np.zeros(3))
+            highs.append(points.max(axis=0) if end > start else np.zeros(3))
+            if end - start > self.LEAF_SIZE:
+                axis = int(np.argmax(highs[node] - lows[node]))
+                middle = (end - start) // 2
+                segment = self.order[start:end]
+                self.order[start:end] = segment[np.argpartition(points[:, axis], middle)]
+                lefts[node] = build(start, start + middle)
+                rights[node] = build(start + middle, end)
+            return node
+
+        build(0, count)
+        self.node_start = np.array(starts)
+        self.node_end = np.array(ends)
+        self.node_left = np.array(lefts)
+        self.node_right = np.array(rights)
+        self.node_low = np.array(lows).reshape(-1, 3)
+        self.node_high = np.array(highs).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def select(self, **criteria):
+        # Boolean mask over stations, pushed down into the tree search
+        mask = np.ones(len(self.stations), dtype=bool)
+        for name, value in criteria.items():
+            if value is None:
+                continue
+            mask &= self.attributes[name] == value
+        return mask
+
+    def _node_distance(self, node, query):
+        delta = np.maximum(self.node_low[node] - query, 0) + np.maximum(query - self.node_high[node], 0)
+        return float(np.dot(delta, delta))
+
+    def _search(self, location, count, max_distance, mask):
+        if not self.stations or (count is not None and count <= 0):
+            return []
+
+        query = to_unit_vectors([location.latitude], [location.longitude])[0]
+        bound = meters_to_chord(max_distance) ** 2 if max_distance is not None else math.inf
+
+        # Max-heap (negated) of the best candidates found so far
+        best = []
+        nodes = [(self._node_distance(0, query), 0)]
+        while nodes:
+            node_distance, node = heapq.heappop(nodes)
+            limit = -best[0][0] if count is not None and len(best) == count else bound
+            if node_distance > limit:
+                break
+
+            left = self.node_left[node]
+            if left >= 0:
+                right = self.node_right[node]
+                for child in (left, right):
+                    child_distance = self._node_distance(child, query)
+                    if child_distance <= limit:
+                        heapq.heappush(nodes, (child_distance, child))
+                continue
+
+            indexes = self.order[self.node_start[node]:self.node_end[node]]
+            if mask is not None:
+                indexes = indexes[mask[indexes]]
+            if not len(indexes):
+                continue
+            delta = self.points[indexes] - query
+            distances = np.einsum('ij,ij->i', delta, delta)
+            keep = distances <= bound
+            for index, distance in zip(indexes[keep].tolist(), distances[keep].tolist()):
+                if count is None or len(best) < count:
+                    heapq.heappush(best, (-distance, index))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, index))
+
+        best.sort(reverse=True)
+        return [
+            (self.stations[index], float(chord_to_meters(math.sqrt(-distance))))
+            for distance, index in best
+        ]
+
+    def nearest(self, location, count=1, max_distance=None, mask=None):
+        # Returns up to `count` (station, distance_m) pairs, closest first
+        return self._search(location, count, max_distance, mask)
+
+    def within(self, location, radius, mask=None):
+        # Returns every (station, distance_m) pair within `radius` meters, closest first
+        return self._search(location, None, radius, mask)
@@ -0,0 +1,381 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pytz
+from flask import current_app
+from surfpy import Location
+
+from .breaking import spot_params
+from .cache import get_cache
+from .station_catalog import get_station_catalog
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class Spot:
+    # One named surf spot. Buoys and the tide station come from the registry file when it
+    # lists them, otherwise they are resolved from the station catalogs once those load.
+    def __init__(self, spot_id, name, latitude, longitude, params, buoys=None, tide_station=None):
+        self.spot_id = spot_id
+        self.name = name
+        self.location = Location(latitude, longitude)
+        self.params = params
+        self.configured_buoys = list(buoys) if buoys else None
+        self.configured_tide_station = tide_station
+        self.buoys = list(buoys) if buoys else []
+        self.tide_station = tide_station
+        self.buoys_resolved_at = None
+        self.tide_resolved_at = None
+
+    def describe(self):
+        return {
+            'id': self.spot_id,
+            'name': self.name,
+            'location': dict(latitude=self.location.latitude, longitude=self.location.longitude, **self.params),
+            'buoys': self.buoys,
+            'tide_station': self.tide_station
+        }
+
+
+def load_spots(path):
+    # {"spots": [{"id", "name", "lat", "lon", "depth"?, "angle"?, "slope"?, "buoys"?, "tide_station"?}]}
+    with open(path) as f:
+        entries = json.load(f).get('spots', [])
+
+    spots = {}
+    for entry in entries:
+        spot_id = str(entry['id'])
+        try:
+            spot = Spot(
+                spot_id,
+                entry.get('name', spot_id),
+                float(entry['lat']),
+                float(entry['lon']),
+                spot_params(entry),
+                buoys=[str(buoy) for buoy in entry.get('buoys') or []],
+                tide_station=str(entry['tide_station']) if entry.get('tide_station') else None
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'Invalid spot {spot_id!r} in {path}: {str(e)}')
+        spots[spot_id] = spot
+    return spots
+
+
+class SpotRegistry:
+    def __init__(self, spots, buoy_count=3):
+        self.spots = spots
+        self.buoy_count = buoy_count
+
+    def get(self, spot_id):
+        return self.spots.get(spot_id)
+
+    def __iter__(self):
+        return iter(list(self.spots.values()))
+
+    def __len__(self):
+        return len(self.spots)
+
+    def resolve(self, catalog):
+        # Nearest active buoys and tide station for spots that do not list their own; redone
+        # whenever a catalog refresh replaces the snapshot they were resolved against
+        buoys = catalog.buoy_snapshot()
+        tides = catalog.tide_snapshot()
+        for spot in self:
+            if spot.configured_buoys is None and buoys and spot.buoys_resolved_at != buoys.loaded_at:
+                closest = buoys.index.nearest(spot.location, self.buoy_count, mask=buoys.index.select(active=True))
+                spot.buoys = [station.station_id for station, _ in closest]
+                spot.buoys_resolved_at = buoys.loaded_at
+            if spot.configured_tide_station is None and tides and spot.tide_resolved_at != tides.loaded_at:
+                closest = tides.index.nearest(spot.location, 1)
+                spot.tide_station = closest[0][0].station_id if closest else None
+                spot.tide_resolved_at = tides.loaded_at
+
+
+class SpotReport:
+    # Ready-made JSON body for one spot plus the source versions it was built from
+    def __init__(self, spot, sections, versions, updated_at):
+        self.sections = sections
+        self.versions = versions
+        self.updated_at = updated_at
+        self.built_at = datetime.now(pytz.UTC)
+        self.etag = hashlib.sha1(json.dumps(versions, sort_keys=True).encode()).hexdigest()
+        self.body = current_app.json.dumps(dict(
+            sections,
+            spot=spot.describe(),
+            generated_at=self.built_at.isoformat(),
+            updated_at=updated_at
+        ))
+
+    def published(self):
+        # What the other workers need to answer a request: the body and its validators
+        return {'body': self.body, 'etag': self.etag, 'built_at': self.built_at.isoformat()}
+
+
+class PublishedReport:
+    # A report as read back from the shared store, without the sections it was built from
+    def __init__(self, body, etag, built_at):
+        self.body = body
+        self.etag = etag
+        self.built_at = datetime.fromisoformat(built_at)
+
+
+class FileReportStore:
+    # Published reports as JSON files in a directory shared by every worker on the host. Each
+    # worker keeps the last one it parsed per spot until the file changes.
+    def __init__(self, root):
+        self.root = root
+        self._loaded = {}
+
+    def _path(self, spot_id):
+        return os.path.join(self.root, f'{spot_id}.json')
+
+    def save(self, spot_id, report):
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.report-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(report.published(), f)
+        os.replace(tmp_path, self._path(spot_id))
+
+    def load(self, spot_id):
+        path = self._path(spot_id)
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        loaded = self._loaded.get(spot_id)
+        if loaded and loaded[0] == modified:
+            return loaded[1]
+        with open(path) as f:
+            report = PublishedReport(**json.load(f))
+        self._loaded[spot_id] = (modified, report)
+        return report
+
+
+class CacheReportStore:
+    # Published reports in the shared cache, for workers on every host using the same Redis
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def save(self, spot_id, report):
+        get_cache().set(f'spot:report:{spot_id}', report.published(), ttl=self.ttl)
+
+    def load(self, spot_id):
+        published = get_cache().get(f'spot:report:{spot_id}')
+        return PublishedReport(**published) if published else None
+
+
+class FileLeaderLock:
+    # Held by the first process on this host to take it, until that process exits
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        if self._file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+
+class RedisLeaderLock:
+    # Held by one process across every host sharing the Redis server; it lapses after ttl
+    # seconds unless the holder takes it again
+    def __init__(self, url, ttl, key='surfpy-api:spot-reports:leader'):
+        if redis is None:
+            raise RuntimeError('REDIS_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.key = key
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        if self.client.set(self.key, self.token, nx=True, ex=self.ttl):
+            return True
+        if self.client.get(self.key) == self.token.encode():
+            self.client.expire(self.key, self.ttl)
+            return True
+        return False
+
+
+class SpotReports:
+    # Merged forecast, tide and buoy report per registered spot. Each section is rebuilt only
+    # when its source moves on (a new model run or forecast hour, a new tide day, fresh buoy
+    # readings), by a background scheduler, so requests are answered from the stored body.
+    # Only the process holding leader_lock runs the scheduler; it publishes each report to
+    # report_store, where the other workers read it.
+    def __init__(self, app, registry, sections, refresh_interval=300, leader_lock=None, report_store=None):
+        self.app = app
+        self.registry = registry
+        # [(name, version(spot), build(spot))]
+        self.sections = sections
+        self.refresh_interval = refresh_interval
+        self.leader_lock = leader_lock
+        self.report_store = report_store
+        self.leader = False
+        self._reports = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.cycles = 0
+        self.last_cycle_seconds = None
+        self.section_builds = {name: 0 for name, _, _ in sections}
+        self.section_errors = {name: 0 for name, _, _ in sections}
+
+    def start(self):
+        if self.refresh_interval <= 0 or not len(self.registry):
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='spot-reports', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Every process keeps trying, so another one takes over when the leader exits
+        delay = 0
+        while not self._stop.wait(delay):
+            self.leader = self._elect()
+            if self.leader:
+                with self.app.app_context():
+                    self.refresh()
+            delay = self.refresh_interval
+
+    def _elect(self):
+        if self.leader_lock is None:
+            return True
+        try:
+            return self.leader_lock.acquire()
+        except Exception as e:
+            print(f"Error taking the spot report lock: {str(e)}")
+            return False
+
+    def _lock_for(self, spot_id):
+        with self._locks_lock:
+            return self._locks.setdefault(spot_id, threading.Lock())
+
+    def refresh(self):
+        started = time.time()
+        self.registry.resolve(get_station_catalog())
+        for spot in self.registry:
+            try:
+                report = self.update(spot)
+                if self.report_store is not None:
+                    self.report_store.save(spot.spot_id, report)
+            except Exception as e:
+                print(f"Error building spot report {spot.spot_id}: {str(e)}")
+        self.cycles += 1
+        self.last_cycle_seconds = round(time.time() - started, 3)
+
+    def _versions(self, spot):
+        versions = {}
+        for name, version, _ in self.sections:
+            try:
+                versions[name] = version(spot)
+            except Exception as e:
+                print(f"Error checking {name} for spot {spot.spot_id}: {str(e)}")
+                versions[name] = None
+        return versions
+
+    def update(self, spot):
+        # Rebuilds the sections whose version moved on and publishes a new report
+        versions = self._versions(spot)
+        report = self._reports.get(spot.spot_id)
+        if report and report.versions == versions:
+            return report
+
+        with self._lock_for(spot.spot_id):
+            report = self._reports.get(spot.spot_id)
+            sections = dict(report.sections) if report else {}
+            built = dict(report.versions) if report else {}
+            updated_at = dict(report.updated_at) if report else {}
+
+            for name, _, build in self.sections:
+                if name in sections and (versions[name] is None or built.get(name) == versions[name]):
+                    continue
+                try:
+                    sections[name] = build(spot)
+                    built[name] = versions[name]
+                    updated_at[name] = datetime.now(pytz.UTC).isoformat()
+                    self.section_builds[name] += 1
+                except Exception as e:
+                    # Keep the previous section; the version is left behind so it is retried next cycle
+                    self.section_errors[name] += 1
+                    print(f"Error building {name} for spot {spot.spot_id}: {str(e)}")
+                    if name not in sections:
+                        sections[name] = {'error': str(e)}
+                        built[name] = None
+
+            report = SpotReport(spot, sections, built, updated_at)
+            self._reports[spot.spot_id] = report
+            return report
+
+    def report(self, spot):
+        # The stored report while this process's scheduler keeps it current, or the leader's
+        # last published one; built inline only before the leader has published any, or when
+        # there is no scheduler
+        report = self._reports.get(spot.spot_id)
+        if report is not None and self.leader:
+            return report
+        if self._thread is not None and not self.leader and self.report_store is not None:
+            try:
+                published = self.report_store.load(spot.spot_id)
+            except Exception as e:
+                published = None
+                print(f"Error reading spot report {spot.spot_id}: {str(e)}")
+            if published is not None:
+                return published
+        self.registry.resolve(get_station_catalog())
+        return self.update(spot)
+
+    def stats(self):
+        return {
+            'spots': len(self.registry),
+            'reports': len(self._reports),
+            'refresh_interval': self.refresh_interval,
+            'scheduler_running': bool(self._thread and self._thread.is_alive()),
+            'leader': self.leader,
+            'cycles': self.cycles,
+            'last_cycle_seconds': self.last_cycle_seconds,
+            'section_builds': dict(self.section_builds),
+            'section_errors': dict(self.section_errors)
+        }
+
+
+def create_spot_reports(app, sections):
+    path = app.config['SPOTS_FILE']
+    spots = load_spots(path) if path else {}
+    registry = SpotRegistry(spots, app.config['SPOT_BUOY_COUNT'])
+    interval = app.config['SPOT_REFRESH_INTERVAL']
+    if app.config.get('REDIS_URL'):
+        leader_lock = RedisLeaderLock(app.config['REDIS_URL'], ttl=interval * 3)
+        # Outlives a few missed cycles, so a dead leader's reports do not linger
+        report_store = CacheReportStore(ttl=interval * 3)
+    else:
+        leader_lock = FileLeaderLock(app.config['SPOT_LEADER_LOCK'])
+        report_store = FileReportStore(app.config['SPOT_REPORT_DIR'])
+    return SpotReports(app, registry, sections, interval, leader_lock, report_store)
+
+
+def get_spot_reports():
+    return current_app.extensions['spot_reports']
@@ -0,0 +1,262 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pytz
+from flask import current_app
+from surfpy import BuoyStations, TideStations
+
+from .spatial_index import StationIndex
+
+# Everything a catalog snapshot may reference besides surfpy's own classes. Anything else in
+# the file is refused rather than loaded, so a planted snapshot cannot run code.
+SNAPSHOT_GLOBALS = {
+    ('app.services.station_catalog', 'CatalogSnapshot'),
+    ('app.services.spatial_index', 'StationIndex'),
+    ('numpy', 'dtype'),
+    ('numpy', 'ndarray'),
+    ('numpy.core.numeric', '_frombuffer'),
+    ('numpy._core.numeric', '_frombuffer'),
+    ('numpy.core.multiarray', '_reconstruct'),
+    ('numpy._core.multiarray', '_reconstruct'),
+    ('numpy.core.multiarray', 'scalar'),
+    ('numpy._core.multiarray', 'scalar')
+}
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) in SNAPSHOT_GLOBALS:
+            return super().find_class(module, name)
+        if module.split('.')[0] == 'surfpy' and '.' not in name:
+            found = super().find_class(module, name)
+            if isinstance(found, type) and found.__module__.split('.')[0] == 'surfpy':
+                return found
+        raise pickle.UnpicklingError(f'{module}.{name} is not allowed in a station snapshot')
+
+
+def _check_private(path):
+    # Snapshots are only read from and written to places no other user can write to
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise PermissionError(f'{path} must be owned by this user and not writable by others')
+
+
+class CatalogSnapshot:
+    # Immutable view of one station list; replaced wholesale on refresh
+    def __init__(self, stations, index_attributes=()):
+        self.stations = stations
+        self.by_id = {station.station_id: station for station in stations.stations}
+        self.index = StationIndex(stations.stations, index_attributes)
+        self.loaded_at = time.time()
+        # Per-station facts learned from upstream responses (e.g. the tide datum that works);
+        # they reset with each refresh so stations that change get re-learned
+        self.datums = {}
+
+    def find_station(self, station_id):
+        return self.by_id.get(station_id)
+
+
+class _CatalogEntry:
+    def __init__(self, name, factory, index_attributes=(), upstream_limiter=None, snapshot_path=None):
+        self.name = name
+        self.factory = factory
+        self.index_attributes = index_attributes
+        self.upstream_limiter = upstream_limiter
+        self.snapshot_path = snapshot_path
+        self.snapshot = None
+        self.source = None
+        self.load_lock = threading.Lock()
+        self.last_attempt = None
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.refresh_count = 0
+
+    def load(self):
+        stations = self.factory()
+        if self.upstream_limiter:
+            with self.upstream_limiter.slot('stations') as call:
+                fetched = stations.fetch_stations()
+                if not fetched or not stations.stations:
+                    call.fail()
+        else:
+            fetched = stations.fetch_stations()
+        if not fetched or not stations.stations:
+            raise RuntimeError(f'Failed to fetch {self.name} stations')
+        return CatalogSnapshot(stations, self.index_attributes)
+
+    def restore(self):
+        # The last snapshot saved by any process, spatial index included, so a new process
+        # serves station lookups without waiting on NOAA
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            _check_private(os.path.dirname(self.snapshot_path))
+            _check_private(self.snapshot_path)
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = _SnapshotUnpickler(f).load()
+        except Exception as e:
+            print(f"Error restoring {self.name} stations: {str(e)}")
+            return False
+
+        self.snapshot = snapshot
+        self.source = 'snapshot'
+        return True
+
+    def save(self, snapshot):
+        if not self.snapshot_path:
+            return
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            _check_private(directory)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{self.name}-')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            print(f"Error saving {self.name} stations: {str(e)}")
+
+    def refresh(self):
+        self.last_attempt = time.time()
+        try:
+            snapshot = self.load()
+        except Exception as e:
+            # Keep serving the previous snapshot, if any
+            self.last_error = str(e)
+            self.consecutive_failures += 1
+            print(f"Error refreshing {self.name} stations: {str(e)}")
+            return False
+
+        self.snapshot = snapshot
+        self.source = 'upstream'
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.refresh_count += 1
+        self.save(snapshot)
+        return True
+
+    def age(self):
+        snapshot = self.snapshot
+        return time.time() - snapshot.loaded_at if snapshot else None
+
+    def stats(self, max_age):
+        snapshot = self.snapshot
+        stats = {
+            'loaded': snapshot is not None,
+            'station_count': len(snapshot.by_id) if snapshot else 0,
+            'loaded_at': None,
+            'age_seconds': None,
+            'stale': True,
+            'source': self.source,
+            'refresh_count': self.refresh_count,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error
+        }
+        if snapshot:
+            age = time.time() - snapshot.loaded_at
+            stats['loaded_at'] = datetime.fromtimestamp(snapshot.loaded_at, pytz.UTC).isoformat()
+            stats['age_seconds'] = round(age, 1)
+            stats['stale'] = age > max_age
+        return stats
+
+
+class StationCatalog:
+    def __init__(self, refresh_interval=21600, retry_interval=300, upstream_limiter=None, snapshot_dir=None):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+
+        def snapshot_path(name):
+            return os.path.join(snapshot_dir, f'{name}.pickle') if snapshot_dir else None
+
+        self._entries = {
+            'buoy': _CatalogEntry(
+                'buoy', BuoyStations, ('active', 'buoy_type'), upstream_limiter, snapshot_path('buoy')
+            ),
+            'tide': _CatalogEntry('tide', TideStations, (), upstream_limiter, snapshot_path('tide'))
+        }
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='station-catalog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def restore(self):
+        # Loads the saved snapshots; cheap enough to do on every boot
+        results = {}
+        for name, entry in self._entries.items():
+            with entry.load_lock:
+                results[name] = entry.restore()
+        return results
+
+    def preload(self):
+        # Restores what it can and fetches the rest inline, so a pre-fork master hands every
+        # worker a loaded catalog
+        for name, restored in self.restore().items():
+            if not restored:
+                self._snapshot(name)
+
+    def refresh(self):
+        results = {}
+        for name, entry in self._entries.items():
+            with entry.load_lock:
+                results[name] = entry.refresh()
+        return results
+
+    def _run(self):
+        # A restored snapshot is only refreshed once it reaches the refresh interval
+        ages = [entry.age() for entry in self._entries.values()]
+        delay = 0 if None in ages else max(0, self.refresh_interval - max(ages))
+        while not self._stop.wait(delay):
+            results = self.refresh()
+            delay = self.refresh_interval if all(results.values()) else self.retry_interval
+
+    def _snapshot(self, name):
+        entry = self._entries[name]
+        snapshot = entry.snapshot
+        if snapshot is None:
+            # Nothing loaded yet: load inline, letting concurrent callers wait on one fetch
+            with entry.load_lock:
+                if entry.snapshot is None:
+                    entry.refresh()
+                snapshot = entry.snapshot
+        return snapshot
+
+    def buoy_snapshot(self):
+        return self._snapshot('buoy')
+
+    def tide_snapshot(self):
+        return self._snapshot('tide')
+
+    def buoy_stations(self):
+        snapshot = self.buoy_snapshot()
+        return snapshot.stations if snapshot else None
+
+    def tide_stations(self):
+        snapshot = self.tide_snapshot()
+        return snapshot.stations if snapshot else None
+
+    def find_buoy_station(self, station_id):
+        snapshot = self.buoy_snapshot()
+        return snapshot.find_station(station_id) if snapshot else None
+
+    def find_tide_station(self, station_id):
+        snapshot = self.tide_snapshot()
+        return snapshot.find_station(station_id) if snapshot else None
+
+    def stats(self):
+        return {name: entry.stats(self.refresh_interval) for name, entry in self._entries.items()}
+
+
+def get_station_catalog():
+    return current_app.extensions['station_catalog']
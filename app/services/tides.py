@@ -0,0 +1,239 @@
+import math
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pytz
+from surfpy import TideStation
+
+from .cache import get_cache
+from .fanout import get_fanout
+from .harmonics import get_harmonic_store
+from .metrics import span
+from .rate_limit import UpstreamBudgetExceeded, get_upstream_limiter
+from .station_catalog import get_station_catalog
+
+# Datums to try, in order of preference
+TIDE_DATUMS = [
+    TideStation.TideDatum.mean_lower_low_water,
+    TideStation.TideDatum.mean_sea_level,
+    TideStation.TideDatum.mean_tide_level
+]
+
+# What fetch_tide_data returns when upstream answered that it has no predictions for the
+# datum, as opposed to None for a failed fetch
+NO_TIDE_DATA = ()
+
+# Curve resolutions for ?interval=, in seconds
+TIDE_INTERVALS = {
+    '6min': 6 * 60,
+    '15min': 15 * 60,
+    'hourly': 60 * 60
+}
+
+# Fetch this much beyond the requested window so the curve has a high or low on both sides
+CURVE_PADDING = timedelta(hours=13)
+
+
+def as_utc(date):
+    if date.tzinfo is None:
+        return pytz.UTC.localize(date)
+    return date.astimezone(pytz.UTC)
+
+
+def tide_days(start_time, end_time):
+    # UTC calendar days touched by [start_time, end_time]
+    first_day = as_utc(start_time).date()
+    last_day = as_utc(end_time).date()
+    return [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+
+
+def day_start(day):
+    return datetime.combine(day, time.min, tzinfo=pytz.UTC)
+
+
+def _day_key(station_id, datum, day):
+    return f'tide:day:{station_id}:{datum}:{day.isoformat()}'
+
+
+def fetch_tide_days(station_id, first_day, last_day, datum):
+    # One upstream call covering whole UTC days, split back into per-day buckets
+    try:
+        station = get_station_catalog().find_tide_station(station_id)
+
+        if not station:
+            return None
+
+        with get_upstream_limiter().slot('tide') as call:
+            result = station.fetch_tide_data(
+                day_start(first_day),
+                day_start(last_day + timedelta(days=1)),
+                datum=datum,
+                interval=TideStation.DataInterval.high_low
+            )
+            if not result:
+                call.fail()
+        if not result:
+            # Upstream answered, with nothing: cached like a miss, but kept apart from errors
+            return {}
+
+        tide_events, tide_data = result
+        days = {}
+        day = first_day
+        while day <= last_day:
+            days[day] = ([], [])
+            day += timedelta(days=1)
+
+        for position, readings in enumerate((tide_events, tide_data)):
+            for reading in readings or []:
+                bucket = days.get(as_utc(reading.date).date())
+                if bucket is not None:
+                    bucket[position].append(reading)
+
+        return days
+    except UpstreamBudgetExceeded:
+        raise
+    except Exception as e:
+        print(f"Error fetching tide data: {str(e)}")
+        return None
+
+
+def harmonic_model(station_id, datum=None):
+    # The station's harmonic model if it can predict in `datum` (any datum if None)
+    model = get_harmonic_store().model(station_id)
+    if model is None or (datum is not None and not model.has_datum(datum)):
+        return None
+    return model
+
+
+def fetch_tide_data(station_id, start_time, end_time, datum):
+    # Stations with published constituents are predicted locally; the rest go upstream
+    model = harmonic_model(station_id, datum)
+    if model is not None:
+        with span('harmonics'):
+            return model.tide_events(as_utc(start_time), as_utc(end_time), datum), []
+
+    cache = get_cache()
+    days = tide_days(start_time, end_time)
+
+    cached_days = {}
+    for day in days:
+        bucket = cache.get(_day_key(station_id, datum, day))
+        if bucket is not None:
+            cached_days[day] = bucket
+
+    missing = [day for day in days if day not in cached_days]
+    if missing:
+        first_day, last_day = missing[0], missing[-1]
+        # Identical concurrent misses share one upstream call for the missing range. The range
+        # entry itself only needs to outlive the fetch; the per-day entries are the real cache.
+        try:
+            fetched = cache.get_or_load(
+                f'tide:range:{station_id}:{datum}:{first_day.isoformat()}:{last_day.isoformat()}',
+                lambda: fetch_tide_days(station_id, first_day, last_day, datum),
+                ttl=cache.negative_ttl
+            )
+        except UpstreamBudgetExceeded:
+            # Out of budget: expired day buckets are still good predictions
+            stale = {day: cache.get(_day_key(station_id, datum, day), allow_stale=True) for day in missing}
+            if any(bucket is None for bucket in stale.values()):
+                raise
+            cached_days.update(stale)
+            fetched = None
+        else:
+            if fetched is None:
+                return None
+            if not fetched:
+                return NO_TIDE_DATA
+
+            for day, bucket in fetched.items():
+                cache.set(_day_key(station_id, datum, day), bucket, 'tide')
+            cached_days.update(fetched)
+
+    # Slice the requested window out of the cached days
+    start_time = as_utc(start_time)
+    end_time = as_utc(end_time)
+    tide_events, tide_data = [], []
+    for day in days:
+        events, data = cached_days[day]
+        tide_events.extend(event for event in events if start_time <= as_utc(event.date) <= end_time)
+        tide_data.extend(pred for pred in data if start_time <= as_utc(pred.date) <= end_time)
+
+    return tide_events, tide_data
+
+
+def fetch_tide_data_any_datum(station_id, start_time, end_time, datums=TIDE_DATUMS):
+    # Returns (result, datum) for the most preferred datum the station supports
+    model = harmonic_model(station_id)
+    if model is not None:
+        for datum in datums:
+            if model.has_datum(datum):
+                return fetch_tide_data(station_id, start_time, end_time, datum), datum
+
+    snapshot = get_station_catalog().tide_snapshot()
+    known = snapshot.datums.get(station_id) if snapshot else None
+    if known:
+        result = fetch_tide_data(station_id, start_time, end_time, known)
+        if result:
+            return result, known
+
+    def probe(datum):
+        # The fan-out reports exceptions as strings; keep this one to re-raise it here
+        try:
+            return fetch_tide_data(station_id, start_time, end_time, datum)
+        except UpstreamBudgetExceeded as e:
+            return e
+
+    # First contact (or the learned datum failed): probe every datum at once
+    results = get_fanout().map(probe, datums)
+    definitive = True
+    for datum in datums:
+        result, _ = results[datum]
+        if isinstance(result, UpstreamBudgetExceeded):
+            raise result
+        if result:
+            # Only learned once every preferred datum said it has no data; after a timeout or
+            # error the preferred one is probed again next time
+            if snapshot and definitive:
+                snapshot.datums[station_id] = datum
+            return result, datum
+        definitive = definitive and result is NO_TIDE_DATA
+
+    return None, None
+
+
+def sample_times(start_time, end_time, step):
+    # Every `step` seconds on the clock (e.g. :00, :06, :12) within the window
+    first = math.ceil(as_utc(start_time).timestamp() / step) * step
+    return np.arange(first, as_utc(end_time).timestamp() + 1, step, dtype=np.float64)
+
+
+def tide_curve(tide_events, start_time, end_time, step):
+    # Cosine interpolation between consecutive highs and lows, sampled every `step` seconds.
+    # Returns (epoch seconds, heights) as arrays.
+    points = sorted(
+        (as_utc(event.date).timestamp(), event.water_level)
+        for event in tide_events if event.water_level is not None
+    )
+    times = np.array([when for when, _ in points], dtype=np.float64)
+    heights = np.array([height for _, height in points], dtype=np.float64)
+    if len(times) > 1:
+        keep = np.concatenate(([True], np.diff(times) > 0))
+        times, heights = times[keep], heights[keep]
+
+    samples = sample_times(start_time, end_time, step)
+    position = np.searchsorted(times, samples, side='right') - 1
+    inside = (position >= 0) & (position < len(times) - 1)
+    samples, position = samples[inside], position[inside]
+
+    t0, t1 = times[position], times[position + 1]
+    h0, h1 = heights[position], heights[position + 1]
+    phase = (samples - t0) / (t1 - t0)
+    return samples, h0 + (h1 - h0) * (1 - np.cos(np.pi * phase)) / 2
+
+
+def curve_predictions(samples, heights, datum):
+    timestamps = np.datetime_as_string(samples.astype('datetime64[s]'), unit='s')
+    return [
+        {'timestamp': f'{timestamp}+00:00', 'height': height, 'datum': datum}
+        for timestamp, height in zip(timestamps.tolist(), np.round(heights, 3).tolist())
+    ]
@@ -0,0 +1,122 @@
+import numpy as np
+import surfpy
+from flask import current_app
+
+
+def _model_factories():
+    # Every wave model factory surfpy ships, keyed by its name without the suffix
+    # (us_west_coast_gfs_wave_model -> us_west_coast), as used on the command line
+    factories = {}
+    for attribute in sorted(dir(surfpy)):
+        factory = getattr(surfpy, attribute)
+        if attribute.endswith('_wave_model') and callable(factory):
+            factories[attribute[:-len('_wave_model')].removesuffix('_gfs')] = factory
+    return factories
+
+
+# Wave models served by the API, keyed by the name used on the command line and in config
+WAVE_MODELS = _model_factories()
+
+
+class GridExtent:
+    # A model's coverage: latitudes south..north and span degrees east of west (0-360
+    # longitudes, possibly across the antimeridian)
+    def __init__(self, south, north, west, east, resolution):
+        self.south = south
+        self.north = north
+        self.west = west % 360
+        span = (east % 360) - self.west
+        if span <= 0:
+            span += 360
+        # A grid whose last column is one cell short of wrapping around is global
+        self.span = 360.0 if span + resolution >= 360 else span
+        self.resolution = resolution
+        self.area = (north - south) * self.span
+
+    @classmethod
+    def of(cls, model):
+        bottom_left, top_right = model.bottom_left, model.top_right
+        return cls(
+            bottom_left.latitude,
+            top_right.latitude,
+            bottom_left.longitude,
+            top_right.longitude,
+            getattr(model, 'location_resolution', None) or float('inf')
+        )
+
+    def contains(self, latitude, longitude):
+        return self.south <= latitude <= self.north and (longitude - self.west) % 360 <= self.span
+
+    def cell_mask(self):
+        # (180, 360) booleans: which one-degree cells the extent touches
+        rows = np.arange(-90, 90)
+        columns = np.arange(360)
+        lat = (rows <= self.north) & (rows + 1 >= self.south)
+        lon = ((columns - self.west) % 360 <= self.span) | ((self.west - columns) % 360 <= 1)
+        return np.outer(lat, lon)
+
+    def describe(self):
+        return {
+            'south': self.south,
+            'north': self.north,
+            'west': self.west,
+            'east': (self.west + self.span) % 360 if self.span < 360 else self.west + 360,
+            'resolution': self.resolution
+        }
+
+
+class WaveModelRegistry:
+    # Picks the finest grid containing a point. Models are ranked by resolution, then area,
+    # and every one-degree cell keeps the ranked models touching it, so a lookup checks
+    # only the few grids around the point. A global grid touches every cell and ends up as
+    # the fallback; a point no grid covers gets None.
+    def __init__(self, factories):
+        models = []
+        for name, factory in factories.items():
+            model = factory()
+            try:
+                extent = GridExtent.of(model)
+            except AttributeError as e:
+                print(f"Error indexing wave model {name}: {str(e)}")
+                continue
+            models.append((name, model, extent))
+        models.sort(key=lambda entry: (entry[2].resolution, entry[2].area))
+        self.models = models
+
+        codes = np.zeros((180, 360), dtype=np.int64)
+        for rank, (_, _, extent) in enumerate(models):
+            codes |= extent.cell_mask().astype(np.int64) << rank
+        combinations, self._cells = np.unique(codes, return_inverse=True)
+        self._cells = self._cells.reshape(codes.shape)
+        self._candidates = [
+            [(model, extent) for rank, (_, model, extent) in enumerate(models) if int(code) >> rank & 1]
+            for code in combinations
+        ]
+
+    def select(self, location):
+        latitude = location.latitude
+        longitude = location.absolute_longitude % 360
+        row = min(max(int(np.floor(latitude)) + 90, 0), 179)
+        column = int(longitude) % 360
+        for model, extent in self._candidates[self._cells[row, column]]:
+            if extent.contains(latitude, longitude):
+                return model
+        return None
+
+    def stats(self):
+        return [
+            dict(name=name, model=model.name, **extent.describe())
+            for name, model, extent in self.models
+        ]
+
+
+def create_wave_models(config):
+    return WaveModelRegistry(WAVE_MODELS)
+
+
+def get_wave_models():
+    return current_app.extensions['wave_models']
+
+
+def select_model(location):
+    return get_wave_models().select(location)
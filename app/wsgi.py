@@ -0,0 +1,26 @@
+from app.config import Config
+
+# WSGI entry point for external servers, e.g. `gunicorn -k gevent app.wsgi:app`. With
+# SERVER_PRELOAD set, run `gunicorn -k gevent -c python:app.wsgi app.wsgi:app` instead: this
+# module then also serves as the gunicorn config, preloading the app in the master and
+# starting its background threads in each worker from post_fork, as app/serve.py does.
+if Config.SERVER_PRELOAD and Config.SERVER_WORKER_CLASS == 'gevent':
+    # The app loads in the master, so the master patches before it does
+    from gevent import monkey
+    monkey.patch_all()
+
+from app.run import create_app, preload, start_background
+
+preload_app = Config.SERVER_PRELOAD
+
+if preload_app:
+    app = create_app(start=False)
+    preload(app)
+else:
+    app = create_app()
+
+
+def post_fork(server, worker):
+    # The preloaded app's background threads stayed behind in the master
+    if preload_app:
+        start_background(app)
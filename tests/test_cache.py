@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from app.services.cache import Cache, MemoryBackend
+from app.services.rate_limit import UpstreamBudgetExceeded
+
+CALLERS = 8
+
+
+class BrokenBackend(MemoryBackend):
+    def get(self, key, allow_stale=False):
+        raise ConnectionError('backend unreachable')
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        raise ConnectionError('backend unreachable')
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def run_callers(cache, key, loader, count=CALLERS):
+    # Starts `count` threads calling get_or_load; returns ({caller: value or error}, threads)
+    results = {}
+
+    def call(caller):
+        try:
+            results[caller] = cache.get_or_load(key, loader)
+        except Exception as e:
+            results[caller] = e
+
+    threads = [threading.Thread(target=call, args=(caller,)) for caller in range(count)]
+    for thread in threads:
+        thread.start()
+    return results, threads
+
+
+def test_concurrent_callers_share_one_load():
+    cache = Cache(MemoryBackend())
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(threading.get_ident())
+        release.wait(5)
+        return 'value'
+
+    results, threads = run_callers(cache, 'buoy:42', loader)
+    wait_until(lambda: cache.stats()['coalesced'] == CALLERS - 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert list(results.values()) == ['value'] * CALLERS
+    assert cache.stats()['in_flight'] == 0
+    assert cache.get_or_load('buoy:42', loader) == 'value'
+    assert len(calls) == 1
+
+
+def test_waiters_get_the_leaders_error():
+    cache = Cache(MemoryBackend())
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        raise RuntimeError('upstream failed')
+
+    results, threads = run_callers(cache, 'buoy:42', loader)
+    wait_until(lambda: cache.stats()['coalesced'] == CALLERS - 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results.values())
+    assert cache.stats()['load_errors'] == 1
+
+
+def test_waiter_loads_itself_after_load_wait():
+    cache = Cache(MemoryBackend(), load_wait=0.05)
+    release = threading.Event()
+    started = threading.Event()
+
+    def stuck_loader():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    results, threads = run_callers(cache, 'tide:1', stuck_loader, count=1)
+    started.wait(5)
+
+    assert cache.get_or_load('tide:1', lambda: 'fast') == 'fast'
+    stats = cache.stats()
+    assert stats['wait_timeouts'] == 1
+    assert stats['loads'] == 2
+    assert stats['in_flight'] == 1
+
+    release.set()
+    threads[0].join()
+    assert results[0] == 'slow'
+    assert cache.stats()['in_flight'] == 0
+
+
+def test_failed_load_is_cached_as_negative():
+    cache = Cache(MemoryBackend())
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return None
+
+    assert cache.get_or_load('buoy:1', loader) is None
+    assert cache.get_or_load('buoy:1', loader) is None
+    assert len(calls) == 1
+    assert cache.stats()['negative_hits'] == 1
+
+
+def test_budget_exceeded_serves_a_stale_value():
+    cache = Cache(MemoryBackend(), default_ttl=0, stale_ttl=60)
+    cache.set('tide:1', 'old')
+
+    def loader():
+        raise UpstreamBudgetExceeded('tide', 30)
+
+    assert cache.get_or_load('tide:1', loader) == 'old'
+    assert cache.stats()['stale_served'] == 1
+
+    with pytest.raises(UpstreamBudgetExceeded):
+        cache.get_or_load('tide:2', loader)
+
+
+def test_backend_errors_still_return_the_loaded_value():
+    cache = Cache(BrokenBackend())
+
+    assert cache.get_or_load('buoy:1', lambda: 'value') == 'value'
+    assert cache.get('buoy:1', default='missing') == 'missing'
+    assert cache.stats()['backend_errors'] == 3
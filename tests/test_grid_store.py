@@ -0,0 +1,199 @@
+import os
+import sys
+import types
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.services.grid_store import GridStore, _corners, _interpolate
+
+RUN_TIME = datetime(2026, 10, 17)
+GRID = {
+    'latitudeOfFirstGridPointInDegrees': 0,
+    'longitudeOfFirstGridPointInDegrees': 280,
+    'jDirectionIncrementInDegrees': 0.5,
+    'iDirectionIncrementInDegrees': 0.5,
+    'jScansPositively': 1,
+    'Nj': 4,
+    'Ni': 3
+}
+
+
+class FakeMessage:
+    def __init__(self, name, valid_date, value):
+        self.shortName = name
+        self.typeOfLevel = 'surface'
+        self.level = 0
+        self.validDate = valid_date
+        self.values = np.ma.masked_invalid(np.full((GRID['Nj'], GRID['Ni']), value))
+
+    def __getitem__(self, key):
+        return GRID[key]
+
+
+class FakeGribFile:
+    # Each file is named after its forecast hour; its swh field is the hour everywhere
+    def __init__(self, path):
+        name = os.path.basename(path)
+        if name.startswith('bad'):
+            raise RuntimeError('truncated GRIB message')
+        self.hour = int(name)
+
+    def __iter__(self):
+        valid_date = RUN_TIME + timedelta(hours=self.hour)
+        return iter([FakeMessage('swh', valid_date, float(self.hour))])
+
+    def close(self):
+        pass
+
+
+class FakeGribStore:
+    def __init__(self, root):
+        self.root = root
+        self.failed = set()
+        self.corrupt = set()
+        self.fetched = []
+
+    def run_id(self, model):
+        return RUN_TIME.strftime('%Y%m%d%H')
+
+    def fetch_grib_paths(self, model, start_index, end_index):
+        paths = []
+        for index in range(start_index, end_index):
+            self.fetched.append(index)
+            if index in self.failed:
+                paths.append(None)
+                continue
+            path = os.path.join(self.root, f'bad{index}' if index in self.corrupt else str(index))
+            open(path, 'w').close()
+            paths.append(path)
+        return paths
+
+
+class FakeModel:
+    name = 'test'
+
+
+GLOBAL_GRID = {'lat_first': 0.0, 'lon_first': 0.0, 'dlat': 1.0, 'dlon': 90.0, 'nlat': 2, 'nlon': 4}
+REGIONAL_GRID = {'lat_first': 0.0, 'lon_first': 280.0, 'dlat': 0.5, 'dlon': 0.5, 'nlat': 4, 'nlon': 3}
+
+
+@pytest.fixture
+def grib_store(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pygrib', types.SimpleNamespace(open=FakeGribFile))
+    os.makedirs(tmp_path / 'grib')
+    return FakeGribStore(str(tmp_path / 'grib'))
+
+
+@pytest.fixture
+def grid_store(tmp_path, grib_store):
+    return GridStore(str(tmp_path / 'grids'), grib_store)
+
+
+def test_build_stops_at_a_failed_download(grid_store, grib_store):
+    grib_store.failed = {3}
+    grid_run = grid_store.ensure(FakeModel(), 6)
+
+    assert grid_run.end_index == 3
+    assert not grid_run.covers(6)
+    assert list(grid_run.indexes) == [0, 1, 2]
+
+
+def test_build_stops_at_an_undecodable_hour(grid_store, grib_store):
+    grib_store.corrupt = {2}
+    grid_run = grid_store.ensure(FakeModel(), 6)
+
+    assert grid_run.end_index == 2
+    assert list(grid_run.variables['swh'][:, 0, 0]) == [0.0, 1.0]
+
+
+def test_failed_hour_is_fetched_again(grid_store, grib_store):
+    grib_store.failed = {3}
+    grid_store.ensure(FakeModel(), 6)
+
+    grib_store.failed = set()
+    grib_store.fetched = []
+    grid_run = grid_store.ensure(FakeModel(), 6)
+
+    assert grib_store.fetched == [3, 4, 5]
+    assert grid_run.end_index == 6
+    assert list(grid_run.variables['swh'][:, 0, 0]) == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_extension_with_nothing_new_keeps_the_existing_build(grid_store, grib_store):
+    grid_store.ensure(FakeModel(), 3)
+    builds = grid_store.builds
+
+    grib_store.failed = {3, 4, 5}
+    grid_run = grid_store.ensure(FakeModel(), 6)
+
+    assert grid_store.builds == builds
+    assert grid_run.end_index == 3
+    assert not grid_run.covers(6)
+
+
+def test_complete_build_with_a_gap_is_not_complete(grid_store, grib_store):
+    grib_store.failed = {4}
+    paths = grib_store.fetch_grib_paths(FakeModel(), 0, 6)
+    grid_store.build(FakeModel(), grib_store.run_id(None), list(zip(range(6), paths)), 6, complete=True)
+    grid_run = grid_store.load(FakeModel(), grib_store.run_id(None))
+
+    assert grid_run.end_index == 4
+    assert not grid_run.meta['complete']
+
+
+def test_extension_reuses_the_base_build(grid_store, grib_store):
+    grid_store.ensure(FakeModel(), 3)
+    grib_store.fetched = []
+    grid_run = grid_store.ensure(FakeModel(), 6)
+
+    assert grib_store.fetched == [3, 4, 5]
+    assert grid_run.end_index == 6
+    assert list(grid_run.variables['swh'][:, 1, 2]) == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+@pytest.mark.parametrize('longitude', [315.0, -45.0, 675.0])
+def test_corners_wrap_across_the_seam(longitude):
+    row_index, col_index, weights, inside = _corners(GLOBAL_GRID, [0.5], [longitude])
+
+    assert inside[0]
+    assert list(row_index[0]) == [0, 0, 1, 1]
+    assert list(col_index[0]) == [3, 0, 3, 0]
+    assert weights[0] == pytest.approx([0.25, 0.25, 0.25, 0.25])
+
+
+def test_corners_on_a_grid_point_take_all_its_weight():
+    row_index, col_index, weights, inside = _corners(REGIONAL_GRID, [1.0], [281.0])
+
+    assert inside[0]
+    corner = int(np.argmax(weights[0]))
+    assert (row_index[0][corner], col_index[0][corner]) == (2, 2)
+    assert weights[0].sum() == pytest.approx(1.0)
+    assert weights[0][corner] == pytest.approx(1.0)
+
+
+def test_corners_outside_a_regional_grid():
+    # East of the last column, south of the first row, and west of the first column
+    _, _, _, inside = _corners(REGIONAL_GRID, [0.5, -0.5, 0.5], [281.5, 280.5, 279.5])
+
+    assert not inside.any()
+
+
+def test_interpolate_weights_only_wet_corners():
+    weights = np.array([0.4, 0.3, 0.2, 0.1])
+    corners = np.array([[1.0, np.nan, 3.0, np.nan], [np.nan] * 4, [1.0, 2.0, 3.0, 4.0]])
+
+    result = _interpolate('swh', corners, weights)
+    assert result[0] == pytest.approx((0.4 * 1.0 + 0.2 * 3.0) / 0.6)
+    assert np.isnan(result[1])
+    assert result[2] == pytest.approx(2.0)
+
+
+def test_interpolate_directions_take_the_circular_mean():
+    weights = np.array([0.25, 0.25, 0.25, 0.25])
+    corners = np.array([[350.0, 10.0, np.nan, np.nan], [np.nan] * 4])
+
+    result = _interpolate('dirpw', corners, weights)
+    assert min(result[0], 360 - result[0]) == pytest.approx(0.0, abs=1e-9)
+    assert np.isnan(result[1])
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+import pytz
+
+from app.services.harmonics import (CONSTITUENTS, HIGH_TIDE, LOW_TIDE, NODAL_KEYS, HarmonicModel,
+                                    astronomical_arguments, nodal_corrections)
+
+DAY = datetime(2026, 10, 17, tzinfo=pytz.UTC)
+DATUMS = {'MSL': 1.2, 'MLLW': 0.0}
+
+
+def make_model(*constituents):
+    return HarmonicModel({
+        'station_id': '9413450',
+        'constituents': [
+            {'name': name, 'amplitude': amplitude, 'phase': phase, 'speed': speed}
+            for name, amplitude, phase, speed in constituents
+        ],
+        'datums': DATUMS
+    })
+
+
+def test_solar_tide_matches_its_harmonic_series():
+    # S2 has no nodal correction and its argument is 30 degrees per hour from midnight UTC,
+    # so the prediction is exactly MSL + A cos(30t - g)
+    amplitude, phase = 0.5, 60.0
+    model = make_model(('S2', amplitude, phase, 30.0), ('S1', 0.0, 0.0, 15.0))
+    hours = np.arange(0, 48, 0.25)
+    times = DAY.timestamp() + hours * 3600
+
+    expected = DATUMS['MSL'] + amplitude * np.cos(np.radians(30.0 * hours - phase))
+    assert model.predict(times, 'MLLW') == pytest.approx(expected, abs=1e-9)
+    assert model.predict(times, 'MSL') == pytest.approx(expected - DATUMS['MSL'], abs=1e-9)
+
+
+def test_solar_tide_events_fall_on_the_series_extrema():
+    model = make_model(('S2', 0.5, 60.0, 30.0))
+    events = model.tide_events(DAY, DAY + timedelta(days=1), 'MLLW')
+
+    assert [(event.date.hour, event.date.minute, event.tidal_event) for event in events] == [
+        (2, 0, HIGH_TIDE), (8, 0, LOW_TIDE), (14, 0, HIGH_TIDE), (20, 0, LOW_TIDE)
+    ]
+    assert [event.water_level for event in events] == [1.7, 0.7, 1.7, 0.7]
+    assert all(event.water_level_datum == 'MLLW' for event in events)
+
+
+def test_lunar_tide_repeats_at_its_period():
+    # Over one M2 period the equilibrium argument and nodal terms barely move
+    speed = 28.9841042
+    model = make_model(('M2', 1.0, 100.0, speed))
+    period = 360.0 / speed * 3600
+    times = DAY.timestamp() + np.arange(0, 86400, 600, dtype=np.float64)
+
+    assert model.predict(times + period, 'MSL') == pytest.approx(model.predict(times, 'MSL'), abs=1e-3)
+
+    events = model.tide_events(DAY, DAY + timedelta(days=3), 'MSL')
+    highs = [event.date.timestamp() for event in events if event.tidal_event == HIGH_TIDE]
+    assert np.diff(highs) == pytest.approx(period, abs=60)
+
+
+def test_unknown_and_zero_constituents_are_dropped():
+    model = make_model(('M2', 1.0, 0.0, 28.9841042), ('K1', 0.0, 0.0, 15.0410686), ('XX', 1.0, 0.0, 1.0))
+
+    assert model.names == ['M2']
+    assert not make_model(('K1', 0.0, 0.0, 15.0410686))
+    assert model.has_datum('MLLW')
+    assert not model.has_datum('MHHW')
+
+
+def test_every_constituent_speed_follows_its_arguments():
+    # d/dt of each equilibrium argument, from the astronomical argument rates, is the
+    # constituent's published speed in degrees per hour
+    hour = 3600.0
+    rates = (astronomical_arguments([DAY.timestamp() + hour]) - astronomical_arguments([DAY.timestamp()]))[:, 0]
+    speeds = {'M2': 28.9841042, 'S2': 30.0, 'N2': 28.4397295, 'K1': 15.0410686, 'O1': 13.9430356,
+              'P1': 14.9589314, 'K2': 30.0821373, 'Q1': 13.3986609, 'MF': 1.0980331, 'MM': 0.5443747}
+    for name, speed in speeds.items():
+        assert np.dot(CONSTITUENTS[name][0], rates) == pytest.approx(speed, abs=1e-4)
+
+
+@pytest.mark.parametrize('key, low, high', [
+    ('M2', 0.963, 1.038),
+    ('K1', 0.882, 1.113),
+    ('O1', 0.806, 1.183),
+    ('K2', 0.748, 1.317),
+    ('MF', 0.629, 1.457),
+    ('MM', 0.870, 1.130)
+])
+def test_nodal_factors_span_schureman_ranges(key, low, high):
+    f, _ = nodal_corrections(np.array([0.0, 180.0]))[key]
+    assert sorted(f) == pytest.approx([low, high], abs=2e-3)
+
+
+def test_nodal_angles_vanish_at_the_node_extremes():
+    corrections = nodal_corrections(np.array([0.0, 180.0]))
+    assert sorted(corrections) == NODAL_KEYS
+    for key in NODAL_KEYS:
+        assert corrections[key][1] == pytest.approx([0.0, 0.0], abs=1e-9)
+
+
+def test_nodal_angle_of_m2_peaks_near_two_degrees():
+    _, u = nodal_corrections(np.arange(0.0, 360.0, 1.0))['M2']
+    assert u.max() == pytest.approx(2.14, abs=0.01)
+    assert u.min() == pytest.approx(-2.14, abs=0.01)
@@ -0,0 +1,112 @@
+import math
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.spatial_index import EARTH_RADIUS, StationIndex
+
+
+def make_station(station_id, latitude, longitude, station_type):
+    location = SimpleNamespace(latitude=latitude, longitude=longitude)
+    return SimpleNamespace(station_id=station_id, location=location, station_type=station_type)
+
+
+def haversine(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, (a.latitude, a.longitude, b.latitude, b.longitude))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def brute_force(stations, location, station_type=None):
+    return sorted(
+        (haversine(location, station.location), station.station_id)
+        for station in stations if station_type is None or station.station_type == station_type
+    )
+
+
+@pytest.fixture(scope='module')
+def stations():
+    generator = random.Random(7)
+    stations = [
+        make_station(str(index), math.degrees(math.asin(generator.uniform(-1, 1))),
+                     generator.uniform(-180, 180), generator.choice(['buoy', 'tide']))
+        for index in range(1000)
+    ]
+    # Clusters along the antimeridian and near the pole, where lat/lon boxes go wrong
+    stations.extend(
+        make_station(f'dateline{index}', generator.uniform(-10, 10),
+                     generator.choice([-1, 1]) * generator.uniform(179, 180), 'buoy')
+        for index in range(50)
+    )
+    stations.extend(
+        make_station(f'pole{index}', generator.uniform(88, 90), generator.uniform(-180, 180), 'tide')
+        for index in range(50)
+    )
+    return stations
+
+
+@pytest.fixture(scope='module')
+def index(stations):
+    return StationIndex(stations, attributes=('station_type',))
+
+
+QUERIES = [
+    SimpleNamespace(latitude=36.6, longitude=-121.9),
+    SimpleNamespace(latitude=0.0, longitude=179.9),
+    SimpleNamespace(latitude=0.0, longitude=-179.9),
+    SimpleNamespace(latitude=89.9, longitude=45.0),
+    SimpleNamespace(latitude=-45.0, longitude=0.0)
+]
+
+
+@pytest.mark.parametrize('location', QUERIES)
+def test_nearest_matches_brute_force(stations, index, location):
+    expected = brute_force(stations, location)[:10]
+    result = index.nearest(location, count=10)
+
+    assert [station.station_id for station, _ in result] == [station_id for _, station_id in expected]
+    for (_, distance), (expected_distance, _) in zip(result, expected):
+        assert distance == pytest.approx(expected_distance, abs=1.0)
+
+
+@pytest.mark.parametrize('location', QUERIES)
+def test_within_matches_brute_force(stations, index, location):
+    radius = 1500000
+    expected = [station_id for distance, station_id in brute_force(stations, location) if distance <= radius]
+
+    assert [station.station_id for station, _ in index.within(location, radius)] == expected
+
+
+@pytest.mark.parametrize('location', QUERIES)
+def test_masked_search_matches_brute_force(stations, index, location):
+    expected = brute_force(stations, location, 'tide')
+    mask = index.select(station_type='tide')
+
+    result = index.nearest(location, count=5, mask=mask)
+    assert [station.station_id for station, _ in result] == [station_id for _, station_id in expected[:5]]
+
+    radius = expected[5][0] + 1.0
+    result = index.within(location, radius, mask=mask)
+    assert [station.station_id for station, _ in result] == [station_id for _, station_id in expected[:6]]
+
+
+def test_max_distance_limits_nearest(stations, index):
+    location = QUERIES[0]
+    expected = brute_force(stations, location)
+    max_distance = (expected[2][0] + expected[3][0]) / 2
+
+    result = index.nearest(location, count=10, max_distance=max_distance)
+    assert [station.station_id for station, _ in result] == [station_id for _, station_id in expected[:3]]
+
+
+def test_stations_without_a_location_are_skipped():
+    stations = [
+        make_station('a', 10, 10, 'buoy'),
+        SimpleNamespace(station_id='b', location=None, station_type='buoy')
+    ]
+    index = StationIndex(stations)
+
+    assert len(index) == 1
+    assert index.nearest(SimpleNamespace(latitude=0, longitude=0), count=5)[0][0].station_id == 'a'
+    assert StationIndex([]).nearest(SimpleNamespace(latitude=0, longitude=0)) == []